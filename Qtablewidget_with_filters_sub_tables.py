@@ -1,10 +1,24 @@
 from PyQt5.QtWidgets import QHeaderView, QPushButton, QWidget, QTableWidgetItem, QTableWidget, QApplication, \
     QVBoxLayout, QMainWindow, QComboBox, QFrame, QStyledItemDelegate, QDialog, QDialogButtonBox, QLabel, QLineEdit, \
-    QProxyStyle, QListView, QCheckBox, QHBoxLayout
+    QProxyStyle, QListView, QHBoxLayout, QTableView, QStyle, QStyleOptionViewItem, QStyleOptionButton, QCheckBox, \
+    QAbstractItemView
 from PyQt5.QtCore import Qt, QRect, pyqtSlot, QMimeData, QByteArray, pyqtSignal, QEvent, QPoint, QObject, QPointF, \
-    pyqtProperty
+    pyqtProperty, QAbstractTableModel, QAbstractItemModel, QModelIndex, QAbstractListModel, QTimer
 import sys
+import os
+import csv
 import time
+import re
+import heapq
+import json
+import queue
+import sqlite3
+import threading
+import functools
+from collections import deque
+from itertools import islice, chain
+from bisect import bisect_left
+from datetime import datetime, timezone
 
 from PyQt5.QtGui import QCursor, QDrag, QColor, QBrush, QFont, QPen, QPainterPath, QStandardItemModel, QStandardItem, \
     QPainter, QPolygonF, QPalette
@@ -12,13 +26,82 @@ from PyQt5.QtGui import QCursor, QDrag, QColor, QBrush, QFont, QPen, QPainterPat
 from typing import List, Union, Tuple
 
 
-# custom delegate for combo box items just to change the spacing in the combobox
+# item data role the header dropdowns keep the row count of each value in
+FILTER_COUNT_ROLE = Qt.UserRole + 1
+
+
+# custom delegate for combo box items just to change the spacing in the combobox, also draws the row count of the
+# filter values on the right of the item
 class ComboCustomDelegate(QStyledItemDelegate):
     def sizeHint(self, option, index):
         size = super().sizeHint(option, index)
         size.setHeight(20)  # Adjust the height as needed
         return size
 
+    def paint(self, painter, option, index):
+        super().paint(painter, option, index)
+        count = index.data(FILTER_COUNT_ROLE)
+        if count is None:
+            return
+
+        painter.save()
+        painter.setPen(option.palette.color(QPalette.Disabled, QPalette.Text))
+        painter.drawText(option.rect.adjusted(0, 0, -6, 0), Qt.AlignRight | Qt.AlignVCenter, str(count))
+        painter.restore()
+
+
+# delegate for checkbox columns, the check state is stored in the cell itself (Qt.CheckStateRole) and this draws it as a
+# checkbox in the middle of the cell and toggles it when clicked, instead of a QWidget + QCheckBox for every cell
+class CheckBoxDelegate(QStyledItemDelegate):
+    def checkbox_rect(self, option) -> QRect:
+        style = option.widget.style() if option.widget else QApplication.style()
+        width = style.pixelMetric(QStyle.PM_IndicatorWidth, option, option.widget)
+        height = style.pixelMetric(QStyle.PM_IndicatorHeight, option, option.widget)
+        return QRect(option.rect.x() + (option.rect.width() - width) // 2,
+                     option.rect.y() + (option.rect.height() - height) // 2, width, height)
+
+    def paint(self, painter, option, index):
+        item_option = QStyleOptionViewItem(option)
+        self.initStyleOption(item_option, index)
+        style = item_option.widget.style() if item_option.widget else QApplication.style()
+
+        # draw the cell background/selection without the default checkbox on the left
+        item_option.features &= ~QStyleOptionViewItem.HasCheckIndicator
+        item_option.text = ""
+        style.drawControl(QStyle.CE_ItemViewItem, item_option, painter, item_option.widget)
+
+        checkbox_option = QStyleOptionButton()
+        checkbox_option.rect = self.checkbox_rect(option)
+        checkbox_option.state = QStyle.State_Enabled
+        if index.data(Qt.CheckStateRole) == Qt.Checked:
+            checkbox_option.state |= QStyle.State_On
+        else:
+            checkbox_option.state |= QStyle.State_Off
+        style.drawPrimitive(QStyle.PE_IndicatorCheckBox, checkbox_option, painter, item_option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        flags = index.flags()
+        if not flags & Qt.ItemIsUserCheckable or not flags & Qt.ItemIsEnabled:
+            return False
+
+        if event.type() in (QEvent.MouseButtonRelease, QEvent.MouseButtonDblClick):
+            if event.button() != Qt.LeftButton or not self.checkbox_rect(option).contains(event.pos()):
+                return False
+            # eat double clicks so they don't toggle twice
+            if event.type() == QEvent.MouseButtonDblClick:
+                return True
+        elif event.type() == QEvent.KeyPress:
+            if event.key() not in (Qt.Key_Space, Qt.Key_Select):
+                return False
+        else:
+            return False
+
+        if index.data(Qt.CheckStateRole) == Qt.Checked:
+            state = Qt.Unchecked
+        else:
+            state = Qt.Checked
+        return model.setData(index, state, Qt.CheckStateRole)
+
 
 class ComboBox(QComboBox):
     # emit signal whenever an item is clicked on the qcomboboxes, this is for the filtering being changed on the qtablewidget
@@ -29,6 +112,10 @@ class ComboBox(QComboBox):
     # while a qcombobox is open
     popupOpened = pyqtSignal()
 
+    # emitted right before the popup is shown, the header fills in the dropdown items at this point if the column's
+    # data changed since they were last built
+    popupAboutToOpen = pyqtSignal()
+
     def __init__(self, parent):
         super().__init__(parent=parent)
         self.view().pressed.connect(self.handleItemPressed)
@@ -41,6 +128,9 @@ class ComboBox(QComboBox):
         # value for keeping combo dropdown open until clicked outside of it
         self._changed = False
 
+        # set by the header for columns with too many values for the combobox list, see FilterPopup
+        self.filter_popup = None
+
         self.setMouseTracking(True)
 
         self.view().viewport().installEventFilter(self)
@@ -86,6 +176,15 @@ class ComboBox(QComboBox):
         self._changed = False
 
     def showPopup(self):
+        self.popupAboutToOpen.emit()
+
+        # high cardinality columns show the searchable filter popup instead of the combobox list
+        if self.filter_popup is not None:
+            self.filter_popup.show_for(self)
+            self.popupOpened.emit()
+            return
+
+        app = QApplication.instance()
         # get animation status for combobox, then set it to false
         # this must be done, otherwise the combobox will appear in 1 location and then snap to the custom placement
         # afterwards because of the animation effect
@@ -107,6 +206,304 @@ class ComboBox(QComboBox):
         self.popupOpened.emit()
 
 
+# columns with more distinct values than this get the FilterPopup instead of a combobox list
+FILTER_POPUP_THRESHOLD = 1000
+# number of values measured to work out the width of the FilterPopup
+FILTER_POPUP_WIDTH_SAMPLE = 100
+FILTER_POPUP_MAX_WIDTH = 300
+
+
+# list model behind FilterPopup, just the sorted distinct values of a column and which of them match the search text.
+# Check states are read from the filter engine as rows are drawn, so nothing is built per value like QStandardItems
+class FilterValueModel(QAbstractListModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.column = 0
+        self.filter_engine = None
+        self.all_values = []
+        # value -> row count shown next to it, see ButtonHeaderView.populate_column_dropdown
+        self.counts = {}
+        # lower case copy of all_values for the search
+        self.lower_values = []
+        # indexes into all_values that match the search text
+        self.matches = range(0)
+        self.search_text = ""
+
+    def set_values(self, column: int, values: List[str], filter_engine, counts=None):
+        self.beginResetModel()
+        self.column = column
+        self.filter_engine = filter_engine
+        self.all_values = values
+        self.counts = counts if counts is not None else {}
+        self.lower_values = [value.lower() for value in values]
+        self.matches = range(len(values))
+        self.search_text = ""
+        self.endResetModel()
+
+    def set_search_text(self, text: str):
+        text = text.lower()
+        if text == self.search_text:
+            return
+
+        # typing more onto the search only has to look through what matched the last search
+        if self.search_text and self.search_text in text:
+            candidates = self.matches
+        else:
+            candidates = range(len(self.all_values))
+
+        self.beginResetModel()
+        if text:
+            lower_values = self.lower_values
+            self.matches = [i for i in candidates if text in lower_values[i]]
+        else:
+            self.matches = range(len(self.all_values))
+        self.search_text = text
+        self.endResetModel()
+
+    def matching_values(self) -> List[str]:
+        return [self.all_values[i] for i in self.matches]
+
+    def value(self, row: int) -> str:
+        return self.all_values[self.matches[row]]
+
+    # redraw the check states after the filter engine was changed
+    def refresh_check_states(self):
+        if self.matches:
+            self.dataChanged.emit(self.index(0), self.index(len(self.matches) - 1), [Qt.CheckStateRole])
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.matches)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        if role == Qt.DisplayRole:
+            return self.value(index.row())
+        if role == Qt.CheckStateRole:
+            if self.filter_engine.is_value_excluded(self.column, self.value(index.row())):
+                return Qt.Unchecked
+            return Qt.Checked
+        if role == FILTER_COUNT_ROLE:
+            return self.counts.get(self.value(index.row()))
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsUserCheckable
+
+
+# dropdown for high cardinality columns: a search box, buttons to check/uncheck everything that matches the search and
+# a list view with uniform item sizes so only the visible rows are ever laid out.  Changes go straight into the
+# tables filter engine and filterChanged tells the table to apply them
+class FilterPopup(QFrame):
+    filterChanged = pyqtSignal(int)
+
+    def __init__(self, parent):
+        super().__init__(parent, Qt.Popup)
+        self.setFrameShape(QFrame.StyledPanel)
+
+        self.column = 0
+        self.filter_engine = None
+        # every value of the column for Clear, the list only has the values the other columns' filters leave
+        self.clear_values = []
+        self.model = FilterValueModel(self)
+
+        self.search_edit = QLineEdit(self)
+        self.search_edit.setPlaceholderText("Search")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self.model.set_search_text)
+
+        self.list_view = QListView(self)
+        self.list_view.setUniformItemSizes(True)
+        # lay the rows out a batch at a time in the background instead of all at once when the popup is shown
+        self.list_view.setLayoutMode(QListView.Batched)
+        self.list_view.setBatchSize(1000)
+        self.list_view.setModel(self.model)
+        self.list_view.setItemDelegate(ComboCustomDelegate(self.list_view))
+        self.list_view.setEditTriggers(QListView.NoEditTriggers)
+        self.list_view.setSelectionMode(QListView.NoSelection)
+        self.list_view.clicked.connect(self.toggle_value)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(4, 4, 4, 4)
+        layout.setSpacing(2)
+        layout.addWidget(self.search_edit)
+
+        self.blank_buttons = []
+        for texts in (("All", "Clear"), ("Select Matching", "Clear Matching"), ("Show Blanks", "Hide Blanks")):
+            button_layout = QHBoxLayout()
+            for text in texts:
+                button = QPushButton(text, self)
+                button.setFocusPolicy(Qt.NoFocus)
+                button.clicked.connect(lambda checked, text=text: self.handle_button(text))
+                button_layout.addWidget(button)
+                if "Blanks" in text:
+                    self.blank_buttons.append(button)
+            layout.addLayout(button_layout)
+
+        layout.addWidget(self.list_view)
+
+    # load a column into the popup, show_blanks is False for checkbox columns same as the combobox dropdowns.  counts
+    # are the row counts shown next to the values, clear_values what Clear unchecks (defaults to values)
+    def set_column(self, column: int, values: List[str], filter_engine, show_blanks: bool = True, counts=None,
+                   clear_values=None):
+        self.column = column
+        self.filter_engine = filter_engine
+        self.clear_values = clear_values if clear_values is not None else values
+        self.search_edit.blockSignals(True)
+        self.search_edit.clear()
+        self.search_edit.blockSignals(False)
+        self.model.set_values(column, values, filter_engine, counts)
+
+        for button in self.blank_buttons:
+            button.setVisible(show_blanks)
+
+        # height for 15 rows, rows are all the same size so only the first one needs measured
+        row_height = self.list_view.sizeHintForRow(0) if values else 18
+        self.list_view.setFixedHeight(row_height * 15 + 2 * self.list_view.frameWidth())
+        self.setFixedWidth(min(max(self.sample_width(values), self.minimumSizeHint().width()), FILTER_POPUP_MAX_WIDTH))
+
+    # width the list needs worked out from a sample of the values instead of measuring every one, the longest values
+    # by character count plus an even spread through the list
+    def sample_width(self, values: List[str]) -> int:
+        if not values:
+            return 0
+
+        sample = heapq.nlargest(FILTER_POPUP_WIDTH_SAMPLE, values, key=len)
+        sample.extend(values[::max(1, len(values) // FILTER_POPUP_WIDTH_SAMPLE)])
+
+        metrics = self.list_view.fontMetrics()
+        scrollbar_width = self.list_view.verticalScrollBar().sizeHint().width()
+        # padding to account for checkbox size, same as the combobox dropdowns
+        padding = 40
+        count_width = metrics.width(f"  {max(self.model.counts.values())}") if self.model.counts else 0
+        return max(metrics.width(text) for text in sample) + count_width + scrollbar_width + padding
+
+    # show under the header combobox arrow, right aligned with it like the combobox dropdowns
+    def show_for(self, button: QComboBox):
+        location = button.mapToGlobal(QPoint(0, button.height()))
+        self.move(location.x() - self.width() + button.width(), location.y())
+        self.show()
+        self.search_edit.setFocus()
+
+    def toggle_value(self, index):
+        value = self.model.value(index.row())
+        excluded = not self.filter_engine.is_value_excluded(self.column, value)
+        self.filter_engine.set_value_excluded(self.column, value, excluded)
+        self.model.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        self.filterChanged.emit(self.column)
+
+    def handle_button(self, text: str):
+        if text == "All":
+            self.filter_engine.include_all(self.column)
+        elif text == "Clear":
+            self.filter_engine.exclude_all(self.column, self.clear_values)
+        elif text == "Select Matching":
+            self.filter_engine.set_values_excluded(self.column, self.model.matching_values(), False)
+        elif text == "Clear Matching":
+            self.filter_engine.set_values_excluded(self.column, self.model.matching_values(), True)
+        elif text == "Show Blanks":
+            self.filter_engine.set_blanks_hidden(self.column, False)
+        elif text == "Hide Blanks":
+            self.filter_engine.set_blanks_hidden(self.column, True)
+
+        self.model.refresh_check_states()
+        self.filterChanged.emit(self.column)
+
+    def hideEvent(self, event):
+        # don't hang on to the values, the header keeps its own sorted list for the column
+        self.model.set_values(self.column, [], self.filter_engine)
+        self.clear_values = []
+        super().hideEvent(event)
+
+
+# timings kept for each operation by TableProfiler
+PROFILE_HISTORY = 200
+
+
+# opt in timing of the table operations that can freeze the window (sorting, filtering, dropdown rebuilds, span fixing
+# and loading), turned on with FilterTableMixin.set_profiler.  Each operation records its wall time, the rows it
+# touched and the widgets it created.  operationTimed is emitted for each one and the last PROFILE_HISTORY timings of
+# each operation are kept for stats() / to_json()
+class TableProfiler(QObject):
+    # (operation, seconds, rows touched, widgets created)
+    operationTimed = pyqtSignal(str, float, int, int)
+
+    def __init__(self, history: int = PROFILE_HISTORY, parent=None):
+        super(TableProfiler, self).__init__(parent)
+        self.history = history
+        # operation -> deque of (seconds, rows touched, widgets created)
+        self.timings = {}
+        # [operation, start time, rows touched, widgets created] for the operations currently running
+        self.running = []
+
+    def begin(self, operation: str):
+        self.running.append([operation, time.perf_counter(), 0, 0])
+
+    def end(self):
+        operation, start, rows, widgets = self.running.pop()
+        self.record(operation, time.perf_counter() - start, rows, widgets)
+
+    # add to the counts of the running operations (an operation inside another counts towards both)
+    def count(self, rows: int = 0, widgets: int = 0):
+        for frame in self.running:
+            frame[2] += rows
+            frame[3] += widgets
+
+    def record(self, operation: str, seconds: float, rows: int = 0, widgets: int = 0):
+        timings = self.timings.get(operation)
+        if timings is None:
+            timings = self.timings[operation] = deque(maxlen=self.history)
+        timings.append((seconds, rows, widgets))
+        self.operationTimed.emit(operation, seconds, rows, widgets)
+
+    def clear(self):
+        self.timings.clear()
+
+    # operation -> count, mean/max/last seconds and mean rows touched/widgets created over the kept timings
+    def stats(self) -> dict:
+        stats = {}
+        for operation, timings in self.timings.items():
+            seconds = [timing[0] for timing in timings]
+            stats[operation] = {"count": len(timings),
+                                "mean": sum(seconds) / len(seconds),
+                                "max": max(seconds),
+                                "last": seconds[-1],
+                                "rows": sum(timing[1] for timing in timings) / len(timings),
+                                "widgets": sum(timing[2] for timing in timings) / len(timings)}
+        return stats
+
+    def to_json(self) -> str:
+        return json.dumps({"stats": self.stats(),
+                           "timings": {operation: [{"seconds": seconds, "rows": rows, "widgets": widgets}
+                                                   for seconds, rows, widgets in timings]
+                                       for operation, timings in self.timings.items()}}, indent=1)
+
+
+# times a table/header method with the object's profiler when it has one, with no profiler it's just one extra check
+def profiled(operation: str):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            profiler.begin(operation)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                profiler.end()
+        return wrapper
+    return decorator
+
+
+# tables with more columns than this get one filter button shared by all the header sections instead of one per section,
+# see ButtonHeaderView.set_shared_button
+SHARED_FILTER_BUTTON_COLUMNS = 50
+
+
 class ButtonHeaderView(QHeaderView):
     onsortChange = pyqtSignal(int)
     onfilterChange = pyqtSignal(object)
@@ -120,10 +517,29 @@ class ButtonHeaderView(QHeaderView):
         # in order to properly rearrange the comboboxes... only way i could figure out how to do this, all other methods failed
         self.m_buttons_index_attachments = {}
 
+        # logical columns whose dropdown items need rebuilt the next time the dropdown is opened
+        self.dirty_columns = set()
+
+        # shared searchable dropdown for high cardinality columns, logical column -> sorted values for the columns
+        # that use it
+        self.filter_popup = FilterPopup(self)
+        self.popup_values = {}
+        # column -> value counts for the columns in popup_values
+        self.popup_counts = {}
+
+        # one filter button moved to whichever section is hovered, used instead of m_buttons when shared_button_mode
+        # is on.  The filter state is in the tables filter engine, so the button's dropdown is just rebuilt for the
+        # column it's opened on
+        self.shared_button = None
+        self.shared_button_mode = False
+        # None to pick the mode from the column count (SHARED_FILTER_BUTTON_COLUMNS), see set_shared_button
+        self.shared_button_setting = None
+
         self.sectionResized.connect(self.adjustPositions)
         self.sectionMoved.connect(self.onSectionMovedChanged)
         self.sectionCountChanged.connect(self.onSectionCountChanged)
-        self.parent().verticalScrollBar().valueChanged.connect(self.adjustPositions)  # Adjust scrollbar connection
+        # the section positions only change with horizontal scrolling
+        self.parent().horizontalScrollBar().valueChanged.connect(self.adjustPositions)
 
         # Set sorting enabled for the header
         self.setSectionsClickable(True)
@@ -132,6 +548,9 @@ class ButtonHeaderView(QHeaderView):
         # var so that the first click out of combobox on the table headers won't trigger resorting of table
         self.outof_combo_popup = 0
 
+        # TableProfiler set by the table, see FilterTableMixin.set_profiler
+        self.profiler = None
+
     def customSortChange(self, logicalIndex):
         self.onsortChange.emit(logicalIndex)
 
@@ -148,15 +567,19 @@ class ButtonHeaderView(QHeaderView):
 
     def mouseMoveEvent(self, event):
         logical_index = self.logicalIndexAt(event.pos())
-        visual_index = self.visualIndex(logical_index)
 
-        # hide combo buttons if they aren't being hovered over or show if being hovered over (NOTE THIS IS FOR THE
-        # COMBO ARROW not for the combobox popup
-        for button in self.m_buttons:
-            if self.m_buttons.index(button) == visual_index:
-                button.show()
-            else:
-                button.hide()
+        if self.shared_button_mode:
+            self.show_shared_button(logical_index)
+        else:
+            visual_index = self.visualIndex(logical_index)
+
+            # hide combo buttons if they aren't being hovered over or show if being hovered over (NOTE THIS IS FOR THE
+            # COMBO ARROW not for the combobox popup
+            for index, button in enumerate(self.m_buttons):
+                if index == visual_index:
+                    button.show()
+                else:
+                    button.hide()
 
         # must keep super to inherit mousemoveevent functionality in order to keep functionality for user moving columns
         super().mouseMoveEvent(event)
@@ -174,9 +597,10 @@ class ButtonHeaderView(QHeaderView):
         # get all logical indexes as a list
         logical_indices = [self.logicalIndex(i) for i in range(self.count())]
 
-        # reset m_button order based on logical indices
-        self.m_buttons.clear()
-        self.m_buttons.extend(self.m_buttons_index_attachments[i] for i in logical_indices)
+        # reset m_button order based on logical indices (no per section buttons in shared button mode)
+        if not self.shared_button_mode:
+            self.m_buttons.clear()
+            self.m_buttons.extend(self.m_buttons_index_attachments[i] for i in logical_indices)
 
         # emit to readjust the spans for the odd rows for sub_tables not to move
         self.readjust_spans.emit(logical_indices[0])
@@ -187,110 +611,261 @@ class ButtonHeaderView(QHeaderView):
     # reset comboboxes when table columns change
     def onSectionCountChanged(self):
         self.m_buttons_index_attachments.clear()
+        self.popup_values.clear()
+        self.popup_counts.clear()
 
         while self.m_buttons:
             button = self.m_buttons.pop()
             button.deleteLater()
-        for i in range(self.count()):
-            # Draw button in header
-            button = ComboBox(self)
-            button.popupOpened.connect(self.first_mouse_click_outof_combo_popup)
 
-            # focus policy removes the box that shows current selection
-            button.setFocusPolicy(Qt.NoFocus)
+        if self.shared_button_setting is None:
+            self.shared_button_mode = self.count() > SHARED_FILTER_BUTTON_COLUMNS
+        else:
+            self.shared_button_mode = self.shared_button_setting
+
+        if self.shared_button_mode:
+            if self.shared_button is None:
+                self.shared_button = self.make_filter_button(-1)
+                if self.profiler is not None:
+                    self.profiler.count(widgets=1)
+            self.shared_button.hide()
+            self.shared_button.logical_index = -1
+            self.shared_button.built_column = None
+        else:
+            if self.shared_button is not None:
+                self.shared_button.deleteLater()
+                self.shared_button = None
 
-            button.setStyleSheet("background-color: lightgrey;")
-            button.activated.connect(self.handleComboboxItemClicked)
-            button.hide()
+            for i in range(self.count()):
+                button = self.make_filter_button(i)
+                self.m_buttons.append(button)
+                self.m_buttons_index_attachments[i] = button
 
-            self.adjustDropdownWidth(button)
-            self.m_buttons.append(button)
-            self.m_buttons_index_attachments[i] = button
-            self.update_data()
-            self.adjustPositions()
+            if self.profiler is not None:
+                self.profiler.count(widgets=len(self.m_buttons))
+
+        self.update_data()
+        self.adjustPositions()
 
+        # dropdown items are only built when a dropdown is opened
         self.populate_filter_dropdown()
 
+    # filter button (combobox arrow) for a logical column
+    def make_filter_button(self, logical_index: int) -> ComboBox:
+        # Draw button in header
+        button = ComboBox(self)
+        button.popupOpened.connect(self.first_mouse_click_outof_combo_popup)
+        button.popupAboutToOpen.connect(self.ensure_dropdown_populated)
+
+        # focus policy removes the box that shows current selection
+        button.setFocusPolicy(Qt.NoFocus)
+
+        button.setStyleSheet("background-color: lightgrey;")
+        button.activated.connect(self.handleComboboxItemClicked)
+        button.hide()
+
+        # logical column the button filters, stays the same when the user moves columns around
+        button.logical_index = logical_index
+        # logical column the dropdown items were last built for
+        button.built_column = None
+        return button
+
+    # use one filter button for every section (True), a button per section (False) or pick from the column count (None)
+    def set_shared_button(self, shared: Union[None, bool]):
+        self.shared_button_setting = shared
+        self.onSectionCountChanged()
+
+    # button with the dropdown built for a logical column, None if there isn't one at the moment
+    def filter_button(self, column: int) -> Union[None, ComboBox]:
+        if self.shared_button_mode:
+            if self.shared_button is not None and self.shared_button.built_column == column:
+                return self.shared_button
+            return None
+        return self.m_buttons_index_attachments.get(column)
+
+    # put the shared button on the hovered section, only that one section's position is worked out
+    def show_shared_button(self, logical_index: int):
+        button = self.shared_button
+        if button is None:
+            return
+        if logical_index < 0:
+            button.hide()
+            return
+
+        button.logical_index = logical_index
+        self.position_button(button, logical_index)
+        button.show()
+
+    # hide the filter buttons when the mouse leaves the header
+    def hide_filter_buttons(self):
+        for button in self.m_buttons:
+            button.hide()
+        if self.shared_button is not None:
+            self.shared_button.hide()
+
     def handleComboboxItemClicked(self):
         self.onfilterChange.emit(self.sender())
 
-    def check_if_parent_cell_is_widget(self, row: int, column: int) -> Union[None, str]:
-        item = None
-        widget = self.parent().cellWidget(row, column)
-
-        if widget:
-            # check for checkbox
-            for child_widget in widget.findChildren(QWidget):
-                if isinstance(child_widget, QCheckBox):
-                    state = child_widget.checkState()
-                    if state == 2:
-                        item = "True"
-                    elif state == 0:
-                        item = "False"
-        return item
+    # index in the dropdown where the values start, checkbox columns don't get the show/hide blanks options
+    def dropdown_base_index(self, column: int) -> int:
+        if column in self.parent().checkbox_columns:
+            return 2
+        return 4
+
+    # mark dropdowns to be rebuilt from the table data the next time they're opened, all columns if none given
+    @profiled("populate_filter_dropdown")
+    def populate_filter_dropdown(self, column: Union[None, int] = None):
+        if column is None:
+            self.dirty_columns.update(range(self.count()))
+        else:
+            self.dirty_columns.add(column)
 
-    def populate_filter_dropdown(self):
-        for column, button in enumerate(self.m_buttons):
-            button.clear()
-
-            widget_string = None
-            base_index = 2
-            items = set()  # Using a set to store unique items
-            for row in range(self.model().rowCount()):
-
-                if row % 2 == 0:
-                    # need to use visual indexes and not logical indexes to populate based on visuals of table
-                    # so the qcomobox drop down matches the visual column
-                    visual_column = self.logicalIndex(column)
-                    index = self.model().index(row, visual_column)
-                    data = self.model().data(index, Qt.DisplayRole)
-
-                    if data:
-                        # don't add to filter just text with spaces
-                        if data.strip() != "":
-                            items.add(data)
-                    if not data:
-                        widget_string = self.check_if_parent_cell_is_widget(row, visual_column)
-                        if widget_string:
-                            items.add(widget_string)
-
-            # Convert set to a list and add items to the QComboBox
-            item_to_list = list(items)
-            item_to_list.sort()
-
-            button.addItem("All")
-            button.addItem("Clear")
-
-            if widget_string is None:
-                button.addItem("Show Blanks")
-                button.addItem("Hide Blanks")
-                base_index = 4
-
-            for index, combo_item in enumerate(item_to_list):
-                button.addItem(combo_item)
-                # note the index +2 (or 3) due to adding all/clear that i dont' want checkmarks on
-                item = button.model().item(index + base_index, 0)
-                item.setCheckState(Qt.Checked)
+    @pyqtSlot()
+    def ensure_dropdown_populated(self):
+        button = self.sender()
+        column = button.logical_index
+        table = self.parent()
+        # the values listed change when other columns' filters hide/show rows
+        counts_changed = table.filter_engine.take_count_change(column)
+        if counts_changed or column in self.dirty_columns or button.built_column != column:
+            self.populate_column_dropdown(button)
+
+        if button.filter_popup is not None:
+            self.filter_popup.set_column(column, self.popup_values[column], table.filter_engine,
+                                         self.dropdown_base_index(column) == 4, self.popup_counts[column],
+                                         table.filter_values(column))
+
+    @profiled("populate_column_dropdown")
+    def populate_column_dropdown(self, button: ComboBox):
+        table = self.parent()
+        column = button.logical_index
+        self.dirty_columns.discard(column)
+        button.built_column = column
+        button.clear()
+
+        # values and their counts come from the count tables kept by the filter engine (or the data source) instead
+        # of scanning every row, only values in rows the other columns' filters leave showing are listed
+        counts = table.filter_value_counts(column)
+        item_to_list = [value for value in counts if value != ""]
+        item_to_list.sort()
+        if self.profiler is not None:
+            self.profiler.count(rows=len(item_to_list))
+
+        # too many values for the combobox list, the column uses the searchable filter popup instead
+        if len(item_to_list) > FILTER_POPUP_THRESHOLD:
+            button.filter_popup = self.filter_popup
+            self.popup_values[column] = item_to_list
+            self.popup_counts[column] = counts
+            return
+
+        button.filter_popup = None
+        self.popup_values.pop(column, None)
+        self.popup_counts.pop(column, None)
+
+        button.addItem("All")
+        button.addItem("Clear")
+
+        base_index = self.dropdown_base_index(column)
+        if base_index == 4:
+            button.addItem("Show Blanks")
+            button.addItem("Hide Blanks")
+
+        for index, combo_item in enumerate(item_to_list):
+            button.addItem(combo_item)
+            # note the index +2 (or 4) due to adding all/clear that i dont' want checkmarks on
+            item = button.model().item(index + base_index, 0)
+            item.setCheckState(self.filter_check_state(column, combo_item))
+            item.setData(counts[combo_item], FILTER_COUNT_ROLE)
+
+        button.combo_dropdown_height(len(item_to_list) + base_index)
+
+        self.adjustDropdownWidth(button)
+
+    # check state comes from the tables filter engine, so rebuilding a dropdown doesn't reset the filters shown
+    def filter_check_state(self, column: int, value: str) -> int:
+        if self.parent().filter_engine.is_value_excluded(column, value):
+            return Qt.Unchecked
+        return Qt.Checked
+
+    # add a single value to a column dropdown in its sorted position (value is new to the column)
+    def add_filter_value(self, column: int, value: str):
+        button = self.filter_button(column)
+        base_index = self.dropdown_base_index(column)
+
+        if column in self.popup_values and column not in self.dirty_columns:
+            popup_values = self.popup_values[column]
+            index = bisect_left(popup_values, value)
+            if index == len(popup_values) or popup_values[index] != value:
+                popup_values.insert(index, value)
+            return
+
+        # dropdown not built yet, it will pick up the value when it's opened
+        if button is None or column in self.dirty_columns or button.count() < base_index:
+            return
+
+        low, high = base_index, button.count()
+        while low < high:
+            mid = (low + high) // 2
+            if button.itemText(mid) < value:
+                low = mid + 1
+            else:
+                high = mid
+
+        if low < button.count() and button.itemText(low) == value:
+            return
 
-            button.combo_dropdown_height(len(item_to_list) + base_index)
+        button.insertItem(low, value)
+        button.model().item(low, 0).setCheckState(self.filter_check_state(column, value))
+        button.combo_dropdown_height(button.count())
 
+        # only need to check the new text for the dropdown width, not re-measure every item
+        if self.dropdown_text_width(button, value) > button.view().width():
             self.adjustDropdownWidth(button)
 
+    # remove a single value from a column dropdown (last row with the value in the column changed)
+    def remove_filter_value(self, column: int, value: str):
+        if column in self.dirty_columns:
+            return
+
+        if column in self.popup_values:
+            popup_values = self.popup_values[column]
+            index = bisect_left(popup_values, value)
+            if index < len(popup_values) and popup_values[index] == value:
+                del popup_values[index]
+            return
+
+        button = self.filter_button(column)
+        if button is None:
+            return
+
+        index = button.findText(value)
+        if index >= self.dropdown_base_index(column):
+            button.removeItem(index)
+            button.combo_dropdown_height(button.count())
+
     # change comboxw idth based on text of the items in it
     def adjustDropdownWidth(self, combo_box):
         max_width = 0
-        scrollbar_width = combo_box.view().verticalScrollBar().sizeHint().width()
-        frame_width = combo_box.view().frameWidth()
 
         for i in range(combo_box.count()):
-            width = combo_box.fontMetrics().width(combo_box.itemText(i))
+            text = combo_box.itemText(i)
+            count = combo_box.itemData(i, FILTER_COUNT_ROLE)
+            if count is not None:
+                text += f"  {count}"
+            width = self.dropdown_text_width(combo_box, text)
             max_width = max(max_width, width)
 
         # set 250 for maximum width drop down
         max_dropdown_width = 250
+        combo_box.view().setFixedWidth(min(max_width, max_dropdown_width))
+
+    # width the dropdown needs for a line of text
+    def dropdown_text_width(self, combo_box, text: str) -> int:
+        scrollbar_width = combo_box.view().verticalScrollBar().sizeHint().width()
+        frame_width = combo_box.view().frameWidth()
         # padding to account for checkbox size and scrollbar
         padding = 40
-        combo_box.view().setFixedWidth(min(max_width + scrollbar_width + frame_width + padding, max_dropdown_width))
+        return combo_box.fontMetrics().width(text) + scrollbar_width + frame_width + padding
 
     # when headers change
     def setModel(self, model):
@@ -310,41 +885,1287 @@ class ButtonHeaderView(QHeaderView):
     @pyqtSlot()
     # adjust positions for qcomboboxes due to resizing/section moves
     def adjustPositions(self):
+        # the shared button only needs moving if it's showing
+        if self.shared_button_mode:
+            if self.shared_button is not None and self.shared_button.isVisible():
+                self.position_button(self.shared_button, self.shared_button.logical_index)
+            return
+
         # adjust drop down menu location in header for when resized/column changed
-        h = 0
         for index, button in enumerate(self.m_buttons):
             # note must use logical index for sectionviewposition, otherwise the qcomboboxes will NOT change position
             # when the sections are moved by the user
-            logical_index = self.logicalIndex(index)
-            combo_width = 19
-            combo_x = self.sectionViewportPosition(logical_index) + self.sectionSize(logical_index) - combo_width - 4
-            geom = QRect(
-                combo_x,
-                0,
-                combo_width,
-                20,  # Adjust width drown down arrow
-            )
-            button.setGeometry(geom)
+            self.position_button(button, self.logicalIndex(index))
+
+    def position_button(self, button: ComboBox, logical_index: int):
+        combo_width = 19
+        combo_x = self.sectionViewportPosition(logical_index) + self.sectionSize(logical_index) - combo_width - 4
+        geom = QRect(
+            combo_x,
+            0,
+            combo_width,
+            20,  # Adjust width drown down arrow
+        )
+        button.setGeometry(geom)
+
+
+# per column lookup of cell value -> set of parent rows (the even rows), so filtering only has to touch the rows that
+# match a value instead of scanning every row of the table each time a filter checkbox is clicked.
+# qcheckbox cells are stored as "True"/"False" and empty/whitespace cells are stored as "" so the blank filters
+# can use the same lookup.  Columns are always logical indexes so moving columns around doesn't affect this
+class ColumnValueIndex:
+    def __init__(self):
+        # logical column -> {value: set of rows}
+        self.value_rows = []
+        # logical column -> {row: value}, needed to take a row out of its old value when a cell is changed
+        self.row_values = []
+
+    def clear(self, column_count: int = 0):
+        self.value_rows = [{} for _ in range(column_count)]
+        self.row_values = [{} for _ in range(column_count)]
+
+    def column_count(self) -> int:
+        return len(self.value_rows)
+
+    # store value for the cell, returns the value that was stored before (None if the cell wasn't indexed yet)
+    def set_value(self, row: int, column: int, value: Union[None, str]) -> Union[None, str]:
+        while column >= len(self.value_rows):
+            self.value_rows.append({})
+            self.row_values.append({})
+
+        if value is None or value.strip() == "":
+            value = ""
+
+        row_values = self.row_values[column]
+        old_value = row_values.get(row)
+        if old_value == value:
+            return old_value
+
+        if old_value is not None:
+            self._discard(column, old_value, row)
+
+        row_values[row] = value
+        self.value_rows[column].setdefault(value, set()).add(row)
+        return old_value
+
+    def remove_row(self, row: int):
+        for column, row_values in enumerate(self.row_values):
+            value = row_values.pop(row, None)
+            if value is not None:
+                self._discard(column, value, row)
+
+    def _discard(self, column: int, value: str, row: int):
+        rows = self.value_rows[column].get(value)
+        if rows is not None:
+            rows.discard(row)
+            if not rows:
+                del self.value_rows[column][value]
+
+    def value(self, row: int, column: int) -> Union[None, str]:
+        if column >= len(self.row_values):
+            return None
+        return self.row_values[column].get(row)
+
+    # row -> value copy of a column
+    def copy_column(self, column: int) -> dict:
+        if column >= len(self.row_values):
+            return {}
+        return dict(self.row_values[column])
+
+    # (value, set of rows) for every value in a column, the sets are live so callers must not modify them
+    def value_items(self, column: int):
+        if column >= len(self.value_rows):
+            return ()
+        return self.value_rows[column].items()
+
+    # every row in the index (a live view, callers must not keep it)
+    def rows(self):
+        if not self.row_values:
+            return {}.keys()
+        return self.row_values[0].keys()
+
+    # NOTE: returns the live set, callers must not modify it
+    def rows_for_value(self, column: int, value: str) -> set:
+        if column >= len(self.value_rows):
+            return set()
+        return self.value_rows[column].get(value, set())
+
+    def blank_rows(self, column: int) -> set:
+        return self.rows_for_value(column, "")
+
+    # how many rows have the value in a column, the row sets act as the refcount for each value in the header dropdowns
+    def value_count(self, column: int, value: str) -> int:
+        return len(self.rows_for_value(column, value))
+
+    # index a whole column at once, rows default to 0, 1, 2...  (much faster than set_value for big tables)
+    def set_column(self, column: int, values, rows=None):
+        while column >= len(self.value_rows):
+            self.value_rows.append({})
+            self.row_values.append({})
+
+        if rows is None:
+            rows = range(len(values))
+
+        value_rows = {}
+        row_values = {}
+        for row, value in zip(rows, values):
+            if value is None or value.strip() == "":
+                value = ""
+            row_values[row] = value
+            bucket = value_rows.get(value)
+            if bucket is None:
+                value_rows[value] = {row}
+            else:
+                bucket.add(row)
+
+        self.value_rows[column] = value_rows
+        self.row_values[column] = row_values
+
+    # distinct non blank values in a column
+    def values(self, column: int) -> List[str]:
+        if column >= len(self.value_rows):
+            return []
+        return [value for value in self.value_rows[column] if value != ""]
+
+
+# table wide (or single column) text search that's used along with the header filters.  The lowercase text of each
+# parent row is cached the first time it's searched, so a search is just substring checks, and when the search text
+# only gets longer (typing) just the rows that matched the last search are checked instead of every row.  Regex
+# searches always check every row.  Checkbox columns are left out of the table wide text, "true"/"false" would match
+# nearly anything typed
+class QuickSearch:
+    def __init__(self, value_index: ColumnValueIndex, checkbox_columns: set):
+        self.value_index = value_index
+        self.checkbox_columns = checkbox_columns
+        # callable(parent row) -> sub table rows or None if they aren't loaded, set by the table
+        self.sub_table_rows = None
+
+        self.text = ""
+        # logical column searched, None for every column
+        self.column = None
+        self.regex = False
+        self.include_sub_tables = False
+        self.test = None
+
+        # parent row -> tuple of the lowercase column values, and the values joined for the table wide search
+        self.row_values = {}
+        self.row_text = {}
+        # parent row -> lowercase text of its sub table rows
+        self.sub_table_text = {}
+
+        # rows that match the search, None when it has to be worked out again (see match_rows)
+        self.matches = None
+        # matches of the last search when the new one can only match a subset of them
+        self.narrow_from = None
+
+    def is_active(self) -> bool:
+        return self.text != ""
+
+    # set the search, an empty text turns it off.  Raises re.error for a bad regex.  The matching rows are worked
+    # out when they're next needed
+    def set_search(self, text: str, column: Union[None, int] = None, regex: bool = False,
+                   include_sub_tables: bool = False):
+        if regex:
+            test = re.compile(text, re.IGNORECASE).search
+        else:
+            needle = text.lower()
+            test = lambda haystack: needle in haystack
+
+        # a longer text containing the old one can only match rows the old one matched
+        previous = self.matches if self.matches is not None else self.narrow_from
+        narrow = (previous is not None and self.text != "" and not regex and not self.regex
+                  and column == self.column and include_sub_tables == self.include_sub_tables
+                  and self.text.lower() in text.lower())
+
+        self.text = text
+        self.column = column
+        self.regex = regex
+        self.include_sub_tables = include_sub_tables
+        self.test = test
+        self.narrow_from = previous if narrow else None
+        self.matches = None
+
+    def values_for_row(self, row: int) -> tuple:
+        values = self.row_values.get(row)
+        if values is None:
+            value = self.value_index.value
+            values = tuple((value(row, column) or "").lower() for column in range(self.value_index.column_count()))
+            self.row_values[row] = values
+        return values
+
+    def text_for_row(self, row: int) -> str:
+        text = self.row_text.get(row)
+        if text is None:
+            values = self.values_for_row(row)
+            text = "\n".join(value for column, value in enumerate(values) if column not in self.checkbox_columns)
+            self.row_text[row] = text
+        return text
+
+    # sub tables that haven't been loaded yet (from a sub_table_provider) aren't searched
+    def sub_table_text_for_row(self, row: int) -> str:
+        text = self.sub_table_text.get(row)
+        if text is None:
+            rows = self.sub_table_rows(row) if self.sub_table_rows is not None else None
+            if rows is None:
+                return ""
+            text = "\n".join("\n".join(str(value) for value in sub_row).lower() for sub_row in rows)
+            self.sub_table_text[row] = text
+        return text
+
+    def matches_row(self, row: int) -> bool:
+        if self.column is None:
+            haystack = self.text_for_row(row)
+        else:
+            values = self.values_for_row(row)
+            haystack = values[self.column] if self.column < len(values) else ""
+        if self.test(haystack):
+            return True
+        return self.include_sub_tables and bool(self.test(self.sub_table_text_for_row(row)))
+
+    def match_rows(self) -> set:
+        if self.matches is None:
+            candidates = self.narrow_from if self.narrow_from is not None else list(self.value_index.rows())
+            matches_row = self.matches_row
+            self.matches = {row for row in candidates if matches_row(row)}
+            self.narrow_from = None
+        return self.matches
+
+    def is_row_hidden(self, row: int) -> bool:
+        return self.is_active() and row not in self.match_rows()
+
+    # rows the search hides
+    def hidden_rows(self) -> set:
+        if not self.is_active():
+            return set()
+        return self.value_index.rows() - self.match_rows()
+
+    # a rows values (or sub table) changed, the cached text is made again and the row checked against the search
+    def invalidate_row(self, row: int):
+        self.row_values.pop(row, None)
+        self.row_text.pop(row, None)
+        self.sub_table_text.pop(row, None)
+        if self.matches is not None:
+            if self.matches_row(row):
+                self.matches.add(row)
+            else:
+                self.matches.discard(row)
+        self.narrow_from = None
+
+    def remove_row(self, row: int):
+        self.row_values.pop(row, None)
+        self.row_text.pop(row, None)
+        self.sub_table_text.pop(row, None)
+        if self.matches is not None:
+            self.matches.discard(row)
+        self.narrow_from = None
+
+    # forget all the cached text, for when the table data is replaced
+    def invalidate(self):
+        self.row_values.clear()
+        self.row_text.clear()
+        self.sub_table_text.clear()
+        self.matches = None
+        self.narrow_from = None
+
+
+# FilterEngine source for the rows hidden by the quick search, the other sources are the logical columns
+SEARCH_SOURCE = -1
+
+
+# filter state for every column (which values are unchecked in the header qcombobox and whether blanks are hidden),
+# kept separately from the qcomboboxes.  The rows to hide are worked out from the value index for each filtered
+# column and compared against the rows that column hid the last time, so only rows that actually change need to be
+# shown/hidden on the table.
+# Each hidden row keeps the set of sources (columns/the quick search) hiding it, which gives the cascading counts for
+# the header dropdowns: a row counts towards a column's dropdown if nothing but that column's own filter hides it.
+# The count tables are made the first time a column's dropdown asks for them, after that they're kept up to date
+# a row at a time as rows are hidden/shown and cell values change
+class FilterEngine:
+    def __init__(self, value_index: ColumnValueIndex, search: Union[None, QuickSearch] = None):
+        self.value_index = value_index
+        # QuickSearch the rows also have to match, it isn't reset by clear()
+        self.search = search
+        # logical column -> set of values unchecked in the filter
+        self.excluded_values = {}
+        # logical columns that have blanks hidden
+        self.hidden_blank_columns = set()
+        # rows hidden by the filters the last time update() was run
+        self.hidden_rows = set()
+        # source -> rows it hides, and hidden row -> sources hiding it
+        self.source_rows = {}
+        self.row_sources = {}
+        # logical column -> {value: rows with the value not hidden by any other column's filter}, see value_counts
+        self.column_counts = {}
+        # columns whose count table changed since the dropdown was last built from it, see take_count_change
+        self.count_changes = set()
+
+    def is_value_excluded(self, column: int, value: str) -> bool:
+        return value in self.excluded_values.get(column, ())
+
+    def is_filtered(self, column: int) -> bool:
+        return bool(self.excluded_values.get(column)) or column in self.hidden_blank_columns
+
+    def set_value_excluded(self, column: int, value: str, excluded: bool):
+        if excluded:
+            self.excluded_values.setdefault(column, set()).add(value)
+        elif column in self.excluded_values:
+            self.excluded_values[column].discard(value)
+
+    def set_values_excluded(self, column: int, values, excluded: bool):
+        if excluded:
+            self.excluded_values.setdefault(column, set()).update(values)
+        elif column in self.excluded_values:
+            self.excluded_values[column].difference_update(values)
+
+    def set_blanks_hidden(self, column: int, hidden: bool):
+        if hidden:
+            self.hidden_blank_columns.add(column)
+        else:
+            self.hidden_blank_columns.discard(column)
+
+    def include_all(self, column: int):
+        self.excluded_values.pop(column, None)
+        self.hidden_blank_columns.discard(column)
+
+    # values defaults to the values in the value index, tables with rows that aren't all loaded pass their own
+    def exclude_all(self, column: int, values=None):
+        if values is None:
+            values = self.value_index.values(column)
+        self.excluded_values[column] = set(values)
+        self.hidden_blank_columns.add(column)
+
+    def clear(self):
+        self.excluded_values.clear()
+        self.hidden_blank_columns.clear()
+
+    # forget every hidden row and count table, for when the table rows are replaced
+    def reset_rows(self):
+        self.hidden_rows = set()
+        self.source_rows = {}
+        self.row_sources = {}
+        self.invalidate_counts()
+
+    # drop the count tables after the value index was rebuilt, they're made again when next asked for
+    def invalidate_counts(self):
+        self.count_changes.update(self.column_counts)
+        self.column_counts = {}
+
+    def rows_hidden_by_column(self, column: int) -> set:
+        rows = set()
+        for value in self.excluded_values.get(column, ()):
+            rows.update(self.value_index.rows_for_value(column, value))
+        if column in self.hidden_blank_columns:
+            rows.update(self.value_index.blank_rows(column))
+        return rows
+
+    # build the hidden rows for the whole table in one go from every filtered column
+    def compute_hidden_rows(self) -> set:
+        hidden_rows = set()
+        for column in set(self.excluded_values) | self.hidden_blank_columns:
+            hidden_rows |= self.rows_hidden_by_column(column)
+        if self.search is not None:
+            hidden_rows |= self.search.hidden_rows()
+        return hidden_rows
+
+    # columns (and SEARCH_SOURCE) hiding a row with its current values
+    def sources_hiding_row(self, row: int) -> set:
+        sources = set()
+        value = self.value_index.value
+        for column, values in self.excluded_values.items():
+            if values and value(row, column) in values:
+                sources.add(column)
+        for column in self.hidden_blank_columns:
+            if value(row, column) == "":
+                sources.add(column)
+        if self.search is not None and self.search.is_row_hidden(row):
+            sources.add(SEARCH_SOURCE)
+        return sources
+
+    def is_row_hidden(self, row: int) -> bool:
+        return bool(self.sources_hiding_row(row))
+
+    # distinct values of a column with how many rows have them among the rows no other column's filter hides,
+    # blanks are under ""
+    def value_counts(self, column: int) -> dict:
+        counts = self.column_counts.get(column)
+        if counts is None:
+            hidden_by_others = set()
+            for source, rows in self.source_rows.items():
+                if source != column:
+                    hidden_by_others |= rows
+
+            counts = {}
+            for value, rows in self.value_index.value_items(column):
+                count = len(rows) - len(rows & hidden_by_others) if hidden_by_others else len(rows)
+                if count:
+                    counts[value] = count
+            self.column_counts[column] = counts
+        return counts
+
+    # True if the column's count table changed since this was last asked for the column
+    def take_count_change(self, column: int) -> bool:
+        if column in self.count_changes:
+            self.count_changes.discard(column)
+            return True
+        return False
+
+    def count_value(self, column: int, row: int, change: int):
+        counts = self.column_counts[column]
+        value = self.value_index.value(row, column)
+        count = counts.get(value, 0) + change
+        if count:
+            counts[value] = count
+        else:
+            counts.pop(value, None)
+        self.count_changes.add(column)
+
+    # count a row in every column except one (the row went from hidden by column to not hidden) or take it away
+    def count_row(self, row: int, change: int, except_column: Union[None, int] = None):
+        for column in self.column_counts:
+            if column != except_column:
+                self.count_value(column, row, change)
+
+    # a row is now hidden by source as well.  prior gets the rows hidden state from before the update
+    def add_source(self, row: int, source: int, prior: dict):
+        sources = self.row_sources.get(row)
+        if sources is None:
+            # was counted in every column, now only in the column hiding it
+            self.count_row(row, -1, source)
+            self.row_sources[row] = {source}
+            prior.setdefault(row, False)
+            self.hidden_rows.add(row)
+            return
+
+        if len(sources) == 1:
+            # was only hidden by one column so it was counted in that column
+            other, = sources
+            if other in self.column_counts:
+                self.count_value(other, row, -1)
+        sources.add(source)
+
+    def remove_source(self, row: int, source: int, prior: dict):
+        sources = self.row_sources[row]
+        sources.discard(source)
+        if not sources:
+            # counted in every column again, it was already counted in the column that was hiding it
+            self.count_row(row, 1, source)
+            del self.row_sources[row]
+            prior.setdefault(row, True)
+            self.hidden_rows.discard(row)
+        elif len(sources) == 1:
+            other, = sources
+            if other in self.column_counts:
+                self.count_value(other, row, 1)
+
+    # (rows that need hidden, rows that need shown) from the hidden state the changed rows had before
+    def hidden_changes(self, prior: dict) -> Tuple[set, set]:
+        newly_hidden = set()
+        newly_shown = set()
+        for row, was_hidden in prior.items():
+            if row in self.hidden_rows:
+                if not was_hidden:
+                    newly_hidden.add(row)
+            elif was_hidden:
+                newly_shown.add(row)
+        return newly_hidden, newly_shown
+
+    # re-check just the given rows after their values changed, returns (rows that need hidden, rows that need shown)
+    def update_rows(self, rows) -> Tuple[set, set]:
+        prior = {}
+        for row in rows:
+            sources = self.sources_hiding_row(row)
+            old_sources = self.row_sources.get(row, set())
+            for source in old_sources - sources:
+                self.source_rows[source].discard(row)
+                self.remove_source(row, source, prior)
+            for source in sources - old_sources:
+                self.source_rows.setdefault(source, set()).add(row)
+                self.add_source(row, source, prior)
+        return self.hidden_changes(prior)
+
+    # returns (rows that need hidden, rows that need shown) compared to the last update
+    def update(self) -> Tuple[set, set]:
+        sources = set(self.excluded_values) | self.hidden_blank_columns
+        if self.search is not None and self.search.is_active():
+            sources.add(SEARCH_SOURCE)
+
+        prior = {}
+        for source in sources | set(self.source_rows):
+            if source == SEARCH_SOURCE:
+                rows = self.search.hidden_rows() if source in sources else set()
+            else:
+                rows = self.rows_hidden_by_column(source) if source in sources else set()
+            old_rows = self.source_rows.get(source, set())
+            for row in old_rows - rows:
+                self.remove_source(row, source, prior)
+            for row in rows - old_rows:
+                self.add_source(row, source, prior)
+            if rows:
+                self.source_rows[source] = rows
+            else:
+                self.source_rows.pop(source, None)
+
+        return self.hidden_changes(prior)
+
+    # a cell value changed, move the row's count to the new value in that column's count table
+    def value_changed(self, row: int, column: int, old_value: Union[None, str]):
+        if column not in self.column_counts:
+            return
+        sources = self.row_sources.get(row)
+        if sources is not None and sources != {column}:
+            return
+
+        counts = self.column_counts[column]
+        if old_value is not None:
+            count = counts.get(old_value, 0) - 1
+            if count > 0:
+                counts[old_value] = count
+            else:
+                counts.pop(old_value, None)
+        self.count_value(column, row, 1)
+
+    # a new row was put in the table (it isn't hidden until the next update)
+    def add_row(self, row: int):
+        if self.column_counts:
+            self.count_row(row, 1)
+
+    # take a row out before it's removed from the value index
+    def remove_row(self, row: int):
+        sources = self.row_sources.pop(row, None)
+        if sources is None:
+            self.count_row(row, -1)
+        else:
+            for source in sources:
+                self.source_rows[source].discard(row)
+            if len(sources) == 1:
+                source, = sources
+                if source in self.column_counts:
+                    self.count_value(source, row, -1)
+            self.hidden_rows.discard(row)
+
+
+# sort key types for set_column_sort_type
+SORT_TEXT = "text"          # plain string compare of the cell text
+SORT_NATURAL = "natural"    # numbers inside the text compare as numbers, so "Row 2" comes before "Row 10"
+SORT_NUMERIC = "numeric"
+SORT_DATE = "date"
+SORT_BOOL = "bool"          # checkbox columns
+
+# date formats tried for SORT_DATE columns after iso format
+SORT_DATE_FORMATS = ["%m/%d/%Y", "%m/%d/%y", "%m/%d/%Y %H:%M", "%m/%d/%Y %H:%M:%S", "%Y/%m/%d", "%d-%b-%Y", "%d %b %Y",
+                     "%b %d, %Y"]
+
+_natural_split = re.compile(r"(\d+)")
+
+
+# sort keys for each column parsed from the cell text, cached per column so sorting the same column again doesn't
+# parse anything.  An edit only re-parses the key of that one cell.
+# Values that can't be parsed for the column type sort after everything that can and blanks sort last, in either
+# direction.  Every key is (0, value), (1, text) for values that can't be parsed or (2, "") for blanks, so the flag can
+# be kept ascending while the value is reversed
+class SortKeyCache:
+    def __init__(self, value_index: ColumnValueIndex, checkbox_columns: set):
+        self.value_index = value_index
+        self.checkbox_columns = checkbox_columns
+        # logical column -> sort type set by the user
+        self.column_types = {}
+        # logical column -> {row: key}
+        self.keys = {}
+        # logical column -> ({row: (flag, rank of the key in the column)}, (flag, rank) of a blank), used for
+        # descending sorts and for sorting on several columns at once
+        self.ranks = {}
+
+    def column_type(self, column: int) -> str:
+        if column in self.column_types:
+            return self.column_types[column]
+        if column in self.checkbox_columns:
+            return SORT_BOOL
+        return SORT_NATURAL
+
+    def set_column_type(self, column: int, key_type: str):
+        self.column_types[column] = key_type
+        self.invalidate(column)
+
+    # forget the sort types set for the columns, for when the table is loaded with different columns
+    def clear_column_types(self):
+        self.column_types.clear()
+        self.invalidate()
+
+    def invalidate(self, column: Union[None, int] = None):
+        if column is None:
+            self.keys.clear()
+            self.ranks.clear()
+        else:
+            self.keys.pop(column, None)
+            self.ranks.pop(column, None)
+
+    # keep a cached key column up to date when a cell is changed
+    def update_value(self, row: int, column: int, value: str):
+        keys = self.keys.get(column)
+        if keys is not None:
+            keys[row] = self.make_key(self.column_type(column), value)
+        self.ranks.pop(column, None)
+
+    def remove_row(self, row: int):
+        for keys in self.keys.values():
+            keys.pop(row, None)
+        self.ranks.clear()
+
+    # {row: key} for a column, parsed the first time the column is sorted
+    def key_column(self, column: int) -> dict:
+        keys = self.keys.get(column)
+        if keys is None:
+            key_type = self.column_type(column)
+            make_key = self.make_key
+            row_values = self.value_index.row_values[column] if column < self.value_index.column_count() else {}
+            keys = {row: make_key(key_type, value) for row, value in row_values.items()}
+            self.keys[column] = keys
+        return keys
+
+    # keys of a column turned into (flag, int) pairs (0 for the smallest key), so a descending column can be sorted as
+    # (flag, -rank) inside a composite key with ascending columns and still keep blanks and bad values last.  Rows
+    # without a key are blank, the blank rank is returned with the ranks so they sort with the rows keyed as blank
+    def rank_column(self, column: int) -> Tuple[dict, Tuple[int, int]]:
+        ranks = self.ranks.get(column)
+        if ranks is None:
+            keys = self.key_column(column)
+            blank_key = self.blank_key(column)
+            key_ranks = {key: (key[0], rank) for rank, key in enumerate(sorted(set(keys.values()) | {blank_key}))}
+            ranks = {row: key_ranks[key] for row, key in keys.items()}, key_ranks[blank_key]
+            self.ranks[column] = ranks
+        return ranks
+
+    def blank_key(self, column: int):
+        return self.make_key(self.column_type(column), "")
+
+    @staticmethod
+    def make_key(key_type: str, value: str):
+        if key_type == SORT_TEXT:
+            return (0, value) if value else (2, value)
+
+        text = value.strip()
+        if text:
+            if key_type == SORT_NATURAL:
+                parts = _natural_split.split(text.lower())
+                parts[1::2] = [int(part) for part in parts[1::2]]
+                return 0, tuple(parts)
+
+            if key_type == SORT_BOOL:
+                return 0, 1 if text == "True" else 0
+
+            if key_type == SORT_NUMERIC:
+                try:
+                    return 0, float(text.replace(",", ""))
+                except ValueError:
+                    pass
+
+            if key_type == SORT_DATE:
+                date = SortKeyCache.parse_date(text)
+                if date is not None:
+                    return 0, date
+
+        return (1, text) if text else (2, text)
+
+    # dates with a utc offset are turned into naive utc times, so they sort with the dates that don't have one
+    @staticmethod
+    def parse_date(text: str) -> Union[None, datetime]:
+        try:
+            date = datetime.fromisoformat(text)
+        except ValueError:
+            pass
+        else:
+            if date.tzinfo is not None:
+                date = date.astimezone(timezone.utc).replace(tzinfo=None)
+            return date
+        for date_format in SORT_DATE_FORMATS:
+            try:
+                return datetime.strptime(text, date_format)
+            except ValueError:
+                pass
+        return None
+
+
+# aggregate functions for SubTableAggregate
+AGGREGATE_COUNT = "count"                # number of sub table rows
+AGGREGATE_COUNT_WHERE = "count_where"    # number of sub table rows that match
+AGGREGATE_MIN = "min"                    # smallest non blank value of a sub table column
+AGGREGATE_MAX = "max"
+AGGREGATE_ANY = "any"                    # "True" if any sub table row matches
+AGGREGATE_ALL = "all"                    # "True" if every sub table row matches (or there are none)
+
+
+# a parent row column worked out from the parent's sub table rows, see set_sub_table_aggregates.  Rows match when
+# their sub table column equals value (or is one of value if it's a set/list/tuple), or when predicate(row data) is
+# true if one is given.  min/max compare the column's values with the key_type sort keys.
+# The state of each parent (the number of matching rows, or the current min/max) is kept so an edited sub table row
+# only updates that one parent from the old and new row data, only min/max has to look at the parent's other rows
+# again, and only when the row that was the min/max changed.
+#   SubTableAggregate("Open NCRs", AGGREGATE_COUNT_WHERE, column=1, value="Open")
+#   SubTableAggregate("All Closed", AGGREGATE_ALL, column=1, value={"Closed", "Scrap"})
+class SubTableAggregate:
+    def __init__(self, header: str, function: str, column: Union[None, int] = None, value=None, predicate=None,
+                 key_type: str = SORT_NATURAL):
+        self.header = header
+        self.function = function
+        self.column = column
+        self.value = value
+        self.predicate = predicate
+        self.key_type = key_type
+        # parent -> number of matching sub table rows for count_where/any/all, (sort key, text) of the min/max value
+        # or None if the column is all blank
+        self.states = {}
+
+    # sort type for the aggregate column, see set_column_sort_type
+    def sort_type(self) -> str:
+        if self.function in (AGGREGATE_COUNT, AGGREGATE_COUNT_WHERE):
+            return SORT_NUMERIC
+        if self.function in (AGGREGATE_ANY, AGGREGATE_ALL):
+            return SORT_BOOL
+        return self.key_type
+
+    def matches(self, row_data: List[str]) -> bool:
+        if self.predicate is not None:
+            return bool(self.predicate(row_data))
+        text = row_data[self.column] if self.column < len(row_data) else ""
+        if isinstance(self.value, (set, frozenset, list, tuple)):
+            return text in self.value
+        return text == self.value
+
+    # (sort key, text) of a rows column value for min/max, None for blanks
+    def extreme_entry(self, row_data: List[str]):
+        text = row_data[self.column] if self.column < len(row_data) else ""
+        if not text.strip():
+            return None
+        return SortKeyCache.make_key(self.key_type, text), text
+
+    def better(self, entry, current) -> bool:
+        if entry is None:
+            return False
+        if current is None:
+            return True
+        if self.function == AGGREGATE_MIN:
+            return entry[0] < current[0]
+        return entry[0] > current[0]
+
+    # work the state of a parent out from all its sub table rows and return the aggregate text
+    def compute(self, parent: int, rows: List[List[str]]) -> str:
+        if self.function in (AGGREGATE_MIN, AGGREGATE_MAX):
+            current = None
+            for row_data in rows:
+                entry = self.extreme_entry(row_data)
+                if self.better(entry, current):
+                    current = entry
+            self.states[parent] = current
+        elif self.function != AGGREGATE_COUNT:
+            self.states[parent] = sum(1 for row_data in rows if self.matches(row_data))
+        return self.text(parent, rows)
+
+    # update the state of a parent for one of its sub table rows changing from old_row_data to row_data (rows already
+    # holds the new row data) and return the aggregate text
+    def row_changed(self, parent: int, rows: List[List[str]], old_row_data: List[str], row_data: List[str]) -> str:
+        if parent not in self.states and self.function != AGGREGATE_COUNT:
+            return self.compute(parent, rows)
+
+        if self.function in (AGGREGATE_MIN, AGGREGATE_MAX):
+            current = self.states[parent]
+            entry = self.extreme_entry(row_data)
+            old_entry = self.extreme_entry(old_row_data)
+            if self.better(entry, current):
+                self.states[parent] = entry
+            elif old_entry is not None and current is not None and old_entry[0] == current[0] and entry != old_entry:
+                # the row that was the min/max changed to something that isn't as good
+                return self.compute(parent, rows)
+        elif self.function != AGGREGATE_COUNT:
+            self.states[parent] += self.matches(row_data) - self.matches(old_row_data)
+        return self.text(parent, rows)
+
+    def text(self, parent: int, rows: List[List[str]]) -> str:
+        if self.function == AGGREGATE_COUNT:
+            return str(len(rows))
+        state = self.states.get(parent)
+        if self.function == AGGREGATE_COUNT_WHERE:
+            return str(state)
+        if self.function == AGGREGATE_ANY:
+            return "True" if state else "False"
+        if self.function == AGGREGATE_ALL:
+            return "True" if state == len(rows) else "False"
+        return "" if state is None else state[1]
+
+    def remove(self, parent: int):
+        self.states.pop(parent, None)
+
+    def clear(self):
+        self.states.clear()
+
+
+# export formats for TableExporter
+EXPORT_CSV = "csv"
+EXPORT_JSONL = "jsonl"
+# rows written between progress signals
+EXPORT_PROGRESS_ROWS = 1000
+
+
+# copy of what a table is showing for TableExporter, made on the gui thread so the export thread never touches the
+# table.  The value lists are shallow copies of the table's own storage (the value index or the model's columns), so
+# making one is a handful of C level copies rather than reading every cell through the widgets.
+# rows are the visible parent rows in their sorted order, column_values has a row -> value lookup for each exported
+# column (in the visual column order) and checkbox_flags says which of those are checkbox columns.  sub_tables has
+# the sub table rows of every exported row, including the ones read from a sub_table_provider for the snapshot
+class TableSnapshot:
+    def __init__(self, headers: List[str], rows: List[int], column_values: list, checkbox_flags: List[bool],
+                 sub_table_headers=(), sub_tables=None):
+        self.headers = list(headers)
+        self.rows = rows
+        self.column_values = column_values
+        self.checkbox_flags = checkbox_flags
+        self.sub_table_headers = list(sub_table_headers)
+        # parent row -> sub table rows, None if sub tables aren't exported
+        self.sub_tables = sub_tables
+
+    def includes_sub_tables(self) -> bool:
+        return self.sub_tables is not None
+
+    def count(self) -> int:
+        return len(self.rows)
+
+    # (row data, sub table rows or None) for each row, checkbox columns come back as bools
+    def records(self):
+        columns = list(zip(self.column_values, self.checkbox_flags))
+        for row in self.rows:
+            row_data = []
+            for values, checkbox in columns:
+                value = values[row]
+                if checkbox:
+                    value = value is True or value == "True"
+                elif value is None:
+                    value = ""
+                row_data.append(value)
+
+            yield row_data, self.sub_tables[row] if self.sub_tables is not None else None
+
+
+# TableSnapshot for a SqliteTableSource, the query is run on a connection the export thread opens itself, inside one
+# read transaction so the count and the rows agree
+class SqliteExportSnapshot:
+    def __init__(self, path: str, sql: str, count_sql: str, params: list, headers: List[str],
+                 checkbox_flags: List[bool], sub_table_headers=(), sub_table_sql: Union[None, str] = None):
+        self.path = path
+        self.sql = sql
+        self.count_sql = count_sql
+        self.params = params
+        self.headers = list(headers)
+        self.checkbox_flags = checkbox_flags
+        self.sub_table_headers = list(sub_table_headers)
+        self.sub_table_sql = sub_table_sql
+        self.connection = None
+
+    def includes_sub_tables(self) -> bool:
+        return self.sub_table_sql is not None
+
+    def count(self) -> int:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("BEGIN")
+        return self.connection.execute(self.count_sql, self.params).fetchone()[0]
+
+    def records(self):
+        if self.connection is None:
+            self.count()
+        try:
+            for key, *values in self.connection.execute(self.sql, self.params):
+                row_data = [bool(value) if checkbox else ("" if value is None else str(value))
+                            for value, checkbox in zip(values, self.checkbox_flags)]
+                sub_table_rows = None
+                if self.sub_table_sql is not None:
+                    sub_table_rows = [["" if value is None else str(value) for value in sub_row]
+                                      for sub_row in self.connection.execute(self.sub_table_sql, (key,))]
+                yield row_data, sub_table_rows
+        finally:
+            self.connection.close()
+            self.connection = None
+
+
+# writes a TableSnapshot (see FilterTableMixin.export_rows) to a CSV or JSON Lines file on a background thread, so the
+# table keeps painting while a big export is written.  The file is written next to path and only renamed to it once
+# it's complete, a cancelled or failed export leaves nothing behind.
+# CSV has one line per parent row, or with sub tables one line per sub table row with the parent's columns repeated
+# in front of it (a parent without sub table rows still gets its line).  JSON Lines has an object per parent row
+# keyed by the headers, with its sub table rows as a list of objects under "sub_table"
+class TableExporter(QObject):
+    # (rows written, total rows), emitted from the export thread so it's delivered to the gui thread through the
+    # event loop
+    progress = pyqtSignal(int, int)
+    # rows written, the file is complete at path
+    finished = pyqtSignal(int)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, snapshot, path: str, file_format: Union[None, str] = None, parent=None):
+        super(TableExporter, self).__init__(parent)
+        self.snapshot = snapshot
+        self.path = path
+        if file_format is None:
+            file_format = EXPORT_JSONL if path.lower().endswith((".jsonl", ".json")) else EXPORT_CSV
+        if file_format not in (EXPORT_CSV, EXPORT_JSONL):
+            raise ValueError(f"unknown export format {file_format!r}")
+        self.file_format = file_format
+
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # stop after the row being written, cancelled is emitted once the partial file is removed
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_running(self) -> bool:
+        return self.thread.is_alive()
+
+    def wait(self, timeout: Union[None, float] = None):
+        self.thread.join(timeout)
+
+    # keys for the JSON objects, blank headers get "Column n" and repeated ones get a number on the end
+    @staticmethod
+    def record_keys(headers: List[str], length: int) -> List[str]:
+        keys = []
+        seen = set()
+        for index in range(length):
+            key = headers[index] if index < len(headers) and headers[index] else f"Column {index + 1}"
+            base, number = key, 2
+            while key in seen:
+                key = f"{base} ({number})"
+                number += 1
+            seen.add(key)
+            keys.append(key)
+        return keys
+
+    def run(self):
+        temp_path = self.path + ".part"
+        written = 0
+        try:
+            total = self.snapshot.count()
+            self.progress.emit(0, total)
+            with open(temp_path, "w", newline="" if self.file_format == EXPORT_CSV else None,
+                      encoding="utf-8") as file:
+                if self.file_format == EXPORT_CSV:
+                    written = self.write_csv(file, total)
+                else:
+                    written = self.write_jsonl(file, total)
+
+            if self.cancel_event.is_set():
+                os.remove(temp_path)
+                self.cancelled.emit()
+                return
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            self.failed.emit(str(e))
+            return
+
+        self.progress.emit(written, total)
+        self.finished.emit(written)
+
+    def write_csv(self, file, total: int) -> int:
+        snapshot = self.snapshot
+        writer = csv.writer(file)
+        sub_tables = snapshot.includes_sub_tables()
+        sub_table_width = len(snapshot.sub_table_headers)
+        writer.writerow(snapshot.headers + (snapshot.sub_table_headers if sub_tables else []))
+
+        written = 0
+        for row_data, sub_table_rows in snapshot.records():
+            if self.cancel_event.is_set():
+                break
+            if sub_tables and sub_table_rows:
+                for sub_row in sub_table_rows:
+                    writer.writerow(row_data + list(sub_row) + [""] * (sub_table_width - len(sub_row)))
+            else:
+                writer.writerow(row_data)
+            written += 1
+            if written % EXPORT_PROGRESS_ROWS == 0:
+                self.progress.emit(written, total)
+        return written
+
+    def write_jsonl(self, file, total: int) -> int:
+        snapshot = self.snapshot
+        keys = self.record_keys(snapshot.headers, len(snapshot.headers))
+        sub_table_keys = {}
+
+        written = 0
+        for row_data, sub_table_rows in snapshot.records():
+            if self.cancel_event.is_set():
+                break
+            record = dict(zip(keys, row_data))
+            if sub_table_rows is not None:
+                sub_records = []
+                for sub_row in sub_table_rows:
+                    length = len(sub_row)
+                    if length not in sub_table_keys:
+                        sub_table_keys[length] = self.record_keys(snapshot.sub_table_headers, length)
+                    sub_records.append(dict(zip(sub_table_keys[length], sub_row)))
+                record["sub_table"] = sub_records
+            file.write(json.dumps(record))
+            file.write("\n")
+            written += 1
+            if written % EXPORT_PROGRESS_ROWS == 0:
+                self.progress.emit(written, total)
+        return written
+
+
+# rows read from the start of an import file to work out the column types from
+IMPORT_SAMPLE_ROWS = 1000
+# field the JSON Lines objects keep their sub table rows in, same as TableExporter writes
+IMPORT_SUB_TABLE_FIELD = "sub_table"
+
+
+# loads a CSV or JSON Lines file (like the ones TableExporter writes) into a CustomTableWidget through load_rows, or a
+# CustomTableView through set_table_data.  The parent file is read a row at a time as the table takes each chunk, so
+# only the table ends up holding the data.  The column types are worked out from the first sample_rows rows: columns
+# of true/false become checkbox columns and numeric/date columns get that sort type (see set_column_sort_type).
+# Sub table rows come from a separate file joined on key_column/sub_table_key, or from a "sub_table" list in each
+# JSON Lines object.  The sub table file is read up front into key -> rows, and those same lists are handed to the
+# table as each parent is loaded.  key_column and sub_table_key can be header names or column numbers.
+#   TableImporter("orders.csv", key_column="Work Order", sub_table_path="ncrs.csv",
+#                 sub_table_key="Work Order").load_into(table)
+class TableImporter:
+    def __init__(self, path: str, key_column: Union[None, int, str] = None, sub_table_path: Union[None, str] = None,
+                 sub_table_key: Union[None, int, str] = None, checkbox_columns=None, file_format: Union[None, str] = None,
+                 sub_table_format: Union[None, str] = None, sample_rows: int = IMPORT_SAMPLE_ROWS,
+                 encoding: str = "utf-8-sig"):
+        self.path = path
+        self.file_format = self.format_for(path, file_format)
+        self.key_column = key_column
+        self.sub_table_path = sub_table_path
+        self.sub_table_format = self.format_for(sub_table_path, sub_table_format) if sub_table_path else None
+        self.sub_table_key = sub_table_key
+        self.sample_rows = sample_rows
+        self.encoding = encoding
+
+        self.headers = []
+        self.sub_table_headers = []
+        # logical column -> SORT_ type worked out from the sample, checkbox columns are SORT_BOOL
+        self.column_types = {}
+        # None to use the columns inferred as SORT_BOOL
+        self.checkbox_columns = set(checkbox_columns) if checkbox_columns is not None else None
+        self.key_index = None
+
+        # parent key -> sub table rows from the sub table file, None without one
+        self.sub_table_rows = None
+        self.file = None
+        self.sample = []
+        self.rows = iter(())
+
+    @staticmethod
+    def format_for(path: str, file_format: Union[None, str]) -> str:
+        if file_format is not None:
+            return file_format
+        return EXPORT_JSONL if path.lower().endswith((".jsonl", ".json")) else EXPORT_CSV
+
+    # text of a value from either file type, JSON true/false become "True"/"False" like checkbox cells
+    @staticmethod
+    def cell_text(value) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            return "True" if value else "False"
+        return str(value)
+
+    @staticmethod
+    def column_index(headers: List[str], column: Union[int, str]) -> int:
+        if isinstance(column, int):
+            return column
+        return headers.index(column)
+
+    # (headers, iterator of (row values, nested sub table objects or None)) for a file, the file stays open until
+    # the iterator is used up
+    def open_rows(self, path: str, file_format: str):
+        file = open(path, newline="", encoding=self.encoding)
+        if file_format == EXPORT_CSV:
+            reader = csv.reader(file)
+            headers = next(reader, [])
+            return file, headers, ((row, None) for row in reader)
+
+        objects = (json.loads(line) for line in file if line.strip())
+        # headers are every key in the sample in the order they're first seen, keys only seen after the sample are
+        # dropped
+        sample = list(islice(objects, self.sample_rows))
+        headers = list(dict.fromkeys(key for record in sample for key in record if key != IMPORT_SUB_TABLE_FIELD))
+        rows = (([record.get(header) for header in headers], record.get(IMPORT_SUB_TABLE_FIELD))
+                for record in chain(sample, objects))
+        return file, headers, rows
+
+    # type of a column from sampled text values, blanks are ignored
+    @staticmethod
+    def infer_column_type(values) -> str:
+        values = [value.strip() for value in values if value.strip()]
+        if not values:
+            return SORT_NATURAL
+        if all(value.lower() in ("true", "false") for value in values):
+            return SORT_BOOL
+        try:
+            for value in values:
+                float(value.replace(",", ""))
+            return SORT_NUMERIC
+        except ValueError:
+            pass
+        if all(SortKeyCache.parse_date(value) is not None for value in values):
+            return SORT_DATE
+        return SORT_NATURAL
+
+    # read the headers and sample rows, work out the column types and read the sub table file
+    def prepare(self):
+        self.file, self.headers, self.rows = self.open_rows(self.path, self.file_format)
+        self.sample = list(islice(self.rows, self.sample_rows))
+
+        cell_text = self.cell_text
+        column_count = len(self.headers)
+        for column in range(column_count):
+            values = (cell_text(row[column]) if column < len(row) else "" for row, _ in self.sample)
+            self.column_types[column] = self.infer_column_type(values)
+        if self.checkbox_columns is None:
+            self.checkbox_columns = {column for column, key_type in self.column_types.items() if key_type == SORT_BOOL}
+
+        self.key_index = None if self.key_column is None else self.column_index(self.headers, self.key_column)
+
+        if self.sub_table_path is not None:
+            self.read_sub_table()
+        else:
+            # headers for nested JSON Lines sub tables, from the first one in the sample
+            for _, nested in self.sample:
+                if nested:
+                    self.sub_table_headers = list(nested[0])
+                    break
+
+    def read_sub_table(self):
+        file, headers, rows = self.open_rows(self.sub_table_path, self.sub_table_format)
+        key_index = self.column_index(headers, self.sub_table_key)
+        self.sub_table_headers = headers[:key_index] + headers[key_index + 1:]
+
+        sub_table_rows = {}
+        cell_text = self.cell_text
+        with file:
+            for row, _ in rows:
+                if key_index >= len(row):
+                    continue
+                key = cell_text(row[key_index])
+                sub_row = [cell_text(value) for index, value in enumerate(row) if index != key_index]
+                rows_for_key = sub_table_rows.get(key)
+                if rows_for_key is None:
+                    sub_table_rows[key] = [sub_row]
+                else:
+                    rows_for_key.append(sub_row)
+        self.sub_table_rows = sub_table_rows
+
+    # (row data, sub table rows) for load_rows, read from the file as they're asked for.  The sub table rows of each
+    # parent are taken out of sub_table_rows as they're handed over
+    def records(self):
+        cell_text = self.cell_text
+        column_count = len(self.headers)
+        checkbox_columns = self.checkbox_columns
+        key_index = self.key_index
+        sub_table_headers = self.sub_table_headers
+        try:
+            for row, nested in chain(self.sample, self.rows):
+                row_data = [cell_text(value) for value in row[:column_count]]
+                row_data.extend([""] * (column_count - len(row_data)))
+                for column in checkbox_columns:
+                    row_data[column] = row_data[column].strip().lower() == "true"
+
+                if nested is not None:
+                    sub_table_rows = [[cell_text(sub_row.get(header)) for header in sub_table_headers]
+                                      for sub_row in nested]
+                elif self.sub_table_rows is not None and key_index is not None:
+                    sub_table_rows = self.sub_table_rows.pop(cell_text(row_data[key_index]), [])
+                else:
+                    sub_table_rows = []
+                yield row_data, sub_table_rows
+        finally:
+            self.file.close()
+            self.sample = []
+
+    # load the file into a CustomTableWidget (in chunks of chunk_size, LOAD_CHUNK_SIZE by default, see load_rows) or a
+    # CustomTableView
+    def load_into(self, table, chunk_size: Union[None, int] = None):
+        self.prepare()
+        if isinstance(table, CustomTableView):
+            # set_table_data reads all the rows before it looks at the sub tables, so the list is filled as it goes
+            sub_tables = []
+
+            def rows():
+                for row_data, sub_table_rows in self.records():
+                    sub_tables.append(sub_table_rows)
+                    yield row_data
+
+            table.set_table_data(self.headers, rows(), sub_tables, self.checkbox_columns, self.sub_table_headers)
+        else:
+            table.load_rows(self.headers, self.records(), self.sub_table_headers, self.checkbox_columns,
+                            chunk_size or LOAD_CHUNK_SIZE, self.key_index)
 
+        for column, key_type in self.column_types.items():
+            if key_type in (SORT_NUMERIC, SORT_DATE):
+                table.set_column_sort_type(column, key_type)
 
-class CustomTableWidget(QTableWidget):
 
-    def __init__(self):
-        super(CustomTableWidget, self).__init__()
-        self.model().dataChanged.connect(self.on_cellvalue_changed)
-     #   self.itemSelectionChanged.connect(self.selection_changed)
-        self.cellClicked.connect(self.on_cell_clicked)
+# how many closed sub table widgets are kept around to be reused for the next sub table that's opened
+SUB_TABLE_POOL_SIZE = 20
+
+# parent rows put in the table each pass of the event loop by CustomTableWidget.load_rows
+LOAD_CHUNK_SIZE = 500
+# the next page of a data source is fetched when the table is scrolled to within this many rows of the bottom
+SOURCE_FETCH_MARGIN = 200
+
+
+# everything CustomTableWidget and CustomTableView share: the header with the filter qcomboboxes, the value index
+# and filter engine behind the filters and the sub table widgets.  Each table implements apply_filters,
+# sort_column_change, adjust_spans and main_table_vertical_header_clicked for how it stores its rows
+class FilterTableMixin:
+
+    # run from the tables __init__
+    def setup_table(self):
         self.setMouseTracking(True)
 
+        # columns the table is sorted on, see set_sort_spec
+        self.sort_spec = []
+
+        # WriteBackQueue edits are sent to, see set_write_back
+        self.write_back = None
+
+        # TableProfiler timing the table operations, see set_profiler
+        self.profiler = None
+
+        # sub_TableWidgets from closed sub table rows, see sub_table_release
+        self.sub_table_pool = []
+        # parent -> (sub table row count, height) of the table row the sub table is shown in
+        self.sub_table_heights = {}
+
+        # value -> rows lookup used by the header filters, see rebuild_value_index
+        self.value_index = ColumnValueIndex()
+        # logical columns that hold checkboxes, these are drawn by checkbox_delegate
+        self.checkbox_columns = set()
+        self.checkbox_delegate = CheckBoxDelegate(self)
+        # text search combined with the header filters, see set_quick_search
+        self.quick_search = QuickSearch(self.value_index, self.checkbox_columns)
+        self.filter_engine = FilterEngine(self.value_index, self.quick_search)
+        self.sort_keys = SortKeyCache(self.value_index, self.checkbox_columns)
+
+        # SubTableAggregate columns added after the loaded columns, see set_sub_table_aggregates.  aggregate_start is
+        # the logical column of the first one, None when the table has none
+        self.sub_table_aggregates = []
+        self.aggregate_start = None
+
         self.header = ButtonHeaderView(self)
         self.setHorizontalHeader(self.header)  # Set horizontal header
         self.header.onsortChange.connect(self.sort_column_change)
         self.header.onfilterChange.connect(self.combo_filter_change)
+        self.header.filter_popup.filterChanged.connect(self.popup_filter_change)
 
         self.horizontalHeader().setSortIndicatorShown(True)
 
         self.setAlternatingRowColors(True)
-        table_stylesheet = "QTableWidget {alternate-background-color: lightgray;}"
+        table_stylesheet = "QTableView {alternate-background-color: lightgray;}"
         self.setStyleSheet(table_stylesheet)
 
         # Set the background color of the header sections
@@ -364,24 +2185,208 @@ class CustomTableWidget(QTableWidget):
             }, 
         """
         self.verticalHeader().setStyleSheet(stylesheet)
-        self.verticalHeader().sectionClicked.connect(self.main_table_vertical_header_clicked)
 
-    # make row below hidden or not hidden
-    def main_table_vertical_header_clicked(self, row: int):
-        if row % 2 == 0:
-            row_hidden = self.isRowHidden(row+1)
-            if row_hidden:
-                self.setRowHidden(row+1, False)
-                item = QTableWidgetItem("-")
-                self.setVerticalHeaderItem(row, item)
+    # store a changed cell value in the value index and add/remove the value in that columns header dropdown when
+    # it's the first/last cell in the column with the value.  Returns False if the cell already had the value
+    def set_index_value(self, row: int, col: int, text: Union[None, str]) -> bool:
+        old_value = self.value_index.set_value(row, col, text)
+        new_value = self.value_index.value(row, col)
+        if old_value == new_value:
+            return False
+
+        self.filter_engine.value_changed(row, col, old_value)
+
+        self.sort_keys.update_value(row, col, new_value)
+        self.quick_search.invalidate_row(row)
+
+        if old_value and self.value_index.value_count(col, old_value) == 0:
+            self.header.remove_filter_value(col, old_value)
+        if new_value and self.value_index.value_count(col, new_value) == 1:
+            self.header.add_filter_value(col, new_value)
+        return True
+
+    # parent row columns worked out from each parent's sub table rows (counts, min/max, any/all, see SubTableAggregate).
+    # They're added after the loaded columns by the next load_rows/set_table_data and are filtered, sorted and
+    # searched like any other column, but can't be edited.  Editing a sub table row only updates the aggregates of
+    # its parent.  Sub tables that aren't loaded yet (sub_table_provider) have blank aggregates until they're opened,
+    # and tables paged in from a data source don't get aggregate columns
+    def set_sub_table_aggregates(self, aggregates: List[SubTableAggregate]):
+        self.sub_table_aggregates = list(aggregates)
+
+    # headers for loading with the aggregate column headers added after them
+    def add_aggregate_headers(self, headers: List[str]) -> List[str]:
+        headers = list(headers)
+        for aggregate in self.sub_table_aggregates:
+            aggregate.clear()
+        if not self.sub_table_aggregates:
+            self.aggregate_start = None
+            return headers
+
+        self.aggregate_start = len(headers)
+        for column, aggregate in enumerate(self.sub_table_aggregates, self.aggregate_start):
+            self.set_column_sort_type(column, aggregate.sort_type())
+        return headers + [aggregate.header for aggregate in self.sub_table_aggregates]
+
+    # aggregate column texts of a parent from all its sub table rows, blanks if they aren't loaded (None)
+    def aggregate_values(self, parent: int, sub_table_rows) -> List[str]:
+        if sub_table_rows is None:
+            return [""] * len(self.sub_table_aggregates)
+        return [aggregate.compute(parent, sub_table_rows) for aggregate in self.sub_table_aggregates]
+
+    # work the aggregate columns of a parent out again, for when its whole sub table is replaced or loaded
+    def refresh_sub_table_aggregates(self, parent: int, sub_table_rows):
+        if self.aggregate_start is not None:
+            self.set_aggregate_values(parent, self.aggregate_values(parent, sub_table_rows))
+
+    # update the aggregate columns of a parent for one edited sub table row, sub_table_rows already has the new row
+    def sub_table_aggregates_row_changed(self, parent: int, sub_table_rows: List[List[str]], old_row_data: List[str],
+                                         row_data: List[str]):
+        if self.aggregate_start is None:
+            return
+        self.set_aggregate_values(parent, [aggregate.row_changed(parent, sub_table_rows, old_row_data, row_data)
+                                           for aggregate in self.sub_table_aggregates])
+
+    # aggregate values go through the value index like an edited cell, so the dropdowns, counts, sort keys and quick
+    # search are updated for just that row
+    def set_aggregate_values(self, parent: int, values: List[str]):
+        for column, text in enumerate(values, self.aggregate_start):
+            if self.set_index_value(parent, column, text):
+                self.set_aggregate_cell(parent, column, text)
+
+    def remove_sub_table_aggregates(self, parent: int):
+        for aggregate in self.sub_table_aggregates:
+            aggregate.remove(parent)
+
+    # show only the rows containing text (case insensitive) in any column, or just in column, along with the header
+    # filters.  Sub table text is searched too with include_sub_tables.  An empty text turns the search off, a bad
+    # regex raises re.error
+    @profiled("quick_search")
+    def set_quick_search(self, text: str, column: Union[None, int] = None, regex: bool = False,
+                         include_sub_tables: bool = False):
+        self.quick_search.set_search(text, column, regex, include_sub_tables)
+        self.apply_filters()
+
+    # time sorting, filtering, dropdown building, span fixing and loading with a TableProfiler, None to stop
+    def set_profiler(self, profiler: Union[None, TableProfiler]):
+        self.profiler = profiler
+        self.header.profiler = profiler
+
+    # send cell edits to a WriteBackQueue, None to stop
+    def set_write_back(self, write_back):
+        self.write_back = write_back
+
+    # identity of a row for the write back queue, stays the same when the table is sorted
+    def row_key(self, row: int):
+        return row
+
+    # queue an edit to be written back, sub_row is the row in the sub table for sub table edits
+    def record_edit(self, row: int, column: int, value, sub_row: Union[None, int] = None):
+        if self.write_back is not None:
+            self.write_back.record(self.row_key(row), column, value, sub_row)
+
+    # queue the cells of an edited sub table row that changed
+    def record_sub_table_edit(self, row: int, sub_row: int, old_row_data: List[str], row_data: List[str]):
+        for column, value in enumerate(row_data):
+            if column >= len(old_row_data) or old_row_data[column] != value:
+                self.record_edit(row, column, value, sub_row)
+
+    # distinct non blank values of a column
+    def filter_values(self, column: int) -> List[str]:
+        return self.value_index.values(column)
+
+    # values of a column for the header dropdowns with how many rows have them, only counting rows the other columns'
+    # filters leave showing
+    def filter_value_counts(self, column: int) -> dict:
+        return self.filter_engine.value_counts(column)
+
+    # write the visible parent rows in their sorted order (with their sub table rows if include_sub_tables) to a CSV or
+    # JSON Lines file on a background thread.  file_format is EXPORT_CSV or EXPORT_JSONL, worked out from the file
+    # extension if not given.  The export is from a snapshot (see export_snapshot) so the table can be changed while
+    # it's written, connect to the returned TableExporter for progress and cancel it with exporter.cancel()
+    def export_rows(self, path: str, file_format: Union[None, str] = None,
+                    include_sub_tables: bool = False) -> TableExporter:
+        exporter = TableExporter(self.export_snapshot(include_sub_tables), path, file_format, self)
+        exporter.start()
+        return exporter
+
+    # logical columns in the order they're shown, exports use the same order the user sees
+    def visual_columns(self) -> List[int]:
+        header = self.horizontalHeader()
+        return [header.logicalIndex(visual) for visual in range(header.count())]
+
+    def export_headers(self, columns: List[int]) -> List[str]:
+        model = self.model()
+        return [model.headerData(column, Qt.Horizontal, Qt.DisplayRole) or "" for column in columns]
+
+    # draw/edit the checkbox columns with the checkbox delegate
+    def set_checkbox_delegates(self):
+        for col in self.checkbox_columns:
+            self.setItemDelegateForColumn(col, self.checkbox_delegate)
+
+    # set how a column is sorted, one of SORT_TEXT, SORT_NATURAL, SORT_NUMERIC, SORT_DATE or SORT_BOOL
+    def set_column_sort_type(self, column: int, key_type: str):
+        self.sort_keys.set_column_type(column, key_type)
+
+    # sort rows on the cached sort keys of a column
+    def sort_rows(self, rows, column: int, reverse: bool = False) -> List[int]:
+        return self.sort_rows_by_spec(rows, [(column, Qt.DescendingOrder if reverse else Qt.AscendingOrder)])
+
+    # sort rows on several columns in one sort, sort_spec is a list of (logical column, Qt.AscendingOrder or
+    # Qt.DescendingOrder) with the main sort column first.  Each column compares on the rank of its cached key, so a
+    # single composite key works for any mix of directions and the sort is stable
+    def sort_rows_by_spec(self, rows, sort_spec: List[Tuple[int, int]]) -> List[int]:
+        return sorted(rows, key=self.sort_key_function(sort_spec))
+
+    # row -> ascending sort key for a sort spec, see sort_rows_by_spec.  A descending column only reverses the rank
+    # part of its key, so blanks and values that can't be parsed stay last like they do in SqliteTableSource
+    def sort_key_function(self, sort_spec: List[Tuple[int, int]]):
+        if len(sort_spec) == 1 and sort_spec[0][1] != Qt.DescendingOrder:
+            keys = self.sort_keys.key_column(sort_spec[0][0])
+            blank_key = self.sort_keys.blank_key(sort_spec[0][0])
+            return lambda row: keys.get(row, blank_key)
+
+        rank_columns = []
+        for column, order in sort_spec:
+            ranks, blank_rank = self.sort_keys.rank_column(column)
+            rank_columns.append((ranks, blank_rank, -1 if order == Qt.DescendingOrder else 1))
+
+        def key(row):
+            row_key = []
+            for ranks, blank_rank, sign in rank_columns:
+                flag, rank = ranks.get(row, blank_rank)
+                row_key.append(flag)
+                row_key.append(sign * rank)
+            return tuple(row_key)
+
+        return key
+
+    # sort the table on several columns, see sort_rows_by_spec for the sort_spec format.  The sort is also kept
+    # so it can be re-applied
+    def set_sort_spec(self, sort_spec: List[Tuple[int, int]]):
+        self.sort_spec = list(sort_spec)
+        if self.sort_spec:
+            self.apply_row_order(self.sort_rows_by_spec(self.parent_rows(), self.sort_spec))
+
+    # activates when headers clicked to sort table, shift+click adds the column to the current sort (or flips its
+    # direction if it's already in it) instead of starting a new sort
+    @profiled("sort_column_change")
+    def sort_column_change(self, column: int):
+        # the header sort indicator arrow is flipped from the direction the table is sorted in
+        if self.horizontalHeader().sortIndicatorOrder() == Qt.DescendingOrder:
+            order = Qt.AscendingOrder
+        else:
+            order = Qt.DescendingOrder
+
+        sort_spec = [(column, order)]
+        if QApplication.keyboardModifiers() & Qt.ShiftModifier:
+            sort_spec = list(self.sort_spec)
+            columns = [sort_column for sort_column, _ in sort_spec]
+            if column in columns:
+                sort_spec[columns.index(column)] = (column, order)
             else:
-                self.setRowHidden(row+1, True)
-                item = QTableWidgetItem("+")
-                self.setVerticalHeaderItem(row, item)
+                sort_spec.append((column, order))
 
-    def on_cellvalue_changed(self):
-        # implementation for when user changes data in cell to repopulate header qcombobox with new data
-        self.header.populate_filter_dropdown()
+        self.set_sort_spec(sort_spec)
 
     def on_cell_clicked(self):
         # this is to support the header repaint/sort not being run on the first click out of qcombox popups
@@ -391,163 +2396,774 @@ class CustomTableWidget(QTableWidget):
     # this is for what index to start iterating checkbox items in the comboboxes.  The index is different depending
     # on whether column contains widgets or text because i give different options in the filters for each
     def base_index_for_combobox_filters(self, row: int = 0, column: int = 0) -> int:
-        base_index = 4
         logical_index = self.horizontalHeader().logicalIndex(column)
-        widget = self.cellWidget(row, logical_index)
-
-        if widget:
-            base_index = 2
-
-        return base_index
+        return self.header.dropdown_base_index(logical_index)
 
     # activates when filter options chosen in qcomboboxes
+    @profiled("combo_filter_change")
     def combo_filter_change(self, button: QComboBox):
-        # column needed
-        column = self.header.m_buttons.index(button)
+        # filter state is kept on logical indexes so it doesn't matter if the user moves columns around, the button
+        # knows which logical column it's for (the shared button is moved between columns)
+        logical_index = button.logical_index
 
-        base_index = self.base_index_for_combobox_filters(column=column)
+        base_index = self.header.dropdown_base_index(logical_index)
 
         item = button.model().item(button.currentIndex())
         item_text = button.itemText(button.currentIndex())
         item_index = button.currentIndex()
 
-        if item.checkState() == Qt.Unchecked and item_index >= base_index:
-            self.hide_filter_table(item_text, column)
-
-        if item.checkState() == Qt.Checked and item_index >= base_index:
-            self.show_filter_table(item_text, column)
+        if item_index >= base_index:
+            self.filter_engine.set_value_excluded(logical_index, item_text, item.checkState() == Qt.Unchecked)
 
         # if "All" selected in combo box
-        if item_index == 0:
+        elif item_index == 0:
             for index in range(base_index, button.count()):
-                item = button.model().item(index)
-                item.setCheckState(Qt.Checked)
-                self.show_filter_table(button.itemText(index), column)
-                self.show_filter_table("Show Blanks", column)
-
-            # if all is selected in 1 of the comboboxes, MUST go back through and check the checkstates
-            # of the rest of the combo boxes and re-hide anything unchecked.
-            for buttons in self.header.m_buttons:
-                if buttons != button:
-                    column = self.header.m_buttons.index(buttons)
-                    base_index = self.base_index_for_combobox_filters(column=column)
-
-                    for index in range(base_index, buttons.count()):
-                        item = buttons.model().item(index)
-                        if item.checkState() == Qt.Unchecked:
-                            self.hide_filter_table(buttons.itemText(index), column)
-                            self.hide_filter_table("Hide Blanks", column)
+                button.model().item(index).setCheckState(Qt.Checked)
+            self.filter_engine.include_all(logical_index)
 
         # if "Clear" selected in combo box
-        if item_index == 1:
+        elif item_index == 1:
             for index in range(base_index, button.count()):
-                item = button.model().item(index)
-                item.setCheckState(Qt.Unchecked)
-                self.hide_filter_table(button.itemText(index), column)
-                self.hide_filter_table("Hide Blanks", column)
+                button.model().item(index).setCheckState(Qt.Unchecked)
+            self.filter_engine.exclude_all(logical_index, self.filter_values(logical_index))
 
         # if "Blanks" selected in combo box for removing all blank rows
-        if item_text == "Hide Blanks" and item_index == 3:
-            self.hide_filter_table("Hide Blanks", column)
+        elif item_text == "Hide Blanks" and item_index == 3:
+            self.filter_engine.set_blanks_hidden(logical_index, True)
 
-        # if "Blanks" selected in combo box for removing all blank rows
-        if item_text == "Show Blanks" and item_index == 2:
-            self.show_filter_table("Show Blanks", column)
-
-            # if show blanks is selected in 1 of the comboboxes, MUST go back through and check the checkstates
-            # of the rest of the combo boxes and re-hide anything unchecked.
-            for buttons in self.header.m_buttons:
-                if buttons != button:
-                    column = self.header.m_buttons.index(buttons)
-                    base_index = self.base_index_for_combobox_filters(column=column)
-                    for index in range(base_index, buttons.count()):
-                        item = buttons.model().item(index)
-                        if item.checkState() == Qt.Unchecked:
-                            self.hide_filter_table(buttons.itemText(index), column)
-                            self.hide_filter_table("Hide Blanks", column)
-
-    # show row based on values in column matches
-    def show_filter_table(self, value, column):
-
-        # note: "column" represents the visual column, but setrowhidden works on logicalindexes and not visual indexes,
-        # so you MUST convert to the logical index if the user moves columns around
-        logical_index = self.horizontalHeader().logicalIndex(column)
+        # if "Blanks" selected in combo box for showing all blank rows
+        elif item_text == "Show Blanks" and item_index == 2:
+            self.filter_engine.set_blanks_hidden(logical_index, False)
 
-        for row in range(self.rowCount()):
-            if row % 2 == 0:
-                item = self.item(row, logical_index)
-
-                if item:
-                    item = item.text()
-
-                # if no value, check if it's qcheckbox and get true/false string
-                if not item:
-                    item = self.header.check_if_parent_cell_is_widget(row, logical_index)
-
-                if item:
-                    if item == value:
-                        self.setRowHidden(row, False)
-                        # reset if there's a "-" in the vertical column from opening the corresponding qtablewidget row
-                        vertical_item = QTableWidgetItem("+")
-                        self.setVerticalHeaderItem(row, vertical_item)
-
-                 # check if blanks selected
-                if value == "Show Blanks":
-                    if not item or item.strip() == "":
-                        self.setRowHidden(row, False)
-                        vertical_item = QTableWidgetItem("+")
-                        self.setVerticalHeaderItem(row, vertical_item)
-
-    # hide rows based on values in column matches
-    def hide_filter_table(self, value, column):
-
-        # note: "column" represents the visual column, but setrowhidden works on logicalindexes and not visual indexes,
-        # so you MUST convert to the logical index if the user moves columns around
-        logical_index = self.horizontalHeader().logicalIndex(column)
+        self.apply_filters()
 
-        for row in range(self.rowCount()):
-            if row % 2 == 0:
-                item = self.item(row, logical_index)
+    # activates when filter options chosen in the searchable filter popup, it has already updated the filter engine
+    @profiled("popup_filter_change")
+    def popup_filter_change(self, column: int):
+        self.apply_filters()
+
+    def mouseMoveEvent(self, event):
+        # hide any header combobox buttons if the mouse is in the qtablewidget.  There's logic to hide comboboxes,
+        # in the header class, however it only works for when mouse moves between headers, Need to have in here as well
+        #, otherwise, if mouse hovering over a header to display the combobox, then moves down to the table, the combobox won't hide
+        try:
+            self.header.hide_filter_buttons()
+        except:
+            pass
+
+        super().mouseMoveEvent(event)
+
+    def sub_table_create(self) -> QWidget:
+        upper_widget = QWidget()
+        upper_widget.setContentsMargins(30, 0, 0, 0)
+        upper_layout = QVBoxLayout()
+        upper_layout.setContentsMargins(0, 0, 0, 10)
+        # reuse a sub table from a closed row if there is one
+        if self.sub_table_pool:
+            sub_table = self.sub_table_pool.pop()
+            created = 1
+        else:
+            sub_table = sub_TableWidget()
+            created = 2
+        if self.profiler is not None:
+            self.profiler.count(widgets=created)
+        upper_layout.addWidget(sub_table)
+        upper_widget.setLayout(upper_layout)
+        return upper_widget
 
-                if item:
-                    item = item.text()
+    # take the sub table back out of a widget made with sub_table_create before the widget is removed from the table
+    # (which deletes it) and keep it for the next sub table that's opened
+    def sub_table_release(self, widget: QWidget):
+        sub_table = widget.findChild(sub_TableWidget)
+        if sub_table is None:
+            return
 
-                # if no value, check if it's qcheckbox and get true/false string
-                if not item:
-                    item = self.header.check_if_parent_cell_is_widget(row, logical_index)
+        try:
+            sub_table.onsubrowChange.disconnect()
+        except TypeError:
+            pass
 
-                if item:
-                    if item == value:
-                        self.setRowHidden(row, True)
-                        # set row below it as hidden as that row is tied to the upper row
-                        self.setRowHidden(row+1, True)
+        if len(self.sub_table_pool) < SUB_TABLE_POOL_SIZE:
+            sub_table.setParent(None)
+            self.sub_table_pool.append(sub_table)
 
-                # check if blanks selected
-                if value == "Hide Blanks":
-                    if not item or item.strip() == "":
-                        self.setRowHidden(row, True)
-                        self.setRowHidden(row+1, True)
+    def get_sub_table_Height(self, widget: QWidget) -> int:
+        table = None
+        # get the qtablewidgetitem (which is in the Qwidget)
+        for child_widget in widget.findChildren(QWidget):
+            if isinstance(child_widget, QTableWidget):
+                table = child_widget
 
-    # return text of cell, for Qcheckboxes will return True or False as text
-    def main_table_cell_item_type_text(self, row: int, col: int, item: QTableWidgetItem) -> Union[None, str]:
-        # if no text in cell, check to see if it's a QWidget with a checkbox and return true or false as the text
-        widget = None
-        if item is None:
-            widget = self.cellWidget(row, col)
-            if widget is not None:
-                # check for Qcheckboxes
-                for child_widget in widget.findChildren(QWidget):
-                    if isinstance(child_widget, QCheckBox):
-                        state = child_widget.checkState()
-                        if state == 2:
-                            item = "True"
-                        elif state == 0:
-                            item = "False"
+        total_height = table.horizontalHeader().height() + 25  # +25 to account for padding
+        for row in range(table.rowCount()):
+            total_height += table.rowHeight(row)
+        return total_height
+
+    # height for the table row a sub table is shown in, only worked out from the widget the first time the parent is
+    # opened or if the number of rows in its sub table has changed since
+    def sub_table_row_height(self, parent: int, widget: QWidget, row_count: int) -> int:
+        cached = self.sub_table_heights.get(parent)
+        if cached is not None and cached[0] == row_count:
+            return cached[1]
+
+        height = self.get_sub_table_Height(widget)
+        self.sub_table_heights[parent] = (row_count, height)
+        return height
+
+    # fill the sub table in a widget made with sub_table_create from plain row data
+    def sub_table_fill(self, widget: QWidget, headers: List[str], rows: List[List[str]]):
+        table = widget.findChild(sub_TableWidget)
+        column_count = max([len(headers)] + [len(row_data) for row_data in rows])
+
+        # table could be a reused one, so clear out the old data
+        table.clearContents()
+        table.setRowCount(len(rows))
+        table.setColumnCount(column_count)
+        table.setHorizontalHeaderLabels(headers)
+
+        for row, row_data in enumerate(rows):
+            table.setRowHeight(row, 18)
+            for col, value in enumerate(row_data):
+                table.setItem(row, col, QTableWidgetItem(value))
+
+
+class CustomTableWidget(FilterTableMixin, QTableWidget):
+    # emitted after each chunk put in the table by load_rows, (parent rows loaded so far, total parent rows or -1 if
+    # the records given don't have a length, like a generator)
+    loadProgress = pyqtSignal(int, int)
+    # emitted when load_rows is finished, number of parent rows loaded
+    loadFinished = pyqtSignal(int)
+
+    def __init__(self):
+        super(CustomTableWidget, self).__init__()
+        # parent row -> widget for the open sub tables.  The widgets aren't cell widgets, they're children of the
+        # viewport laid over the full width of the sub table row (see position_sub_tables), so they don't depend on
+        # spans or on which column is visually first and moving columns never has to touch them.
+        # Made first as updateGeometries uses it
+        self.sub_table_widgets = {}
+
+        self.model().dataChanged.connect(self.on_cellvalue_changed)
+     #   self.itemSelectionChanged.connect(self.selection_changed)
+        self.cellClicked.connect(self.on_cell_clicked)
+
+        self.setup_table()
+
+        self.verticalHeader().sectionClicked.connect(self.main_table_vertical_header_clicked)
+
+        # sub table data is kept as plain lists, parent row -> sub table rows, a sub table widget is only made for it
+        # when the row is opened
+        self.sub_table_headers = []
+        self.sub_table_data = {}
+        # callable(parent row) -> sub table rows, used for parent rows that aren't in sub_table_data
+        self.sub_table_provider = None
+        self.quick_search.sub_table_rows = lambda row: self.sub_table_data.get(row)
+        self.verticalHeader().sectionResized.connect(self.position_sub_tables)
+        self.verticalHeader().sectionMoved.connect(self.position_sub_tables)
+
+        # records still to be put in the table by load_rows, None when nothing is loading
+        self.load_records = None
+        self.load_chunk_size = LOAD_CHUNK_SIZE
+        self.load_count = 0
+        self.load_total = -1
+        self.load_start = 0.0
+        self.load_timer = QTimer(self)
+        self.load_timer.setSingleShot(True)
+        self.load_timer.timeout.connect(self.load_next_chunk)
+
+        # SqliteTableSource the rows are paged in from, see set_data_source
+        self.data_source = None
+        self.source_cursor = None
+
+        # parent row -> row key and back, from the data source or the key_column given to load_rows.  Rows without a
+        # key use the parent row as their key
+        self.key_column = None
+        self.row_keys = {}
+        self.key_rows = {}
+        # parent rows removed by apply_row_deltas, they stay in the table hidden so row numbers never change
+        self.deleted_rows = set()
+        self.verticalScrollBar().valueChanged.connect(self.fetch_source_rows_if_needed)
+
+    # replace the table data with records of (row data, sub table rows).  The rows are put in the table a chunk at a
+    # time with the model signals blocked, giving the event loop a pass between chunks so the window keeps painting,
+    # and the header dropdowns are only rebuilt once at the end.  records can be a generator, each record is used
+    # once to make the cells and the sub table rows are kept as given, so the data is never held twice.
+    # Checkbox column values can be bools or "True"/"False", sub table rows can be None to get them from
+    # sub_table_provider when the row is opened.  key_column is the column with the row ids used by apply_row_deltas
+    # and the write back queue
+    def load_rows(self, headers: List[str], records, sub_table_headers=(), checkbox_columns=(),
+                  chunk_size: int = LOAD_CHUNK_SIZE, key_column: Union[None, int] = None):
+        self.cancel_load()
+        self.data_source = None
+        self.source_cursor = None
+        self.key_column = key_column
+        self.set_columns(headers, sub_table_headers, checkbox_columns)
+        self.clear_rows()
+
+        try:
+            self.load_total = len(records)
+        except TypeError:
+            self.load_total = -1
+        self.load_records = iter(records)
+        self.load_chunk_size = max(1, chunk_size)
+        self.load_count = 0
+        self.load_start = time.perf_counter()
+        self.load_timer.start(0)
+
+    # set up the columns for new data, the filters and sort are reset.  The aggregate columns go after the loaded ones
+    def set_columns(self, headers: List[str], sub_table_headers=(), checkbox_columns=()):
+        self.sub_table_headers = list(sub_table_headers)
+        self.sort_spec = []
+        self.filter_engine.clear()
+        self.sort_keys.clear_column_types()
+
+        if self.data_source is None:
+            headers = self.add_aggregate_headers(headers)
+        else:
+            self.aggregate_start = None
+
+        self.setColumnCount(len(headers))
+        self.setHorizontalHeaderLabels(headers)
+
+        for col in self.checkbox_columns:
+            self.setItemDelegateForColumn(col, None)
+        self.checkbox_columns.clear()
+        self.checkbox_columns.update(checkbox_columns)
+        self.set_checkbox_delegates()
+
+    # remove every row along with its sub table data and index values
+    def clear_rows(self):
+        for row in list(self.sub_table_widgets):
+            self.close_sub_table(row)
+        self.sub_table_data = {}
+        self.sub_table_heights.clear()
+        self.row_keys = {}
+        self.key_rows = {}
+        self.deleted_rows = set()
+        self.filter_engine.reset_rows()
+
+        self.setRowCount(0)
+        self.value_index.clear(self.columnCount())
+        self.sort_keys.invalidate()
+        self.quick_search.invalidate()
+
+    # stop a load_rows that's still going, the rows already loaded stay in the table
+    def cancel_load(self):
+        if self.load_records is None:
+            return
+        self.load_timer.stop()
+        self.finish_load()
+
+    def is_loading(self) -> bool:
+        return self.load_records is not None
+
+    def load_next_chunk(self):
+        if self.load_records is None:
+            return
+
+        records = list(islice(self.load_records, self.load_chunk_size))
+        if records:
+            self.insert_records(records)
+            self.load_count += len(records)
+            self.loadProgress.emit(self.load_count, self.load_total)
+
+        if len(records) < self.load_chunk_size:
+            self.finish_load()
         else:
-            item = item.text()
+            self.load_timer.start(0)
+
+    # add parent rows (and the hidden sub table row below each) to the end of the table, cell values go straight into
+    # the value index as they're set since on_cellvalue_changed doesn't see them with the signals blocked
+    @profiled("load_chunk")
+    def insert_records(self, records):
+        if self.profiler is not None:
+            self.profiler.count(rows=len(records))
+        row = self.rowCount()
+        # the row count has to change with signals on so the headers know about the new rows
+        self.setRowCount(row + 2 * len(records))
+
+        column_count = self.loaded_column_count()
+        checkbox_columns = self.checkbox_columns
+        set_index_value = self.value_index.set_value
+        add_filter_row = self.filter_engine.add_row
+        aggregate_start = self.aggregate_start
 
+        self.model().blockSignals(True)
+        for row_data, sub_table_rows in records:
+            self.setRowHeight(row, 18)
+            self.setVerticalHeaderItem(row, QTableWidgetItem("+"))
+            self.setVerticalHeaderItem(row+1, QTableWidgetItem(""))
+
+            for col in range(column_count):
+                value = row_data[col] if col < len(row_data) else ""
+                if col in checkbox_columns:
+                    checked = value is True or value == "True"
+                    item = self.make_cell_checkbox(checked)
+                    text = "True" if checked else "False"
+                else:
+                    text = "" if value is None else str(value)
+                    item = QTableWidgetItem(text)
+                self.setItem(row, col, item)
+                set_index_value(row, col, text)
+            if aggregate_start is not None:
+                for col, text in enumerate(self.aggregate_values(row, sub_table_rows), aggregate_start):
+                    self.setItem(row, col, self.make_aggregate_item(text))
+                    set_index_value(row, col, text)
+            add_filter_row(row)
+
+            if sub_table_rows is not None:
+                self.sub_table_data[row] = sub_table_rows
+            if self.key_column is not None and self.key_column < len(row_data):
+                self.set_row_key(row, str(row_data[self.key_column]))
+            self.setRowHidden(row+1, True)
+            row += 2
+        self.model().blockSignals(False)
+
+        self.viewport().update()
+
+    def finish_load(self):
+        self.load_records = None
+
+        # a search that's still in the search box is applied to the new rows
+        self.quick_search.invalidate()
+        if self.quick_search.is_active():
+            self.apply_filters()
+
+        # one rebuild of the header dropdowns for everything that was loaded
+        self.header.onSectionCountChanged()
+        self.verticalHeader().viewport().update()
+        self.viewport().update()
+
+        # the whole load including the passes of the event loop between chunks, load_chunk times each chunk.  The
+        # widgets made are the header comboboxes, one per column
+        if self.profiler is not None:
+            self.profiler.record("load_rows", time.perf_counter() - self.load_start, self.load_count,
+                                 self.columnCount())
+
+        self.loadFinished.emit(self.load_count)
+
+    # page the table rows in from a SqliteTableSource as the table is scrolled instead of loading them all.  Sub table
+    # rows are only fetched when a row is opened, and the header filters and sorting are done by the source's SQL
+    # query, so changing them re-queries the source instead of hiding/moving rows already in the table
+    def set_data_source(self, source):
+        self.cancel_load()
+        self.data_source = source
+        self.key_column = None
+        self.sub_table_provider = lambda row: source.sub_table_rows(self.row_keys[row])
+        self.set_columns(source.headers, source.sub_table_headers, source.checkbox_columns)
+        self.reload_source()
+        self.header.onSectionCountChanged()
+
+    # query the source again with the current filters and sort and start again from the first page
+    @profiled("reload_source")
+    def reload_source(self):
+        self.clear_rows()
+        self.source_cursor = self.data_source.query(self.filter_engine, self.sort_spec, self.sort_keys)
+        self.fetch_source_rows()
+        # the dropdown values depend on the other columns' filters
+        self.header.populate_filter_dropdown()
+
+    # put the next page of rows from the source query at the end of the table
+    def fetch_source_rows(self):
+        if self.source_cursor is None:
+            return
+
+        page = self.data_source.fetch_page(self.source_cursor)
+        if len(page) < self.data_source.page_size:
+            self.source_cursor = None
+        if not page:
+            return
+
+        row = self.rowCount()
+        self.insert_records([(row_data, None) for key, row_data in page])
+        for key, row_data in page:
+            self.set_row_key(row, key)
+            row += 2
+
+    # the scroll bar counts rows, or pixels if the table scrolls per pixel
+    def fetch_source_rows_if_needed(self, value: int):
+        margin = SOURCE_FETCH_MARGIN
+        if self.verticalScrollMode() == QAbstractItemView.ScrollPerPixel:
+            margin *= self.verticalHeader().defaultSectionSize()
+        if self.source_cursor is not None and value >= self.verticalScrollBar().maximum() - margin:
+            self.fetch_source_rows()
+
+    # sorting is done by the data source when there is one
+    def set_sort_spec(self, sort_spec: List[Tuple[int, int]]):
+        if self.data_source is None:
+            super().set_sort_spec(sort_spec)
+            return
+        self.sort_spec = list(sort_spec)
+        self.reload_source()
+
+    # values for the header dropdowns come from the whole data source, not just the rows paged in so far
+    def filter_values(self, column: int) -> List[str]:
+        if self.data_source is None:
+            return super().filter_values(column)
+        return self.data_source.distinct_values(column)
+
+    def filter_value_counts(self, column: int) -> dict:
+        if self.data_source is None:
+            return super().filter_value_counts(column)
+        return self.data_source.value_counts(column, self.filter_engine)
+
+    def set_row_key(self, row: int, key):
+        self.row_keys[row] = key
+        self.key_rows[key] = row
+
+    # rows from a data source or loaded with a key_column are identified by their key, others by the parent row
+    def row_key(self, row: int):
+        return self.row_keys.get(row, row)
+
+    def row_for_key(self, key) -> Union[None, int]:
+        if self.row_keys:
+            return self.key_rows.get(key)
+        if isinstance(key, int) and 0 <= key < self.rowCount() and key % 2 == 0 and key not in self.deleted_rows:
+            return key
+        return None
+
+    # patch the table with rows that were changed somewhere else (another user, a shared change table...) without
+    # reloading it, so the sort, filters and open sub tables stay as they are.  upserts are (row key, row data, sub table
+    # rows or None to leave the sub table alone), deletes are row keys.  Only the rows given are touched: their values
+    # go through the value index so the header dropdowns are updated a value at a time, then just those rows are
+    # checked against the filters and moved to where they belong in the current sort
+    @profiled("apply_row_deltas")
+    def apply_row_deltas(self, upserts=(), deletes=()):
+        changed_rows = []
+        changed_columns = set()
+        for key, row_data, sub_table_rows in upserts:
+            row = self.row_for_key(key)
+            if row is None:
+                # rows that are still to be paged in from a data source will come with the query
+                if self.source_cursor is not None:
+                    continue
+                row = self.rowCount()
+                self.insert_records([([], None)])
+                if key != row:
+                    self.set_row_key(row, key)
+                if self.deleted_rows:
+                    # keep the deleted rows at the end, see move_to_sort_positions
+                    self.move_parent_row(row, row // 2 - len(self.deleted_rows))
+
+            changed_columns.update(self.set_row_values(row, row_data))
+            if sub_table_rows is not None:
+                self.sub_table_data[row] = sub_table_rows
+                self.quick_search.invalidate_row(row)
+                self.refresh_sub_table_aggregates(row, sub_table_rows)
+                if row in self.sub_table_widgets:
+                    self.close_sub_table(row)
+                    self.open_sub_table(row)
+            changed_rows.append(row)
+
+        for key in deletes:
+            row = self.row_for_key(key)
+            if row is not None:
+                self.delete_row(row)
+                changed_columns.update(range(self.columnCount()))
+
+        if self.data_source is not None:
+            for column in changed_columns:
+                self.data_source.invalidate(column)
+
+        self.show_hide_rows(*self.filter_engine.update_rows(changed_rows))
+        if self.sort_spec:
+            self.move_to_sort_positions(changed_rows)
+
+        self.viewport().update()
+
+    # set the cells of a parent row without it going through on_cellvalue_changed (so it isn't written back), returns
+    # the columns that changed.  The aggregate columns are left alone
+    def set_row_values(self, row: int, row_data: List) -> set:
+        changed_columns = set()
+        self.model().blockSignals(True)
+        for col in range(self.loaded_column_count()):
+            value = row_data[col] if col < len(row_data) else ""
+            item = self.item(row, col)
+            if col in self.checkbox_columns:
+                checked = value is True or value == "True"
+                text = "True" if checked else "False"
+                if item is None:
+                    self.setItem(row, col, self.make_cell_checkbox(checked))
+                else:
+                    item.setCheckState(Qt.Checked if checked else Qt.Unchecked)
+            else:
+                text = "" if value is None else str(value)
+                if item is None:
+                    self.setItem(row, col, QTableWidgetItem(text))
+                else:
+                    item.setText(text)
+            if self.set_index_value(row, col, text):
+                changed_columns.add(col)
+        self.model().blockSignals(False)
+        return changed_columns
+
+    # take a parent row out of the table.  The row is hidden and moved to the end rather than removed, so the row
+    # numbers everything else is kept by don't change
+    def delete_row(self, row: int):
+        self.close_sub_table(row)
+
+        old_values = [(col, self.value_index.value(row, col)) for col in range(self.value_index.column_count())]
+        self.filter_engine.remove_row(row)
+        self.value_index.remove_row(row)
+        self.sort_keys.remove_row(row)
+        self.quick_search.remove_row(row)
+        for col, value in old_values:
+            if value and self.value_index.value_count(col, value) == 0:
+                self.header.remove_filter_value(col, value)
+
+        self.deleted_rows.add(row)
+        self.sub_table_data.pop(row, None)
+        self.remove_sub_table_aggregates(row)
+        self.sub_table_heights.pop(row, None)
+        key = self.row_keys.pop(row, None)
+        if key is not None:
+            self.key_rows.pop(key, None)
+
+        self.setRowHidden(row, True)
+        self.setRowHidden(row+1, True)
+        self.move_parent_row(row, self.rowCount() // 2 - 1)
+
+    # move a parent row and its sub table row so the parent is the position'th parent row shown
+    def move_parent_row(self, row: int, position: int):
+        vertical_header = self.verticalHeader()
+        current = vertical_header.visualIndex(row)
+        if current == position * 2:
+            return
+        if current > position * 2:
+            vertical_header.moveSection(current, position * 2)
+            vertical_header.moveSection(current + 1, position * 2 + 1)
+        else:
+            vertical_header.moveSection(current + 1, position * 2 + 1)
+            vertical_header.moveSection(current, position * 2)
+
+    # move changed parent rows to where they belong in the current sort.  They're first moved after all the other
+    # rows, then each is put in place with a binary search over the rows before them, which are still in sort order.
+    # Deleted rows are kept after everything so they're never searched
+    def move_to_sort_positions(self, rows: List[int]):
+        rows = [row for row in dict.fromkeys(rows) if row not in self.deleted_rows]
+        if not rows:
+            return
+
+        live_count = self.rowCount() // 2 - len(self.deleted_rows)
+        for row in rows:
+            self.move_parent_row(row, live_count - 1)
+
+        key = self.sort_key_function(self.sort_spec)
+        vertical_header = self.verticalHeader()
+        for sorted_count, row in enumerate(rows, live_count - len(rows)):
+            row_key = key(row)
+            low, high = 0, sorted_count
+            while low < high:
+                mid = (low + high) // 2
+                other = vertical_header.logicalIndex(mid * 2)
+                other_key = key(other)
+                if other_key != row_key:
+                    before = other_key < row_key
+                else:
+                    before = other < row
+                if before:
+                    low = mid + 1
+                else:
+                    high = mid
+            self.move_parent_row(row, low)
+
+    # make row below hidden or not hidden
+    def main_table_vertical_header_clicked(self, row: int):
+        if row % 2 == 0:
+            row_hidden = self.isRowHidden(row+1)
+            if row_hidden:
+                self.open_sub_table(row)
+                self.setRowHidden(row+1, False)
+                item = QTableWidgetItem("-")
+                self.setVerticalHeaderItem(row, item)
+            else:
+                self.setRowHidden(row+1, True)
+                self.close_sub_table(row)
+                item = QTableWidgetItem("+")
+                self.setVerticalHeaderItem(row, item)
+
+    def set_sub_table_rows(self, row: int, rows: List[List[str]]):
+        self.sub_table_data[row] = rows
+        self.refresh_sub_table_aggregates(row, rows)
+
+    def sub_table_rows(self, row: int) -> List[List[str]]:
+        rows = self.sub_table_data.get(row)
+        if rows is None:
+            rows = self.sub_table_provider(row) if self.sub_table_provider is not None else []
+            self.sub_table_data[row] = rows
+            self.refresh_sub_table_aggregates(row, rows)
+        return rows
+
+    # make the sub table widget for the row below a parent row
+    def open_sub_table(self, row: int):
+        if row in self.sub_table_widgets:
+            return
+
+        widget = self.sub_table_create()
+        sub_table_rows = self.sub_table_rows(row)
+        self.sub_table_fill(widget, self.sub_table_headers, sub_table_rows)
+
+        sub_table = widget.findChild(sub_TableWidget)
+        sub_table.onsubrowChange.connect(lambda sub_row, row_data, row=row:
+                                         self.sub_table_row_changed(row, sub_row, row_data))
+
+        widget.setParent(self.viewport())
+        self.sub_table_widgets[row] = widget
+        self.setRowHeight(row+1, self.sub_table_row_height(row, widget, len(sub_table_rows)))
+        self.position_sub_table(row, widget)
+        widget.show()
+
+    # give the sub table widget of a closed row back to the pool, the data stays in sub_table_data
+    def close_sub_table(self, row: int):
+        if row not in self.sub_table_widgets:
+            return
+
+        widget = self.sub_table_widgets.pop(row)
+        self.sub_table_release(widget)
+        widget.hide()
+        widget.deleteLater()
+
+    # lay an open sub table over the whole width of the row below its parent
+    def position_sub_table(self, row: int, widget: QWidget):
+        widget.setGeometry(0, self.rowViewportPosition(row+1), self.viewport().width(), self.rowHeight(row+1))
+
+    # keep the open sub tables over their rows when the table is scrolled, resized or rows are moved/resized.  This is
+    # only the open sub tables, which is only ever a handful of widgets
+    def position_sub_tables(self):
+        for row, widget in self.sub_table_widgets.items():
+            self.position_sub_table(row, widget)
+
+    # the view scrolls the viewport's children along with the cells, sideways too, so the sub tables are put back over
+    # their rows after any scroll
+    def scrollContentsBy(self, dx: int, dy: int):
+        super().scrollContentsBy(dx, dy)
+        if self.sub_table_widgets:
+            self.position_sub_tables()
+
+    def updateGeometries(self):
+        super().updateGeometries()
+        self.position_sub_tables()
+
+    # keep edits made in a sub table widget in the sub table data
+    def sub_table_row_changed(self, row: int, sub_row: int, row_data: List[str]):
+        sub_table_rows = self.sub_table_rows(row)
+        old_row_data = sub_table_rows[sub_row]
+        self.record_sub_table_edit(row, sub_row, old_row_data, row_data)
+        sub_table_rows[sub_row] = list(row_data)
+        self.quick_search.invalidate_row(row)
+        self.sub_table_aggregates_row_changed(row, sub_table_rows, old_row_data, sub_table_rows[sub_row])
+
+    # columns loaded from the row data, the aggregate columns come after them
+    def loaded_column_count(self) -> int:
+        if self.aggregate_start is None:
+            return self.columnCount()
+        return self.aggregate_start
+
+    # aggregate cells are plain text that can't be edited
+    def make_aggregate_item(self, text: str) -> QTableWidgetItem:
+        item = QTableWidgetItem(text)
+        item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
         return item
 
+    # the value index already has the new value, so on_cellvalue_changed has nothing to do for it
+    def set_aggregate_cell(self, row: int, col: int, text: str):
+        item = self.item(row, col)
+        if item is None:
+            self.setItem(row, col, self.make_aggregate_item(text))
+        else:
+            item.setText(text)
+
+    def on_cellvalue_changed(self, top_left=None, bottom_right=None):
+        # no cells given, rebuild everything
+        if top_left is None or bottom_right is None:
+            self.rebuild_value_index()
+            self.header.populate_filter_dropdown()
+            return
+
+        # implementation for when user changes data in cell to update the header qcombobox with the new data,
+        # only the changed cells are looked at
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            if row % 2 == 0:
+                for col in range(top_left.column(), bottom_right.column() + 1):
+                    text = self.main_table_cell_item_type_text(row, col, self.item(row, col))
+                    if not self.set_index_value(row, col, text):
+                        continue
+                    if col in self.checkbox_columns:
+                        self.checkbox_value_changed(row, col, text == "True")
+                    else:
+                        self.record_edit(row, col, text)
+
+    # this needs to be run whenever the table is populated/re-populated with data (signals are normally blocked
+    # while populating, so the cell changes aren't picked up by on_cellvalue_changed)
+    def rebuild_value_index(self):
+        self.value_index.clear(self.columnCount())
+        self.sort_keys.invalidate()
+        self.quick_search.invalidate()
+        self.filter_engine.invalidate_counts()
+        self.checkbox_columns.clear()
+        for row in range(0, self.rowCount(), 2):
+            for col in range(self.columnCount()):
+                item = self.item(row, col)
+                if item is not None and item.data(Qt.CheckStateRole) is not None:
+                    self.checkbox_columns.add(col)
+                self.value_index.set_value(row, col, self.main_table_cell_item_type_text(row, col, item))
+
+        self.set_checkbox_delegates()
+
+    # combine the filters of every column and only touch the rows whose hidden state changes
+    def apply_filters(self):
+        # filtered out rows aren't fetched from a data source at all
+        if self.data_source is not None:
+            self.reload_source()
+            return
+
+        self.show_hide_rows(*self.filter_engine.update())
+
+    # only the rows whose hidden state changed are given.  Each setRowHidden repaints and re-lays out the table when
+    # it's done one at a time, so painting is turned off and the vertical header's resize signals are blocked while
+    # they're done, then the table is laid out and painted once
+    def show_hide_rows(self, newly_hidden: set, newly_shown: set):
+        if self.profiler is not None:
+            self.profiler.count(rows=len(newly_hidden) + len(newly_shown))
+        if not newly_hidden and not newly_shown:
+            return
+
+        vertical_header = self.verticalHeader()
+        updates_enabled = self.updatesEnabled()
+        self.setUpdatesEnabled(False)
+        vertical_header.blockSignals(True)
+        try:
+            for row in newly_hidden:
+                self.setRowHidden(row, True)
+                # set row below it as hidden as that row is tied to the upper row (it's only showing if its sub table
+                # is), and put the "-" in the vertical header back to "+" for when the row is shown again
+                if row in self.sub_table_widgets or not self.isRowHidden(row+1):
+                    self.setRowHidden(row+1, True)
+                    self.setVerticalHeaderItem(row, QTableWidgetItem("+"))
+                self.close_sub_table(row)
+
+            for row in newly_shown:
+                self.setRowHidden(row, False)
+        finally:
+            vertical_header.blockSignals(False)
+            self.setUpdatesEnabled(updates_enabled)
+
+        # updateGeometries also moves the open sub tables to where their rows ended up
+        self.updateGeometries()
+        vertical_header.viewport().update()
+        self.viewport().update()
+
+    # return text of cell, for checkboxes will return True or False as text
+    def main_table_cell_item_type_text(self, row: int, col: int, item: QTableWidgetItem) -> Union[None, str]:
+        if item is None:
+            return None
+
+        # checkbox cells have a check state instead of text
+        state = item.data(Qt.CheckStateRole)
+        if state is not None:
+            return "True" if state == Qt.Checked else "False"
+
+        return item.text()
+
     def main_table_get_all_data(self) -> Tuple[List[List], List[List]]:
         visible_table_data = []
         hidden_table_data = []
@@ -556,14 +3172,14 @@ class CustomTableWidget(QTableWidget):
         # if there is filters applied
 
         # get visible rows first
-        for row in range(self.rowCount()):
-            if row % 2 == 0 and not self.isRowHidden(row):
+        for row in self.parent_rows():
+            if not self.isRowHidden(row):
                 row_data = self.main_table_get_row_data(row)
                 visible_table_data.append(row_data)
 
         # now get hidden rows
-        for row in range(self.rowCount()):
-            if row % 2 == 0 and self.isRowHidden(row):
+        for row in self.parent_rows():
+            if self.isRowHidden(row):
                 row_data = self.main_table_get_row_data(row)
                 hidden_table_data.append(row_data)
 
@@ -580,84 +3196,89 @@ class CustomTableWidget(QTableWidget):
             else:
                 row_data.append("")
 
-        # append sub table widget data in row below to be used with sorting
-        row_below_widget = self.cellWidget(row+1, 0)
-        sub_table_data = self.get_sub_table_data(row_below_widget)
-        row_data.append(sub_table_data)
+        # append sub table data of the row below
+        row_data.append([list(sub_row) for sub_row in self.sub_table_rows(row)])
 
         return row_data
 
-    def main_table_repopulate_all(self, visible_table_data: List[List], hidden_table_data: List[List]):
-
-        # map sorted visible data back to table
-        table_index = 0
-        for row in range(self.rowCount()):
-            if row % 2 == 0 and not self.isRowHidden(row):
-                self.main_table_repopulate_row(row, visible_table_data[table_index])
-                table_index +=1
-
-        # map hidden data back to table (not sorted)
-        table_index = 0
-        for row in range(self.rowCount()):
-            if row % 2 == 0 and self.isRowHidden(row):
-                self.main_table_repopulate_row(row, hidden_table_data[table_index])
-                table_index +=1
-
-    def main_table_repopulate_row(self, row: int, table_data: List):
-        # on the odd rows change sub_table data to match what was in the sub_table of the paired even column
-        self.update_sub_table_on_sort(row+1, table_data[-1])
-        self.update_main_table_row_height_for_subtable(row+1)
-
-        # set all rows with the qtablewidget as hidden on sort changes... mostly so i don't have to implement
-        # code to tracking which qtablewidget rows are not hidden before a sort so that the non-hidden rows
-        # are in proper spots on sort changes
-        self.setRowHidden(row+1, True)
-        vertical_item = QTableWidgetItem("+")
-        self.setVerticalHeaderItem(row, vertical_item)
-
-        for col in range(self.columnCount()):
-            #check if column has widgets with qcheckboxes
-            widget = self.cellWidget(row, col)
-
-            # if not widget in cell
-            if widget is None:
-                item = QTableWidgetItem(table_data[col])
-                self.setItem(row, col, item)
-
-            # if widget in cell, check for qcheckbox and set state of it, i may want to make this it's own function
-            elif widget is not None:
-                checkbox_widget = None
-                # get the qtablewidgetitem (which is in the Qwidget)
-                for child_widget in widget.findChildren(QWidget):
-                    if isinstance(child_widget, QCheckBox):
-                        checkbox_widget = child_widget
-
-                if checkbox_widget is not None:
-                    if table_data[col] == "True":
-                        checkbox_widget.setCheckState(Qt.Checked)
-                    else:
-                        checkbox_widget.setCheckState(Qt.Unchecked)
-
-    # activates when headers clicked to sort table
-    def sort_column_change(self, column: int):
-
-        sort_order = self.horizontalHeader().sortIndicatorOrder()
-
-        visible_table_data, hidden_table_data = self.main_table_get_all_data()
-
-        # sort visible table data
-        if sort_order == 1:
-            visible_table_data = sorted(visible_table_data, key=lambda x: x[column])
-        elif sort_order == 0:
-            visible_table_data = sorted(visible_table_data, key=lambda x: x[column], reverse=True)
-
-        # block signals while repopulating table is faster
-        self.model().blockSignals(True)
-        self.main_table_repopulate_all(visible_table_data, hidden_table_data)
-        self.model().blockSignals(False)
-
-        # force a repaint after unblocking signals updates the tablewidget on screen fast
-        self.viewport().repaint()
+    # TableSnapshot of the rows shown in the order they're shown, values are copied from the value index rather than
+    # read from the items.  With a data source the export reads the whole query, not just the rows paged in so far
+    def export_snapshot(self, include_sub_tables: bool = False):
+        columns = self.visual_columns()
+        if self.data_source is not None:
+            return self.data_source.export_snapshot(self.filter_engine, self.sort_spec, self.sort_keys, columns,
+                                                    include_sub_tables)
+
+        # parent rows are moved with their sub table row, so they're at the even visual positions
+        vertical_header = self.verticalHeader()
+        rows = []
+        for visual_row in range(0, self.rowCount(), 2):
+            row = vertical_header.logicalIndex(visual_row)
+            if not self.isRowHidden(row):
+                rows.append(row)
+
+        # sub tables that aren't loaded yet are read from the provider here on the gui thread, they aren't kept so the
+        # export doesn't load every sub table into the table
+        sub_tables = None
+        if include_sub_tables:
+            sub_tables = {}
+            for row in rows:
+                sub_table_rows = self.sub_table_data.get(row)
+                if sub_table_rows is None:
+                    sub_table_rows = self.sub_table_provider(row) if self.sub_table_provider is not None else []
+                sub_tables[row] = list(sub_table_rows)
+
+        return TableSnapshot(self.export_headers(columns), rows,
+                             [self.value_index.copy_column(column) for column in columns],
+                             [column in self.checkbox_columns for column in columns],
+                             self.sub_table_headers, sub_tables)
+
+    # parent rows are the even rows of the table
+    def parent_rows(self) -> List[int]:
+        if self.deleted_rows:
+            return [row for row in range(0, self.rowCount(), 2) if row not in self.deleted_rows]
+        return range(0, self.rowCount(), 2)
+
+    # put the parent rows (with the sub table row below each one) in the given order.  Only the vertical header sections
+    # are moved, so every row keeps its items, checkboxes and sub table widget and the row numbers (logical indexes)
+    # used everywhere else never change.  Rows not in parent_rows (the deleted rows) stay after them in the order
+    # they're in now
+    def apply_row_order(self, parent_rows: List[int]):
+        if self.profiler is not None:
+            self.profiler.count(rows=len(parent_rows))
+        vertical_header = self.verticalHeader()
+        row_count = self.rowCount()
+
+        logical_order = []
+        for row in parent_rows:
+            logical_order.append(row)
+            if row + 1 < row_count:
+                logical_order.append(row + 1)
+        if len(logical_order) < row_count:
+            placed = set(logical_order)
+            logical_order.extend(logical_row for logical_row in
+                                 (vertical_header.logicalIndex(visual_row) for visual_row in range(row_count))
+                                 if logical_row not in placed)
+
+        # each row is swapped straight into its place, swapSections only touches the two sections so the whole order
+        # is O(rows) where moveSection would shift every section in between.  Sizes and hidden states go with the
+        # sections.  Signals and painting are off while swapping, the table is updated once at the end
+        updates_enabled = self.updatesEnabled()
+        self.setUpdatesEnabled(False)
+        vertical_header.blockSignals(True)
+        try:
+            for position, logical_row in enumerate(logical_order):
+                visual_row = vertical_header.visualIndex(logical_row)
+                if visual_row != position:
+                    vertical_header.swapSections(visual_row, position)
+        finally:
+            vertical_header.blockSignals(False)
+            self.setUpdatesEnabled(updates_enabled)
+
+        # updateGeometries also moves the open sub tables to where their rows ended up
+        self.updateGeometries()
+        vertical_header.viewport().update()
+        self.viewport().update()
 
     def get_sub_table_data(self, sub_table_widget: QWidget) -> List[List]:
         table = None
@@ -679,109 +3300,36 @@ class CustomTableWidget(QTableWidget):
 
         return table_data
 
-    def update_sub_table_on_sort(self, row: int, sub_table_array: List[List]):
-
-        current_widget = self.cellWidget(row, 0)
-
-        old_sub_table = None
-        # get the qtablewidget (which is in the Qwidget)
-        for child_widget in current_widget.findChildren(QWidget):
-            if isinstance(child_widget, QTableWidget):
-                old_sub_table = child_widget
-
-        old_sub_table.setRowCount(len(sub_table_array))
-
-        # repopulate table
-        if len(sub_table_array) != 0:
-            for row in range(old_sub_table.rowCount()):
-                for col in range(old_sub_table.columnCount()):
-                    item = QTableWidgetItem(sub_table_array[row][col])
-                    old_sub_table.setItem(row, col, item)
-
-                old_sub_table.setRowHeight(row, 18)
-
     def update_main_table_row_height_for_subtable(self, row: int):
-        current_widget = self.cellWidget(row, 0)
-        height = self.get_sub_table_Height(current_widget)
-        self.setRowHeight(row, height)
-
-    # adjust spans for the rows with qtablewidgets when user moves columns, otherwise qtablewidget will move around
+        if row-1 in self.sub_table_widgets:
+            current_widget = self.sub_table_widgets[row-1]
+            # forget the cached height so it's worked out again from the widget
+            self.sub_table_heights.pop(row-1, None)
+            height = self.sub_table_row_height(row-1, current_widget, len(self.sub_table_rows(row-1)))
+            self.setRowHeight(row, height)
+
+    # nothing to do when the user moves columns, the sub tables are laid over the full width of their rows rather than
+    # being spanned from the first column, see position_sub_tables
+    @profiled("adjust_spans")
     def adjust_spans(self, col_reset_subtable_position: int):
+        pass
 
-        for row in range(self.rowCount()):
-            if row % 2 == 1:
-                current_widget = self.cellWidget(row, 0)
-                # remove span and remake it: THIS IS THE ONLY WAY TO GET SUB_TABLE WIDGET for the row back into correct position
-                # when user moves a column
-                for column in range(self.columnCount()):
-                    self.setSpan(row, column, 1, 1)
-
-                self.setSpan(row, col_reset_subtable_position, 1, self.columnCount())
-
-                # only reset cellwidget if the section moved into column 0 changes (visually)... otherwise
-                # the connect signals gets lost for the vertical header... i don't know why
-                if col_reset_subtable_position != 0:
-                    self.setCellWidget(row, col_reset_subtable_position, current_widget)
-
-    def mouseMoveEvent(self, event):
-        # hide any header combobox buttons if the mouse is in the qtablewidget.  There's logic to hide comboboxes,
-        # in the header class, however it only works for when mouse moves between headers, Need to have in here as well
-        #, otherwise, if mouse hovering over a header to display the combobox, then moves down to the table, the combobox won't hide
-        try:
-            for button in self.header.m_buttons:
-                button.hide()
-        except:
-            pass
-
-        super().mouseMoveEvent(event)
-
-    def make_cell_checkbox(self) -> QWidget:
-        upper_widget = QWidget()
-        upper_widget.setContentsMargins(0, 0, 0, 0)
-        upper_layout = QVBoxLayout()
-        upper_layout.setContentsMargins(0, 0, 0, 0)
-        upper_layout.setAlignment(Qt.AlignCenter)
-        checkbox = QCheckBox("")
-        checkbox.stateChanged.connect(lambda state, checkbox=checkbox: self.checkbox_value_changed(state))
-        upper_layout.addWidget(checkbox)
-        upper_widget.setLayout(upper_layout)
-        return upper_widget
-
-    def sub_table_create(self) -> QWidget:
-        upper_widget = QWidget()
-        upper_widget.setContentsMargins(30, 0, 0, 0)
-        upper_layout = QVBoxLayout()
-        upper_layout.setContentsMargins(0, 0, 0, 10)
-        sub_table = sub_TableWidget()
-        upper_layout.addWidget(sub_table)
-        upper_widget.setLayout(upper_layout)
-        return upper_widget
-
-    def get_sub_table_Height(self, widget: QWidget) -> int:
-        table = None
-        # get the qtablewidgetitem (which is in the Qwidget)
-        for child_widget in widget.findChildren(QWidget):
-            if isinstance(child_widget, QTableWidget):
-                table = child_widget
-
-        total_height = table.horizontalHeader().height() + 25  # +25 to account for padding
-        for row in range(table.rowCount()):
-            total_height += table.rowHeight(row)
-        return total_height
-
-    # not used for anything at the moment, will be used when this is connected with a SQL database to update dateabase
-    @pyqtSlot()
-    def checkbox_value_changed(self, state: int):
-        # get to the Qwidget item (which is the parent), as this is what i need to figure out what row it's in
-        widget = self.sender().parent()
-        row = self.indexAt(widget.pos()).row()
-        col = self.indexAt(widget.pos()).column()
+    # item for a checkbox cell, the checkbox itself is drawn by the checkbox delegate
+    def make_cell_checkbox(self, checked: bool = False) -> QTableWidgetItem:
+        item = QTableWidgetItem()
+        item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable)
+        item.setCheckState(Qt.Checked if checked else Qt.Unchecked)
+        return item
 
-        # repopulate header filter
-        self.on_cellvalue_changed()
+    # checkbox clicked, goes to the write back queue if there is one
+    def checkbox_value_changed(self, row: int, col: int, checked: bool):
+        self.record_edit(row, col, checked)
 
 
 class sub_TableWidget(QTableWidget):
+    # emitted when a sub table row is changed through the sub_table_window dialog, (row, row data)
+    onsubrowChange = pyqtSignal(int, list)
+
     def __init__(self):
         super(sub_TableWidget, self).__init__()
 
@@ -814,107 +3362,1076 @@ class sub_TableWidget(QTableWidget):
             item = QTableWidgetItem(row_data[i])
             table.setItem(row, i, item)
 
+        self.onsubrowChange.emit(row, row_data)
+
+
+# model for CustomTableView.  The data is kept as plain python lists, one list per column, instead of a
+# QTableWidgetItem per cell and a QWidget per checkbox.  Checkbox columns hold bools and are shown through the
+# CheckStateRole.  Each parent row can have a sub table below it, but the sub table row only exists in the model while
+# the parent is expanded, and rows hidden by the filters aren't in the model at all, so the rows the view sees
+# (view_rows) are built from the parent order, the hidden parents and the expanded parents
+class CustomTableModel(QAbstractTableModel):
+    def __init__(self, parent=None):
+        super(CustomTableModel, self).__init__(parent)
+        self.headers = []
+        # one list per logical column, index in the list is the parent number
+        self.columns = []
+        self.checkbox_columns = set()
+        # columns that can't be edited, the sub table aggregate columns
+        self.read_only_columns = set()
+
+        self.sub_table_headers = []
+        # sub table rows for each parent, None until needed if a sub_table_provider is used
+        self.sub_tables = []
+        # callable(parent) -> sub table rows, used for sub tables that aren't loaded yet
+        self.sub_table_provider = None
+
+        # parent numbers in sorted order
+        self.order = []
+        # parents hidden by the filters
+        self.hidden = set()
+        # parents with the sub table row shown
+        self.expanded = set()
+
+        # what is in each row of the view, parent number for a parent row and ~parent (negative) for a sub table row
+        self.view_rows = []
+
+    def set_table_data(self, headers: List[str], rows, sub_tables=None, checkbox_columns=(),
+                       sub_table_headers=()):
+        self.beginResetModel()
+        self.headers = list(headers)
+        self.checkbox_columns = set(checkbox_columns)
+        self.sub_table_headers = list(sub_table_headers)
+
+        # cells are kept as text like the table widget's, values from a database cursor can be numbers or None
+        self.columns = [[] for _ in self.headers]
+        for row_data in rows:
+            for col, column in enumerate(self.columns):
+                value = row_data[col] if col < len(row_data) else ""
+                if col in self.checkbox_columns:
+                    value = value is True or value == "True"
+                else:
+                    value = "" if value is None else str(value)
+                column.append(value)
 
-class MainWindow(QMainWindow):
+        parent_count = len(self.columns[0]) if self.columns else 0
+        if sub_tables is None:
+            self.sub_tables = [None] * parent_count
+        else:
+            self.sub_tables = list(sub_tables)
+
+        self.order = list(range(parent_count))
+        self.hidden = set()
+        self.expanded = set()
+        self._build_view_rows()
+        self.endResetModel()
+
+    def parent_count(self) -> int:
+        return len(self.order)
+
+    def _build_view_rows(self):
+        view_rows = []
+        hidden = self.hidden
+        expanded = self.expanded
+        for parent in self.order:
+            if parent not in hidden:
+                view_rows.append(parent)
+                if parent in expanded:
+                    view_rows.append(~parent)
+        self.view_rows = view_rows
+
+    # rebuild the rows the view sees after sorting/filtering.  This is done as a layout change rather than a model
+    # reset so the header keeps its moved/resized columns, and the persistent indexes (selection and the sub table
+    # widgets) are moved to wherever their parent ended up
+    def refresh_view_rows(self):
+        self.layoutAboutToBeChanged.emit([], QAbstractItemModel.VerticalSortHint)
+
+        old_view_rows = self.view_rows
+        old_indexes = self.persistentIndexList()
+        self._build_view_rows()
+
+        wanted = {old_view_rows[index.row()] for index in old_indexes}
+        new_positions = {}
+        if wanted:
+            for row, parent in enumerate(self.view_rows):
+                if parent in wanted:
+                    new_positions[parent] = row
+
+        new_indexes = []
+        for index in old_indexes:
+            row = new_positions.get(old_view_rows[index.row()])
+            new_indexes.append(self.index(row, index.column()) if row is not None else QModelIndex())
+        self.changePersistentIndexList(old_indexes, new_indexes)
+
+        self.layoutChanged.emit([], QAbstractItemModel.VerticalSortHint)
+
+    def set_order(self, order: List[int]):
+        self.order = order
+        self.refresh_view_rows()
+
+    def set_hidden(self, hidden: set):
+        self.hidden = set(hidden)
+        # sub table rows of filtered out parents are closed, same as the table widget
+        self.expanded -= self.hidden
+        self.refresh_view_rows()
+
+    # parent number for a parent row of the view, None for sub table rows
+    def parent_at(self, row: int) -> Union[None, int]:
+        parent = self.view_rows[row]
+        if parent < 0:
+            return None
+        return parent
+
+    # (view row, parent) for all sub table rows currently in the view
+    def expanded_rows(self) -> List[Tuple[int, int]]:
+        if not self.expanded:
+            return []
+        return [(row, ~parent) for row, parent in enumerate(self.view_rows) if parent < 0]
+
+    def expand_row(self, row: int):
+        parent = self.view_rows[row]
+        self.beginInsertRows(QModelIndex(), row + 1, row + 1)
+        self.expanded.add(parent)
+        self.view_rows.insert(row + 1, ~parent)
+        self.endInsertRows()
+        self.headerDataChanged.emit(Qt.Vertical, row, row)
+
+    def collapse_row(self, row: int):
+        parent = self.view_rows[row]
+        self.beginRemoveRows(QModelIndex(), row + 1, row + 1)
+        self.expanded.discard(parent)
+        del self.view_rows[row + 1]
+        self.endRemoveRows()
+        self.headerDataChanged.emit(Qt.Vertical, row, row)
+
+    def sub_table_rows(self, parent: int) -> List[List[str]]:
+        rows = self.sub_tables[parent]
+        if rows is None:
+            rows = self.sub_table_provider(parent) if self.sub_table_provider is not None else []
+            self.sub_tables[parent] = rows
+        return rows
+
+    # text of a cell the same way the table widget gives it, "True"/"False" for checkboxes
+    def cell_text(self, parent: int, column: int) -> str:
+        value = self.columns[column][parent]
+        if column in self.checkbox_columns:
+            return "True" if value else "False"
+        return value
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.view_rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        parent = self.view_rows[index.row()]
+        if parent < 0:
+            return None
+
+        column = index.column()
+        if column in self.checkbox_columns:
+            if role == Qt.CheckStateRole:
+                return Qt.Checked if self.columns[column][parent] else Qt.Unchecked
+            return None
+
+        if role == Qt.DisplayRole or role == Qt.EditRole:
+            return self.columns[column][parent]
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        parent = self.view_rows[index.row()]
+        if parent < 0:
+            return False
+
+        column = index.column()
+        if column in self.checkbox_columns:
+            if role != Qt.CheckStateRole:
+                return False
+            self.columns[column][parent] = value == Qt.Checked
+        elif role == Qt.EditRole:
+            self.columns[column][parent] = value
+        else:
+            return False
+
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def flags(self, index):
+        if self.view_rows[index.row()] < 0:
+            return Qt.ItemIsEnabled
+        if index.column() in self.checkbox_columns:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+        if index.column() in self.read_only_columns:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsEditable
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+
+        if orientation == Qt.Horizontal:
+            if section < len(self.headers):
+                return self.headers[section]
+            return None
+
+        # "+"/"-" in the vertical header for opening/closing the sub table row
+        parent = self.view_rows[section]
+        if parent < 0:
+            return ""
+        return "-" if parent in self.expanded else "+"
+
+
+# QTableView version of CustomTableWidget for big tables, works the same (ButtonHeaderView filters, sorting,
+# checkbox columns and sub tables that open under the parent rows) but the data is in a CustomTableModel.
+# Sub table widgets are only made for the expanded parent rows.
+# Load data with set_table_data
+class CustomTableView(FilterTableMixin, QTableView):
 
     def __init__(self):
+        super(CustomTableView, self).__init__()
+        self.table_model = CustomTableModel(self)
+        self.setModel(self.table_model)
+        self.model().dataChanged.connect(self.on_cellvalue_changed)
+        self.clicked.connect(self.on_cell_clicked)
+
+        self.setup_table()
+
+        self.verticalHeader().sectionClicked.connect(self.main_table_vertical_header_clicked)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setDefaultSectionSize(18)
+
+        self.quick_search.sub_table_rows = lambda parent: self.table_model.sub_tables[parent]
+
+    @profiled("set_table_data")
+    def set_table_data(self, headers: List[str], rows, sub_tables=None, checkbox_columns=(),
+                       sub_table_headers=(), sub_table_provider=None):
+        self.filter_engine.clear()
+        self.filter_engine.reset_rows()
+        self.sort_spec = []
+        self.sort_keys.clear_column_types()
+        self.sub_table_heights.clear()
+        self.table_model.sub_table_provider = sub_table_provider
+        self.table_model.set_table_data(self.add_aggregate_headers(headers), rows, sub_tables, checkbox_columns,
+                                        sub_table_headers)
+        self.fill_aggregate_columns()
+        if self.profiler is not None:
+            self.profiler.count(rows=self.table_model.parent_count())
+        self.checkbox_columns.clear()
+        self.checkbox_columns.update(self.table_model.checkbox_columns)
+        self.set_checkbox_delegates()
+
+        # this needs to be run whenever table is populated/re-populated with data to reset
+        # the items in the qcombobox headers
+        self.rebuild_value_index()
+        self.header.onSectionCountChanged()
+
+        # a search that's still in the search box is applied to the new rows
+        if self.quick_search.is_active():
+            self.apply_filters()
+
+    # aggregate columns of the loaded sub tables go straight into the model columns, the value index is built from
+    # them afterwards
+    def fill_aggregate_columns(self):
+        model = self.table_model
+        if self.aggregate_start is None:
+            model.read_only_columns = set()
+            return
+
+        aggregate_columns = model.columns[self.aggregate_start:]
+        model.read_only_columns = set(range(self.aggregate_start, len(model.columns)))
+        for parent, sub_table_rows in enumerate(model.sub_tables):
+            if sub_table_rows is not None:
+                for column, text in zip(aggregate_columns, self.aggregate_values(parent, sub_table_rows)):
+                    column[parent] = text
+
+    def rebuild_value_index(self):
+        model = self.table_model
+        self.value_index.clear(len(model.columns))
+        self.sort_keys.invalidate()
+        self.quick_search.invalidate()
+        self.filter_engine.invalidate_counts()
+        for col, values in enumerate(model.columns):
+            if col in model.checkbox_columns:
+                values = ["True" if value else "False" for value in values]
+            self.value_index.set_column(col, values)
+
+    def on_cellvalue_changed(self, top_left=None, bottom_right=None):
+        # no cells given, rebuild everything
+        if top_left is None or bottom_right is None:
+            self.rebuild_value_index()
+            self.header.populate_filter_dropdown()
+            return
+
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            parent = self.table_model.parent_at(row)
+            if parent is not None:
+                for col in range(top_left.column(), bottom_right.column() + 1):
+                    if self.set_index_value(parent, col, self.table_model.cell_text(parent, col)):
+                        self.record_edit(parent, col, self.table_model.columns[col][parent])
+
+    def apply_filters(self):
+        newly_hidden, newly_shown = self.filter_engine.update()
+        if self.profiler is not None:
+            self.profiler.count(rows=len(newly_hidden) + len(newly_shown))
+        if newly_hidden or newly_shown:
+            # sub tables of parents being filtered out go back to the pool
+            for row, parent in self.table_model.expanded_rows():
+                if parent in newly_hidden:
+                    self.release_sub_table(row)
+
+            self.table_model.set_hidden(self.filter_engine.hidden_rows)
+            self.update_sub_table_spans()
+
+    def parent_rows(self) -> range:
+        return range(self.table_model.parent_count())
+
+    # TableSnapshot of the parents shown in sorted order, copied from the model's column lists
+    def export_snapshot(self, include_sub_tables: bool = False) -> TableSnapshot:
+        model = self.table_model
+        columns = self.visual_columns()
+        hidden = model.hidden
+        rows = [parent for parent in model.order if parent not in hidden]
+
+        # sub tables that aren't loaded yet are read from the provider here on the gui thread, see the table widget
+        sub_tables = None
+        if include_sub_tables:
+            sub_tables = {}
+            provider = model.sub_table_provider
+            for parent in rows:
+                sub_table_rows = model.sub_tables[parent]
+                if sub_table_rows is None:
+                    sub_table_rows = provider(parent) if provider is not None else []
+                sub_tables[parent] = list(sub_table_rows)
+
+        return TableSnapshot(self.export_headers(columns), rows, [list(model.columns[column]) for column in columns],
+                             [column in model.checkbox_columns for column in columns],
+                             model.sub_table_headers, sub_tables)
+
+    def apply_row_order(self, parent_rows: List[int]):
+        if self.profiler is not None:
+            self.profiler.count(rows=len(parent_rows))
+        self.table_model.set_order(parent_rows)
+        self.update_sub_table_spans()
+
+    # open/close the sub table row below a parent row
+    def main_table_vertical_header_clicked(self, row: int):
+        parent = self.table_model.parent_at(row)
+        if parent is None:
+            return
+
+        if parent in self.table_model.expanded:
+            self.release_sub_table(row + 1)
+            self.table_model.collapse_row(row)
+        else:
+            self.table_model.expand_row(row)
+            self.attach_sub_table(row + 1, parent)
+
+    def attach_sub_table(self, row: int, parent: int):
+        widget = self.sub_table_create()
+        loaded = self.table_model.sub_tables[parent] is not None
+        sub_table_rows = self.table_model.sub_table_rows(parent)
+        if not loaded:
+            self.refresh_sub_table_aggregates(parent, sub_table_rows)
+        self.sub_table_fill(widget, self.table_model.sub_table_headers, sub_table_rows)
+
+        sub_table = widget.findChild(sub_TableWidget)
+        sub_table.onsubrowChange.connect(lambda sub_row, row_data, parent=parent:
+                                         self.sub_table_row_changed(parent, sub_row, row_data))
+
+        # span from whatever column is visually first so the sub table always starts at the left of the table
+        span_column = self.horizontalHeader().logicalIndex(0)
+        self.setSpan(row, span_column, 1, self.table_model.columnCount())
+        self.setIndexWidget(self.table_model.index(row, span_column), widget)
+        self.setRowHeight(row, self.sub_table_row_height(parent, widget, len(sub_table_rows)))
+
+    # spans don't move with the rows when the model layout changes (the sub table widgets do), so redo them for the
+    # expanded rows, which is only a handful of rows
+    def update_sub_table_spans(self):
+        self.clearSpans()
+        span_column = self.horizontalHeader().logicalIndex(0)
+        for row, parent in self.table_model.expanded_rows():
+            widget_column = None
+            for col in range(self.table_model.columnCount()):
+                if self.indexWidget(self.table_model.index(row, col)) is not None:
+                    widget_column = col
+                    break
+
+            # sub table widget has to be in the first visual column for the span to show it
+            if widget_column == span_column:
+                self.setSpan(row, span_column, 1, self.table_model.columnCount())
+            else:
+                if widget_column is not None:
+                    self.release_sub_table(row)
+                    self.setIndexWidget(self.table_model.index(row, widget_column), None)
+                self.attach_sub_table(row, parent)
+
+    # put the sub table of a sub table row back in the pool before the view deletes the widget it's in
+    def release_sub_table(self, row: int):
+        for col in range(self.table_model.columnCount()):
+            widget = self.indexWidget(self.table_model.index(row, col))
+            if widget is not None:
+                self.sub_table_release(widget)
+                return
+
+    # keep edits made in a sub table widget in the model data
+    def sub_table_row_changed(self, parent: int, row: int, row_data: List[str]):
+        sub_table_rows = self.table_model.sub_table_rows(parent)
+        old_row_data = sub_table_rows[row]
+        self.record_sub_table_edit(parent, row, old_row_data, row_data)
+        sub_table_rows[row] = list(row_data)
+        self.quick_search.invalidate_row(parent)
+        self.sub_table_aggregates_row_changed(parent, sub_table_rows, old_row_data, sub_table_rows[row])
+
+    # the value index already has the new value, the model column is set directly so it isn't seen as an edit
+    def set_aggregate_cell(self, parent: int, column: int, text: str):
+        self.table_model.columns[column][parent] = text
+        self.viewport().update()
+
+    # move the sub table spans to the new first column when the user moves columns around
+    @profiled("adjust_spans")
+    def adjust_spans(self, col_reset_subtable_position: int):
+        self.update_sub_table_spans()
+
+
+# excluded values of a column passed as one parameter each in a NOT IN (...), more than this go in one json parameter
+SQLITE_IN_PARAMS = 500
+
+
+# reads the cursors of a query one after the other, the sorted query of SqliteTableSource is a cursor over the rows
+# with a value in the main sort column followed by one over the blank rows
+class SqliteCursorChain:
+    def __init__(self, cursors):
+        self.cursors = deque(cursors)
+
+    def fetchmany(self, size: int) -> list:
+        rows = []
+        while self.cursors and len(rows) < size:
+            wanted = size - len(rows)
+            page = self.cursors[0].fetchmany(wanted)
+            rows.extend(page)
+            if len(page) < wanted:
+                self.cursors.popleft()
+        return rows
+
+
+# rows of a sqlite table for CustomTableWidget.set_data_source, a page at a time.  The header filters and sort of the
+# table are turned into the WHERE and ORDER BY of the query, so only rows that are shown are ever read.  The first
+# column sorted on gets an index (unless create_indexes is False), the query reads the rows with a value from the index
+# in order and then the blank rows, so the first page doesn't wait on the whole table being sorted.
+# Cells are compared and shown as the text sqlite gives for them, columns without TEXT affinity (numbers, untyped
+# columns) are CAST to text so a filter always matches the value in the dropdown.  NULL and '' are blank.
+# Sub table rows are read from sub_table by the parent key when a row is opened.  Checkbox columns hold 0/1 and come
+# back as bools, everything else comes back as text.
+# connection can be a sqlite3.Connection or a database file path
+class SqliteTableSource:
+    def __init__(self, connection, table: str, columns: List[str], headers=None, key_column: str = "rowid",
+                 checkbox_columns=(), sub_table: Union[None, str] = None, sub_table_key: Union[None, str] = None,
+                 sub_table_columns=(), sub_table_headers=None, page_size: int = 200, create_indexes: bool = True):
+        if isinstance(connection, sqlite3.Connection):
+            self.connection = connection
+        else:
+            self.connection = sqlite3.connect(connection)
+
+        self.table = table
+        self.columns = list(columns)
+        self.headers = list(headers) if headers is not None else list(columns)
+        self.key_column = key_column
+        self.checkbox_columns = set(checkbox_columns)
+        self.sub_table = sub_table
+        self.sub_table_key = sub_table_key
+        self.sub_table_columns = list(sub_table_columns)
+        self.sub_table_headers = list(sub_table_headers) if sub_table_headers is not None else list(sub_table_columns)
+        self.page_size = page_size
+
+        # logical column -> sorted distinct values for the header dropdowns
+        self.value_cache = {}
+        # (logical column, other columns' filters) -> value counts for the header dropdowns
+        self.count_cache = {}
+        # columns that have had an index made, see ensure_index
+        self.create_indexes = create_indexes
+        self.indexed_columns = set()
+
+        # columns with TEXT affinity, the others are compared as CAST(column AS TEXT)
+        declared_types = {name: declared_type.upper() for _, name, declared_type, *_ in
+                          self.connection.execute(f"PRAGMA table_info({self.quote(table)})")}
+        self.text_columns = {column for column, name in enumerate(self.columns)
+                             if any(text_type in declared_types.get(name, "") for text_type in ("CHAR", "CLOB", "TEXT"))
+                             and "INT" not in declared_types.get(name, "")}
+
+        if sub_table is not None and create_indexes:
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {self.quote(f'{sub_table}_{sub_table_key}_idx')} "
+                                    f"ON {self.quote(sub_table)} ({self.quote(sub_table_key)})")
+
+        # sqlite has no regex function built in, used for regex quick searches
+        self.connection.create_function("quick_search_regex", 2, self.regex_match)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=16)
+    def compile_regex(pattern: str):
+        return re.compile(pattern, re.IGNORECASE)
+
+    @staticmethod
+    def regex_match(pattern: str, text) -> bool:
+        return text is not None and SqliteTableSource.compile_regex(pattern).search(str(text)) is not None
+
+    @staticmethod
+    def quote(name: str) -> str:
+        return '"' + name.replace('"', '""') + '"'
+
+    # index for the main sort column, it's what lets the sorted query read the rows in order instead of sorting them all
+    # first.  The key is in the index too (rowid always is) as it's the last sort term.  Only made once for each
+    # column, and never if create_indexes is False
+    def ensure_index(self, column: int):
+        if column in self.indexed_columns or not self.create_indexes:
+            return
+        name = self.quote(f"{self.table}_{self.columns[column]}_sort_idx")
+        indexed = self.quote(self.columns[column])
+        if self.key_column.lower() != "rowid":
+            indexed += ", " + self.quote(self.key_column)
+        self.connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {self.quote(self.table)} ({indexed})")
+        self.indexed_columns.add(column)
+
+    # sql for the cell text of a column, the same text the table shows, the dropdowns list and the filters compare
+    def column_sql(self, column: int) -> str:
+        name = self.quote(self.columns[column])
+        if column in self.checkbox_columns:
+            return f"(CASE WHEN {name} THEN 'True' ELSE 'False' END)"
+        if column in self.text_columns:
+            return name
+        return f"CAST({name} AS TEXT)"
+
+    # sql for a column in the rows read for the table, checkbox columns come back as 0/1 (see fetch_page)
+    def select_sql(self, column: int) -> str:
+        if column in self.checkbox_columns:
+            return self.quote(self.columns[column])
+        return self.column_sql(column)
+
+    # checkbox columns are never blank, a NULL is shown as unchecked.  Written on the column itself so it can use an
+    # index
+    def blank_sql(self, column: int) -> str:
+        if column in self.checkbox_columns:
+            return "0"
+        name = self.quote(self.columns[column])
+        return f"({name} IS NULL OR {name} = '')"
+
+    def not_blank_sql(self, column: int) -> str:
+        if column in self.checkbox_columns:
+            return "1"
+        name = self.quote(self.columns[column])
+        return f"({name} IS NOT NULL AND {name} <> '')"
+
+    # WHERE clause and its parameters for the filters in a FilterEngine, leaving out skip_column's own filter
+    def where_sql(self, filter_engine, skip_column: Union[None, int] = None) -> Tuple[str, list]:
+        conditions = []
+        params = []
+        for column, values in filter_engine.excluded_values.items():
+            if not values or column == skip_column:
+                continue
+            # blanks aren't part of the excluded values, they're handled by the blank filter
+            values = sorted(values)
+            if len(values) <= SQLITE_IN_PARAMS:
+                conditions.append(f"({self.blank_sql(column)} OR {self.column_sql(column)} NOT IN "
+                                  f"({', '.join('?' * len(values))}))")
+                params.extend(values)
+            else:
+                conditions.append(f"({self.blank_sql(column)} OR {self.column_sql(column)} NOT IN "
+                                  f"(SELECT value FROM json_each(?)))")
+                params.append(json.dumps(values))
+        for column in filter_engine.hidden_blank_columns:
+            if column != skip_column:
+                conditions.append(self.not_blank_sql(column))
+        if filter_engine.search is not None and filter_engine.search.is_active():
+            condition, search_params = self.search_sql(filter_engine.search)
+            conditions.append(condition)
+            params.extend(search_params)
+
+        if not conditions:
+            return "", params
+        return " WHERE " + " AND ".join(conditions), params
+
+    # condition for a QuickSearch, any of the searched columns (or sub table columns) containing the text.  sqlite's
+    # lower() only lowercases ascii so substring searches of other text are case sensitive
+    def search_sql(self, search) -> Tuple[str, list]:
+        if search.column is None:
+            columns = [self.column_sql(column) for column in range(len(self.columns))
+                       if column not in self.checkbox_columns]
+        else:
+            columns = [self.column_sql(search.column)]
+
+        if search.regex:
+            match = lambda column: f"quick_search_regex(?, {column})"
+            param = search.text
+        else:
+            match = lambda column: f"instr(lower(COALESCE({column}, '')), ?) > 0"
+            param = search.text.lower()
+        terms = [match(column) for column in columns]
+        params = [param] * len(columns)
+
+        if search.include_sub_tables and self.sub_table is not None and self.sub_table_columns:
+            sub_terms = [match(self.quote(column)) for column in self.sub_table_columns]
+            terms.append(f"EXISTS (SELECT 1 FROM {self.quote(self.sub_table)} WHERE "
+                         f"{self.quote(self.sub_table)}.{self.quote(self.sub_table_key)} = "
+                         f"{self.quote(self.table)}.{self.quote(self.key_column)} AND ({' OR '.join(sub_terms)}))")
+            params.extend([param] * len(sub_terms))
+
+        if not terms:
+            return "0", []
+        return f"({' OR '.join(terms)})", params
+
+    # sql a column is sorted on, the column itself unless a numeric sort of a column that doesn't hold numbers.
+    # Natural sort can't be done in sql so those columns sort on the plain value
+    def sort_sql(self, column: int, sort_keys: Union[None, SortKeyCache] = None) -> str:
+        name = self.quote(self.columns[column])
+        key_type = sort_keys.column_type(column) if sort_keys is not None else SORT_TEXT
+        if key_type == SORT_NUMERIC and column in self.text_columns:
+            return f"CAST({name} AS REAL)"
+        return name
+
+    # ORDER BY clause for a sort spec (see FilterTableMixin.sort_rows_by_spec), blanks sort last like the table.
+    # blanks=False leaves out the blank term of the first column, for the query of the rows that have a value in it.
+    # The key is last in the direction of the first column so rows that compare the same always come back in the
+    # same order, and an index on the first column gives the rows in that order as they are
+    def order_sql(self, sort_spec: List[Tuple[int, int]], sort_keys: Union[None, SortKeyCache] = None,
+                  blanks: bool = True) -> str:
+        terms = []
+        for position, (column, order) in enumerate(sort_spec):
+            direction = "DESC" if order == Qt.DescendingOrder else "ASC"
+            if blanks or position > 0:
+                terms.append(self.blank_sql(column))
+            terms.append(f"{self.sort_sql(column, sort_keys)} {direction}")
+
+        key_direction = "DESC" if sort_spec and sort_spec[0][1] == Qt.DescendingOrder else "ASC"
+        terms.append(f"{self.quote(self.key_column)} {key_direction}")
+        return " ORDER BY " + ", ".join(terms)
+
+    # cursor over (key, columns...) of the rows that pass the filters in sort order, read it with fetch_page.  When the
+    # first sort column can be read from its index, the rows with a value in it are read in index order and the blank
+    # rows after them, the same order as the single query but without sorting the whole table before the first page
+    def query(self, filter_engine, sort_spec: List[Tuple[int, int]], sort_keys=None):
+        where, params = self.where_sql(filter_engine)
+        columns = ", ".join(self.select_sql(column) for column in range(len(self.columns)))
+        select = f"SELECT {self.quote(self.key_column)}, {columns} FROM {self.quote(self.table)}"
+
+        column = sort_spec[0][0] if sort_spec else None
+        if column is None or column in self.checkbox_columns or \
+                self.sort_sql(column, sort_keys) != self.quote(self.columns[column]):
+            return self.connection.execute(f"{select}{where}{self.order_sql(sort_spec, sort_keys)}", params)
+
+        # both halves use the single query's order without its leading blank term
+        self.ensure_index(column)
+        joiner = " AND " if where else " WHERE "
+        order = self.order_sql(sort_spec, sort_keys, blanks=False)
+        return SqliteCursorChain([
+            self.connection.execute(f"{select}{where}{joiner}{self.not_blank_sql(column)}{order}", params),
+            self.connection.execute(f"{select}{where}{joiner}{self.blank_sql(column)}{order}", params)])
+
+    # next page_size rows of a query as (key, row data)
+    def fetch_page(self, cursor: sqlite3.Cursor) -> List[Tuple[object, list]]:
+        page = []
+        checkbox_columns = self.checkbox_columns
+        for key, *values in cursor.fetchmany(self.page_size):
+            row_data = []
+            for col, value in enumerate(values):
+                if col in checkbox_columns:
+                    row_data.append(bool(value))
+                else:
+                    row_data.append("" if value is None else str(value))
+            page.append((key, row_data))
+        return page
+
+    def sub_table_rows(self, key) -> List[List[str]]:
+        if self.sub_table is None:
+            return []
+        columns = ", ".join(self.quote(column) for column in self.sub_table_columns)
+        cursor = self.connection.execute(f"SELECT {columns} FROM {self.quote(self.sub_table)} "
+                                         f"WHERE {self.quote(self.sub_table_key)} = ? ORDER BY rowid", (key,))
+        return [["" if value is None else str(value) for value in row] for row in cursor]
+
+    # distinct non blank values of a column over the whole table
+    def distinct_values(self, column: int) -> List[str]:
+        values = self.value_cache.get(column)
+        if values is None:
+            cursor = self.connection.execute(f"SELECT DISTINCT {self.column_sql(column)} FROM {self.quote(self.table)} "
+                                             f"WHERE {self.not_blank_sql(column)}")
+            values = sorted(str(value) for value, in cursor)
+            self.value_cache[column] = values
+        return values
+
+    # distinct values of a column with their row counts among the rows the other columns' filters leave, see
+    # FilterTableMixin.filter_value_counts
+    def value_counts(self, column: int, filter_engine) -> dict:
+        where, params = self.where_sql(filter_engine, column)
+        cache_key = (column, where, json.dumps(params))
+        counts = self.count_cache.get(cache_key)
+        if counts is None:
+            cursor = self.connection.execute(f"SELECT {self.column_sql(column)}, COUNT(*) FROM {self.quote(self.table)}"
+                                             f"{where} GROUP BY 1", params)
+            counts = {}
+            for value, count in cursor:
+                value = "" if value is None else str(value)
+                counts[value] = counts.get(value, 0) + count
+            self.count_cache[cache_key] = counts
+        return counts
+
+    # forget the cached dropdown values after the table has been changed, all columns if none given
+    def invalidate(self, column: Union[None, int] = None):
+        if column is None:
+            self.value_cache.clear()
+            self.count_cache.clear()
+        else:
+            self.value_cache.pop(column, None)
+            # counts of every column depend on the other columns' values
+            self.count_cache.clear()
+
+    # (key, row data) of the given rows, in the same form as fetch_page
+    def fetch_rows(self, keys) -> List[Tuple[object, list]]:
+        keys = list(keys)
+        if not keys:
+            return []
+        columns = ", ".join(self.select_sql(column) for column in range(len(self.columns)))
+        cursor = self.connection.execute(f"SELECT {self.quote(self.key_column)}, {columns} FROM {self.quote(self.table)} "
+                                         f"WHERE {self.quote(self.key_column)} IN (SELECT value FROM json_each(?))",
+                                         (json.dumps(keys),))
+        rows = []
+        while True:
+            page = self.fetch_page(cursor)
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+
+    # deltas for CustomTableWidget.apply_row_deltas from a change table with (change_id, row_key, deleted) columns that
+    # the other users' edits are logged to.  Returns (last change id, upserts, deletes), pass the last change id back
+    # in on the next poll
+    def changes_since(self, change_table: str, last_change: int = 0) -> Tuple[int, list, list]:
+        changed = {}
+        for change_id, key, deleted in self.connection.execute(
+                f"SELECT change_id, row_key, deleted FROM {self.quote(change_table)} WHERE change_id > ? "
+                f"ORDER BY change_id", (last_change,)):
+            last_change = change_id
+            # only the last change to each row matters
+            changed.pop(key, None)
+            changed[key] = bool(deleted)
+
+        deletes = [key for key, deleted in changed.items() if deleted]
+        upserts = [(key, row_data, self.sub_table_rows(key) if self.sub_table is not None else None)
+                   for key, row_data in self.fetch_rows(key for key, deleted in changed.items() if not deleted)]
+        return last_change, upserts, deletes
+
+    # file of the connection's main database, "" for an in memory database
+    def database_path(self) -> str:
+        for _, name, file in self.connection.execute("PRAGMA database_list"):
+            if name == "main":
+                return file
+        return ""
+
+    # SqliteExportSnapshot of the rows that pass the filters in sort order with the columns in column_order, for
+    # TableExporter.  The query is made here, it's run on the export thread's own connection
+    def export_snapshot(self, filter_engine, sort_spec: List[Tuple[int, int]], sort_keys=None, column_order=None,
+                        include_sub_tables: bool = False):
+        path = self.database_path()
+        if not path:
+            raise ValueError("in memory databases can't be read from the export thread")
+
+        if column_order is None:
+            column_order = range(len(self.columns))
+        where, params = self.where_sql(filter_engine)
+        columns = ", ".join(self.select_sql(column) for column in column_order)
+        sql = f"SELECT {self.quote(self.key_column)}, {columns} FROM {self.quote(self.table)}{where}"
+        count_sql = f"SELECT COUNT(*) FROM {self.quote(self.table)}{where}"
+        sql += self.order_sql(sort_spec, sort_keys)
+
+        sub_table_sql = None
+        if include_sub_tables and self.sub_table is not None:
+            sub_columns = ", ".join(self.quote(column) for column in self.sub_table_columns)
+            sub_table_sql = (f"SELECT {sub_columns} FROM {self.quote(self.sub_table)} "
+                             f"WHERE {self.quote(self.sub_table_key)} = ? ORDER BY rowid")
+
+        return SqliteExportSnapshot(path, sql, count_sql, params, [self.headers[column] for column in column_order],
+                                    [column in self.checkbox_columns for column in column_order],
+                                    self.sub_table_headers, sub_table_sql)
+
+    # SqliteWriteBackSink that writes table edits back to this source's tables
+    def write_back_sink(self):
+        path = self.database_path()
+        if not path:
+            raise ValueError("in memory databases can't be written to from the write back thread")
+
+        return SqliteWriteBackSink(path, self.table, self.columns, self.key_column, self.checkbox_columns,
+                                   self.sub_table, self.sub_table_key, self.sub_table_columns)
+
+
+# how long edits are collected before they're written, (ms) edits to the same cell in that time are only written once
+WRITE_BACK_INTERVAL = 250
+# times a batch is tried again before failed is emitted
+WRITE_BACK_RETRIES = 3
+
+
+# collects cell edits from a table (see FilterTableMixin.set_write_back) and writes them to a sink in batches on a
+# background thread, so clicking checkboxes never waits on the database.  Edits are kept by (row key, sub row,
+# column) so editing the same cell again before it's written just replaces the value.  The sink is any object with a
+# write(edits) method that writes a list of (row key, sub row or None, column, value) in one transaction and raises
+# if it can't.  A batch that still fails after retrying is kept and written along with the next one
+class WriteBackQueue(QObject):
+    # number of edits written, emitted from the writer thread so it's delivered to the gui thread through the event loop
+    flushed = pyqtSignal(int)
+    # (number of edits not written, error message)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self, sink, interval: int = WRITE_BACK_INTERVAL, retries: int = WRITE_BACK_RETRIES,
+                 retry_delay: float = 0.5, parent=None):
+        super(WriteBackQueue, self).__init__(parent)
+        self.sink = sink
+        self.retries = retries
+        # seconds before the first retry, doubled for each retry after that
+        self.retry_delay = retry_delay
+
+        # (row key, sub row, column) -> value of the edits not handed to the writer thread yet
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.batches = queue.Queue()
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, row_key, column: int, value, sub_row: Union[None, int] = None):
+        with self.lock:
+            self.pending[(row_key, sub_row, column)] = value
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def pending_count(self) -> int:
+        with self.lock:
+            return len(self.pending)
+
+    # hand the pending edits to the writer thread now instead of waiting for the timer
+    def flush(self):
+        self.timer.stop()
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        self.batches.put(batch)
+
+    # write whatever is left and stop the writer thread
+    def close(self, timeout: Union[None, float] = None):
+        self.flush()
+        self.batches.put(None)
+        self.thread.join(timeout)
+
+    def run(self):
+        # batch that failed, written again with the next one (newer edits to the same cells win)
+        failed_batch = {}
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            if failed_batch:
+                failed_batch.update(batch)
+                batch, failed_batch = failed_batch, {}
+            if not batch:
+                continue
+
+            edits = [(row_key, sub_row, column, value) for (row_key, sub_row, column), value in batch.items()]
+            error = None
+            for attempt in range(self.retries + 1):
+                try:
+                    self.sink.write(edits)
+                    error = None
+                    break
+                except Exception as e:
+                    error = e
+                    if attempt < self.retries:
+                        time.sleep(self.retry_delay * 2 ** attempt)
+
+            if error is None:
+                self.flushed.emit(len(edits))
+            else:
+                failed_batch = batch
+                self.failed.emit(len(edits), str(error))
+
+
+# WriteBackQueue sink for sqlite tables laid out the same as for SqliteTableSource.  Sub table rows are found by their
+# position under the parent key in rowid order, the same order SqliteTableSource reads them in.  The connection is
+# opened by the writer thread the first time something is written
+class SqliteWriteBackSink:
+    def __init__(self, path: str, table: str, columns: List[str], key_column: str = "rowid", checkbox_columns=(),
+                 sub_table: Union[None, str] = None, sub_table_key: Union[None, str] = None, sub_table_columns=()):
+        self.path = path
+        self.table = table
+        self.columns = list(columns)
+        self.key_column = key_column
+        self.checkbox_columns = set(checkbox_columns)
+        self.sub_table = sub_table
+        self.sub_table_key = sub_table_key
+        self.sub_table_columns = list(sub_table_columns)
+        self.connection = None
+
+    def write(self, edits):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+
+        quote = SqliteTableSource.quote
+        # with the connection is one transaction, rolled back if anything fails
+        with self.connection:
+            for row_key, sub_row, column, value in edits:
+                if sub_row is None:
+                    if column in self.checkbox_columns:
+                        value = int(value is True or value == "True")
+                    self.connection.execute(f"UPDATE {quote(self.table)} SET {quote(self.columns[column])} = ? "
+                                            f"WHERE {quote(self.key_column)} = ?", (value, row_key))
+                else:
+                    sub_table = quote(self.sub_table)
+                    self.connection.execute(f"UPDATE {sub_table} SET {quote(self.sub_table_columns[column])} = ? "
+                                            f"WHERE rowid = (SELECT rowid FROM {sub_table} "
+                                            f"WHERE {quote(self.sub_table_key)} = ? ORDER BY rowid LIMIT 1 OFFSET ?)",
+                                            (value, row_key, sub_row))
+
+
+# search box for a table's quick search (see FilterTableMixin.set_quick_search), the table is searched as the text is
+# typed.  The column list follows the table's headers, a bad regex turns the box red and leaves the last search showing
+class QuickSearchBox(QWidget):
+    def __init__(self, table, parent=None):
+        super(QuickSearchBox, self).__init__(parent)
+        self.table = table
+
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Search...")
+        self.search_edit.setClearButtonEnabled(True)
+
+        self.column_combo = QComboBox()
+        self.column_combo.setSizeAdjustPolicy(QComboBox.AdjustToContents)
+
+        self.regex_check = QCheckBox("Regex")
+        self.sub_tables_check = QCheckBox("Sub Tables")
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.search_edit)
+        layout.addWidget(self.column_combo)
+        layout.addWidget(self.regex_check)
+        layout.addWidget(self.sub_tables_check)
+
+        self.update_columns()
+        model = table.model()
+        model.headerDataChanged.connect(self.update_columns)
+        model.columnsInserted.connect(self.update_columns)
+        model.columnsRemoved.connect(self.update_columns)
+        model.modelReset.connect(self.update_columns)
+        # the model is deleted after the table and sends columnsRemoved on the way out
+        table.destroyed.connect(self.table_destroyed)
+
+        self.search_edit.textChanged.connect(self.search)
+        self.column_combo.currentIndexChanged.connect(self.search)
+        self.regex_check.toggled.connect(self.search)
+        self.sub_tables_check.toggled.connect(self.search)
+
+    def table_destroyed(self):
+        self.table = None
+
+    # "All Columns" then a item per column, the item data is the logical column
+    def update_columns(self, *args):
+        if self.table is None:
+            return
+        column = self.column_combo.currentData()
+        model = self.table.model()
+
+        self.column_combo.blockSignals(True)
+        self.column_combo.clear()
+        self.column_combo.addItem("All Columns", None)
+        for col in range(model.columnCount()):
+            text = model.headerData(col, Qt.Horizontal, Qt.DisplayRole)
+            self.column_combo.addItem(text if text else f"Column {col + 1}", col)
+        index = self.column_combo.findData(column)
+        self.column_combo.setCurrentIndex(index if index >= 0 else 0)
+        self.column_combo.blockSignals(False)
+
+    def search(self, *args):
+        if self.table is None:
+            return
+        try:
+            self.table.set_quick_search(self.search_edit.text(), self.column_combo.currentData(),
+                                        self.regex_check.isChecked(), self.sub_tables_check.isChecked())
+        except re.error:
+            self.search_edit.setStyleSheet("background-color: #ffc0c0;")
+            return
+        self.search_edit.setStyleSheet("")
+
+
+class MainWindow(QMainWindow):
+
+    def __init__(self, model_backend: bool = False):
         super(MainWindow, self).__init__()
 
+        # use the QTableView/model version of the table (run with --model)
+        self.model_backend = model_backend
+
         self.initUI()
 
     def initUI(self):
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
 
-        # Create a table
-        self.main_table = CustomTableWidget()
-        self.populate_main_table()
+        if self.model_backend:
+            self.main_table = CustomTableView()
+            self.populate_model_table()
 
-        # this function needs to be run whenever table is populated/re-populated with data to reset
-        # the items in the qcombobox headers
-        self.main_table.header.onSectionCountChanged()
+            layout = QVBoxLayout(central_widget)
+            layout.addWidget(QuickSearchBox(self.main_table))
+            layout.addWidget(self.main_table)
 
-        # use this function to modify header labels due to overwriting qheaderview paintsection
-        self.main_table.setHorizontalHeaderLabels(["Field 1", "Field 2", "Field 3", "Field N"])
-
-        # Set vertical header labels
-        for row in range(self.main_table.rowCount()):
-            if row % 2 == 0:
-                item = QTableWidgetItem("+")
-             #   item.setBackground(QColor("#d3d3d3"))  # Set your desired background color (this doesn't seem to work on my system OS)
-                self.main_table.setVerticalHeaderItem(row, item)
-            else:
-                item = QTableWidgetItem("")
-                self.main_table.setVerticalHeaderItem(row, item)
+            self.setGeometry(100, 100, 600, 400)
+            self.setWindowTitle('Mouse Near Column Grid Line Example')
+            return
 
+        # Create a table
+        self.main_table = CustomTableWidget()
         self.main_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.populate_main_table()
 
         layout = QVBoxLayout(central_widget)
+        layout.addWidget(QuickSearchBox(self.main_table))
         layout.addWidget(self.main_table)
 
         self.setGeometry(100, 100, 600, 400)
         self.setWindowTitle('Mouse Near Column Grid Line Example')
 
+    # load_rows builds the value index, header dropdowns and "+" vertical headers itself when it's done
     def populate_main_table(self):
-        self.main_table.setRowCount(1000)
-        self.main_table.setColumnCount(5)
-
-        self.main_table.model().blockSignals(True)
         start = time.time()
 
-        # Populate the table with random data
-        for row in range(self.main_table.rowCount()):
-
-            if row % 2 == 0:
-                self.main_table.setRowHeight(row, 18)
-                for col in range(self.main_table.columnCount()):
-                    if  col < 4 or col > 4:
-                        item = QTableWidgetItem(f'Row {row}, Col {col}')
-                        self.main_table.setItem(row, col, item)
-                    if col == 4:
-                        widget = self.main_table.make_cell_checkbox()
-                        self.main_table.setCellWidget(row, col, widget)
-
-            elif row % 2 == 1:
-                self.main_table.setSpan(row, 0, 1, self.main_table.columnCount())
-
-                sub_table = self.main_table.sub_table_create()
-
-                self.sub_table_populate(3, 3, sub_table)
-                total_height = self.main_table.get_sub_table_Height(sub_table)
-
-                self.main_table.setRowHeight(row, total_height)
-                self.main_table.setCellWidget(row, 0, sub_table)
+        # sub table data is kept for each row, the sub table widget is only made when the row is opened
+        records = (([f'Row {row}, Col {col}' for col in range(4)] + [False], self.sub_table_populate(3, 3))
+                   for row in range(0, 1000, 2))
+        self.main_table.loadFinished.connect(lambda count: print(time.time() - start))
+        # number of NCRs in each row's sub table, kept up to date when a sub table row is changed
+        self.main_table.set_sub_table_aggregates([SubTableAggregate("NCRs", AGGREGATE_COUNT)])
+        self.main_table.load_rows(["Field 1", "Field 2", "Field 3", "Field N", ""], records, checkbox_columns={4},
+                                  sub_table_headers=["NCR No.", "Disposition", "Extra"])
+
+    # 1,000,000 cells for the model version of the table, sub tables are only made when a row is opened
+    def populate_model_table(self):
+        start = time.time()
 
-                self.main_table.setRowHidden(row, True)
+        rows = ([f'Row {row}, Col {col}' for col in range(4)] + [False] for row in range(200000))
+        sub_table_headers = ["NCR No.", "Disposition", "Extra"]
+        sub_table_provider = lambda parent: self.sub_table_populate(3, 3)
 
-        self.main_table.model().blockSignals(False)
+        self.main_table.set_table_data(["Field 1", "Field 2", "Field 3", "Field N", ""], rows, checkbox_columns={4},
+                                       sub_table_headers=sub_table_headers, sub_table_provider=sub_table_provider)
         end = time.time()
         print(end-start)
 
-        # force a repaint after unblocking signals updates the tablewidget on screen fast
-        self.main_table.viewport().repaint()
-
-
-    def sub_table_populate(self, rows: int, columns: int, widget: QWidget):
-        table = None
-        # get the qtablewidgetitem (which is in the Qwidget)
-        for child_widget in widget.findChildren(QWidget):
-            if isinstance(child_widget, QTableWidget):
-                table = child_widget
-
-        if table is not None:
-            table.setRowCount(rows)
-            table.setColumnCount(columns)
-
-            table.setHorizontalHeaderLabels(["NCR No.", "Disposition", "Extra"])
-
-             # Populate the table with random data
-            for row in range(rows):
-                table.setRowHeight(row, 18)
-                for col in range(columns):
-                    item = QTableWidgetItem(f'sub Row {row}, sub Col {col}')
-                    table.setItem(row, col, item)
+    def sub_table_populate(self, rows: int, columns: int) -> List[List[str]]:
+        # Populate the table with random data
+        return [[f'sub Row {row}, sub Col {col}' for col in range(columns)] for row in range(rows)]
 
 
 
@@ -985,6 +4502,6 @@ class sub_table_window(QDialog):
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    window = MainWindow()
+    window = MainWindow(model_backend="--model" in sys.argv)
     window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,243 @@
+# headless benchmarks for the hot paths of CustomTableWidget: loading, sorting, the header filters, building the filter
+# dropdowns, hovering/scrolling the header, moving columns and opening/closing sub tables.  Runs on the offscreen qt
+# platform so it works without a display, and writes the timings as json so runs from different commits can be
+# compared, eg.
+#
+#   python benchmark_table.py --rows 1000,10000 --output before.json
+#   python benchmark_table.py --rows 1000,10000 --output after.json --compare before.json
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import List
+
+from PyQt5.QtCore import Qt, QEvent, QEventLoop, QPoint, QT_VERSION_STR
+from PyQt5.QtGui import QMouseEvent
+from PyQt5.QtWidgets import QApplication, QTableWidgetItem
+
+import Qtablewidget_with_filters_sub_tables as table_module
+
+# different values in each of the data columns, so the filter dropdowns are a realistic size
+VALUE_CARDINALITY = 50
+# every n'th cell in the data columns is blank, for the blank filters
+BLANK_EVERY = 17
+# sub tables opened for the expand/collapse and column move benchmarks
+OPEN_SUB_TABLES = 50
+
+
+def make_records(rows: int, columns: int):
+    # first column is unique like a work order number, the last column is a checkbox column
+    for row in range(rows):
+        row_data = [f"WO{row:07d}"]
+        for col in range(1, columns - 1):
+            if (row + col) % BLANK_EVERY == 0:
+                row_data.append("")
+            else:
+                row_data.append(f"Value {(row * (col + 1)) % VALUE_CARDINALITY}")
+        row_data.append(row % 3 == 0)
+        yield row_data, [[f"NCR {row}-{sub_row}", "Open", ""] for sub_row in range(3)]
+
+
+def headers_for(columns: int) -> List[str]:
+    return [f"Field {col}" for col in range(columns)]
+
+
+def timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+# same as the old MainWindow.populate_main_table, a setItem/setRowHeight per row then the value index and header rebuild
+def populate_loop(table, rows: int, columns: int):
+    table.setRowCount(rows * 2)
+    table.setColumnCount(columns)
+    table.model().blockSignals(True)
+    for index, (row_data, sub_table_rows) in enumerate(make_records(rows, columns)):
+        row = index * 2
+        table.setRowHeight(row, 18)
+        for col, value in enumerate(row_data):
+            if col == columns - 1:
+                table.setItem(row, col, table.make_cell_checkbox(value))
+            else:
+                table.setItem(row, col, QTableWidgetItem(value))
+        table.set_sub_table_rows(row, sub_table_rows)
+        table.setRowHidden(row + 1, True)
+    table.model().blockSignals(False)
+    table.rebuild_value_index()
+    table.header.onSectionCountChanged()
+
+
+def load_rows(table, rows: int, columns: int):
+    loop = QEventLoop()
+    table.loadFinished.connect(loop.quit)
+    table.load_rows(headers_for(columns), make_records(rows, columns), ["NCR No.", "Disposition", "Extra"],
+                    checkbox_columns={columns - 1})
+    if table.is_loading():
+        loop.exec_()
+    table.loadFinished.disconnect(loop.quit)
+
+
+def new_table(rows: int, columns: int):
+    table = table_module.CustomTableWidget()
+    table.resize(1000, 600)
+    table.show()
+    load_rows(table, rows, columns)
+    return table
+
+
+# pick a dropdown item the way a click in the combobox popup does, then run the filter
+def click_filter_item(table, button, index: int):
+    button.setCurrentIndex(index)
+    item = button.model().item(index)
+    if index >= table.header.dropdown_base_index(button.logical_index):
+        item.setCheckState(Qt.Unchecked if item.checkState() == Qt.Checked else Qt.Checked)
+    table.combo_filter_change(button)
+
+
+# filter button for a logical column, in shared button mode the one button is pointed at the column
+def filter_button(header, column: int):
+    if header.shared_button_mode:
+        header.shared_button.logical_index = column
+        return header.shared_button
+    return header.m_buttons_index_attachments[column]
+
+
+def hover_sections(header):
+    for logical_index in range(header.count()):
+        header.mouseMoveEvent(QMouseEvent(QEvent.MouseMove, QPoint(header.sectionViewportPosition(logical_index) + 2, 5),
+                                          Qt.NoButton, Qt.NoButton, Qt.NoModifier))
+
+
+def scroll_header(table):
+    scroll_bar = table.horizontalScrollBar()
+    for value in range(scroll_bar.minimum(), scroll_bar.maximum() + 1, max(1, scroll_bar.singleStep())):
+        scroll_bar.setValue(value)
+    scroll_bar.setValue(scroll_bar.minimum())
+
+
+def benchmark_size(rows: int, columns: int, repeat: int) -> List[dict]:
+    timings = {}
+
+    def record(name: str, seconds: float):
+        timings.setdefault(name, []).append(seconds)
+
+    for _ in range(repeat):
+        table = table_module.CustomTableWidget()
+        record("populate_main_table", timed(lambda: populate_loop(table, rows, columns)))
+        table.deleteLater()
+
+        table = table_module.CustomTableWidget()
+        record("load_rows", timed(lambda: load_rows(table, rows, columns)))
+        table.deleteLater()
+
+    table = new_table(rows, columns)
+    header = table.header
+    app = QApplication.instance()
+
+    for _ in range(repeat):
+        # sorting through the header sort indicator, same as clicking the header
+        for order in (Qt.DescendingOrder, Qt.AscendingOrder):
+            record("sort_column_change", timed(lambda: header.setSortIndicator(1, order)))
+        table.sort_keys.invalidate()
+        record("sort_column_change_uncached", timed(lambda: header.setSortIndicator(0, Qt.DescendingOrder)))
+
+        # dropdown rebuild: marking the columns dirty, then building one dropdown the way opening it does
+        record("populate_filter_dropdown", timed(header.populate_filter_dropdown))
+        button = filter_button(header, 1)
+        record("populate_column_dropdown", timed(lambda: header.populate_column_dropdown(button)))
+
+        base_index = header.dropdown_base_index(1)
+        record("combo_filter_change_single", timed(lambda: click_filter_item(table, button, base_index)))
+        record("combo_filter_change_single_undo", timed(lambda: click_filter_item(table, button, base_index)))
+        record("combo_filter_change_hide_blanks", timed(lambda: click_filter_item(table, button, 3)))
+        record("combo_filter_change_show_blanks", timed(lambda: click_filter_item(table, button, 2)))
+        record("combo_filter_change_clear", timed(lambda: click_filter_item(table, button, 1)))
+        record("combo_filter_change_all", timed(lambda: click_filter_item(table, button, 0)))
+
+        # hovering across every header section, and scrolling the header sideways
+        record("header_hover", timed(lambda: hover_sections(header)))
+        record("header_scroll", timed(lambda: scroll_header(table)))
+
+        # open/close sub tables from the vertical header
+        parent_rows = [header_row for header_row in table.parent_rows()][:OPEN_SUB_TABLES]
+        record("sub_table_expand", timed(lambda: [table.main_table_vertical_header_clicked(row)
+                                                  for row in parent_rows]))
+
+        # moving the first column goes through onSectionMovedChanged -> adjust_spans for the open sub tables
+        record("section_moved_adjust_spans", timed(lambda: header.moveSection(0, columns - 1)))
+        header.moveSection(columns - 1, 0)
+
+        record("sub_table_collapse", timed(lambda: [table.main_table_vertical_header_clicked(row)
+                                                    for row in parent_rows]))
+        app.processEvents()
+
+    table.deleteLater()
+    app.processEvents()
+
+    return [{"benchmark": name, "rows": rows, "columns": columns, "repeat": len(values),
+             "min": min(values), "median": statistics.median(values)} for name, values in timings.items()]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+# print median time of each benchmark against a previous results file
+def compare(results: List[dict], baseline_path: str):
+    with open(baseline_path) as file:
+        baseline = {(result["benchmark"], result["rows"], result["columns"]): result
+                    for result in json.load(file)["results"]}
+
+    print(f"{'benchmark':36} {'rows':>8} {'cols':>5} {'before':>10} {'after':>10} {'ratio':>7}", file=sys.stderr)
+    for result in results:
+        before = baseline.get((result["benchmark"], result["rows"], result["columns"]))
+        if before is None:
+            continue
+        ratio = result["median"] / before["median"] if before["median"] else float("inf")
+        print(f"{result['benchmark']:36} {result['rows']:>8} {result['columns']:>5} {before['median']:>10.4f} "
+              f"{result['median']:>10.4f} {ratio:>7.2f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CustomTableWidget hot paths on the offscreen platform")
+    parser.add_argument("--rows", default="1000,10000,100000", help="comma separated parent row counts")
+    parser.add_argument("--columns", default="5,10", help="comma separated column counts (at least 3)")
+    parser.add_argument("--repeat", type=int, default=3, help="times each benchmark is run")
+    parser.add_argument("--output", help="json file for the results, printed to stdout if not given")
+    parser.add_argument("--compare", help="results json from an earlier run to compare against")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    results = []
+    for rows in (int(value) for value in args.rows.split(",")):
+        for columns in (int(value) for value in args.columns.split(",")):
+            print(f"benchmarking {rows} rows x {columns} columns", file=sys.stderr)
+            results.extend(benchmark_size(rows, max(columns, 3), args.repeat))
+
+    output = {"commit": git_commit(), "python": platform.python_version(), "qt": QT_VERSION_STR,
+              "platform": app.platformName(), "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=1)
+    else:
+        json.dump(output, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import gc
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PyQt5.QtCore import QEventLoop
+from PyQt5.QtWidgets import QApplication
+
+import Qtablewidget_with_filters_sub_tables as table_module
+
+
+@pytest.fixture(scope="session")
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+# the tables hold reference cycles through their signal connections, collect them after each test so a table isn't
+# deleted by the garbage collector in the middle of a later test's event processing
+@pytest.fixture(autouse=True)
+def collect_tables():
+    yield
+    gc.collect()
+
+
+# load_records(headers, records, ...) makes a shown CustomTableWidget loaded through load_rows with (row data, sub table
+# rows) records, the other arguments are passed on to load_rows
+@pytest.fixture
+def load_records(app):
+    def load(headers, records, sub_table_headers=(), **kwargs):
+        table = table_module.CustomTableWidget()
+        table.resize(400, 300)
+        table.show()
+        loop = QEventLoop()
+        table.loadFinished.connect(loop.quit)
+        table.load_rows(headers, records, sub_table_headers, **kwargs)
+        if table.is_loading():
+            loop.exec_()
+        return table
+
+    return load
+
+
+# load_table(rows, columns) makes a shown CustomTableWidget loaded with rows of text, each with one sub table row
+@pytest.fixture
+def load_table(load_records):
+    def load(rows: int = 20, columns: int = 30):
+        records = (([f"Row {row} Col {col}" for col in range(columns)], [["NCR 1", "Open", ""]])
+                   for row in range(rows))
+        return load_records([f"Field {col}" for col in range(columns)], records, ["NCR No.", "Disposition", "Extra"])
+
+    return load
@@ -0,0 +1,109 @@
+import pytest
+
+import Qtablewidget_with_filters_sub_tables as table_module
+
+SUB_TABLE_HEADERS = ["NCR No.", "Disposition"]
+SUB_TABLES = [[["NCR 3", "Open"], ["NCR 10", "Closed"], ["NCR 7", "Open"]],
+              [["NCR 1", "Closed"], ["NCR 2", "Scrap"]],
+              [["NCR 5", "Open"]]]
+
+
+def make_aggregates():
+    return [table_module.SubTableAggregate("Open NCRs", table_module.AGGREGATE_COUNT_WHERE, column=1, value="Open"),
+            table_module.SubTableAggregate("First NCR", table_module.AGGREGATE_MIN, column=0),
+            table_module.SubTableAggregate("Last NCR", table_module.AGGREGATE_MAX, column=0),
+            table_module.SubTableAggregate("Any Scrap", table_module.AGGREGATE_ANY, column=1, value="Scrap"),
+            table_module.SubTableAggregate("All Closed", table_module.AGGREGATE_ALL, column=1,
+                                           value={"Closed", "Scrap"})]
+
+
+def load_widget():
+    table = table_module.CustomTableWidget()
+    table.set_sub_table_aggregates(make_aggregates())
+    records = [([f"WO{parent}"], [list(sub_row) for sub_row in sub_rows])
+               for parent, sub_rows in enumerate(SUB_TABLES)]
+    table.load_rows(["Work Order"], records, SUB_TABLE_HEADERS, chunk_size=len(records))
+    while table.is_loading():
+        table.load_next_chunk()
+    return table, [parent * 2 for parent in range(len(SUB_TABLES))]
+
+
+def load_view():
+    table = table_module.CustomTableView()
+    table.set_sub_table_aggregates(make_aggregates())
+    table.set_table_data(["Work Order"], [[f"WO{parent}"] for parent in range(len(SUB_TABLES))],
+                         [[list(sub_row) for sub_row in sub_rows] for sub_rows in SUB_TABLES],
+                         sub_table_headers=SUB_TABLE_HEADERS)
+    return table, list(range(len(SUB_TABLES)))
+
+
+# edit a sub table row the way the sub table dialog does, through the sub table widget's signal
+def edit_sub_row(table, parent, sub_row, row_data):
+    if isinstance(table, table_module.CustomTableWidget):
+        table.open_sub_table(parent)
+        widget = table.sub_table_widgets[parent]
+    else:
+        row = table.table_model.view_rows.index(parent)
+        if parent not in table.table_model.expanded:
+            table.main_table_vertical_header_clicked(row)
+        widget = table.indexWidget(table.table_model.index(row + 1, table.horizontalHeader().logicalIndex(0)))
+    sub_table = widget.findChild(table_module.sub_TableWidget)
+    sub_table.sub_table_adjust(sub_table, sub_row, row_data)
+
+
+def aggregate_texts(table, parent):
+    return [table.value_index.value(parent, column) or ""
+            for column in range(table.aggregate_start, table.aggregate_start + len(table.sub_table_aggregates))]
+
+
+def sub_table_rows(table, parent):
+    if isinstance(table, table_module.CustomTableWidget):
+        return table.sub_table_rows(parent)
+    return table.table_model.sub_table_rows(parent)
+
+
+def recomputed_texts(table, parent):
+    return [aggregate.compute(parent, sub_table_rows(table, parent)) for aggregate in make_aggregates()]
+
+
+@pytest.mark.parametrize("load", [load_widget, load_view])
+def test_aggregates_follow_sub_table_edits(app, load):
+    table, parents = load()
+    assert aggregate_texts(table, parents[0]) == ["2", "NCR 3", "NCR 10", "False", "False"]
+
+    updated_parents = []
+    set_aggregate_cell = table.set_aggregate_cell
+    table.set_aggregate_cell = lambda parent, column, text: (updated_parents.append(parent),
+                                                             set_aggregate_cell(parent, column, text))
+    others = {parent: aggregate_texts(table, parent) for parent in parents[1:]}
+
+    # the min row changes, so the min is found again from the other rows
+    edit_sub_row(table, parents[0], 0, ["NCR 12", "Closed"])
+    assert aggregate_texts(table, parents[0]) == ["1", "NCR 7", "NCR 12", "False", "False"]
+
+    # any and all flip
+    edit_sub_row(table, parents[0], 2, ["NCR 7", "Scrap"])
+    assert aggregate_texts(table, parents[0]) == ["0", "NCR 7", "NCR 12", "True", "True"]
+
+    # a blank value doesn't count for the min/max
+    edit_sub_row(table, parents[0], 1, ["", "Open"])
+    assert aggregate_texts(table, parents[0]) == ["1", "NCR 7", "NCR 12", "True", "False"]
+    assert aggregate_texts(table, parents[0]) == recomputed_texts(table, parents[0])
+
+    assert set(updated_parents) == {parents[0]}
+    assert {parent: aggregate_texts(table, parent) for parent in parents[1:]} == others
+
+
+@pytest.mark.parametrize("load", [load_widget, load_view])
+def test_aggregate_columns_filter_after_sub_table_edits(app, load):
+    table, parents = load()
+    any_scrap = table.aggregate_start + 3
+    table.filter_engine.set_value_excluded(any_scrap, "True", True)
+    table.apply_filters()
+    assert table.filter_engine.hidden_rows == {parents[1]}
+
+    edit_sub_row(table, parents[2], 0, ["NCR 5", "Scrap"])
+    table.apply_filters()
+
+    assert table.filter_engine.hidden_rows == {parents[1], parents[2]}
+    assert table.filter_value_counts(any_scrap) == {"True": 2, "False": 1}
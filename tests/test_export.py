@@ -0,0 +1,53 @@
+import json
+import threading
+
+from PyQt5.QtCore import QEventLoop
+
+import Qtablewidget_with_filters_sub_tables as table_module
+
+
+class RecordingProvider:
+    def __init__(self):
+        self.threads = []
+
+    def __call__(self, row):
+        self.threads.append(threading.current_thread())
+        return [["NCR 1", "Open"]]
+
+
+def export(table, path):
+    exporter = table.export_rows(str(path), include_sub_tables=True)
+    exporter.wait(5)
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def load_widget(provider):
+    table = table_module.CustomTableWidget()
+    loop = QEventLoop()
+    table.loadFinished.connect(loop.quit)
+    table.load_rows(["Work Order"], [(["WO1"], None), (["WO2"], [["NCR 9", "Closed"]]), (["WO3"], None)],
+                    ["NCR No.", "Disposition"])
+    if table.is_loading():
+        loop.exec_()
+    table.sub_table_provider = provider
+    return table
+
+
+def load_view(provider):
+    table = table_module.CustomTableView()
+    table.set_table_data(["Work Order"], [["WO1"], ["WO2"], ["WO3"]], [None, [["NCR 9", "Closed"]], None],
+                         sub_table_headers=["NCR No.", "Disposition"], sub_table_provider=provider)
+    return table
+
+
+def test_unloaded_sub_tables_are_read_on_the_gui_thread(app, tmp_path):
+    for load in (load_widget, load_view):
+        provider = RecordingProvider()
+        table = load(provider)
+
+        records = export(table, tmp_path / "rows.jsonl")
+
+        assert provider.threads and all(thread is threading.main_thread() for thread in provider.threads)
+        assert [[sub_row["NCR No."] for sub_row in record["sub_table"]] for record in records] == \
+            [["NCR 1"], ["NCR 9"], ["NCR 1"]]
@@ -0,0 +1,120 @@
+import random
+
+import pytest
+
+import Qtablewidget_with_filters_sub_tables as table_module
+
+STATUSES = ["Open", "Closed", "Hold", ""]
+PARTS = ["A", "B", "C"]
+QUANTITIES = ["1", "2", "3", ""]
+COLUMN_VALUES = [STATUSES, PARTS, QUANTITIES]
+
+
+@pytest.fixture
+def table(load_records):
+    generator = random.Random(0)
+    records = [([f"WO{row}"] + [generator.choice(values) for values in COLUMN_VALUES], None) for row in range(60)]
+    table = load_records(["Work Order", "Status", "Part", "Qty"], records, key_column=0)
+    # make every count table up front so each one is kept up to date incrementally from here on
+    for column in range(table.columnCount()):
+        table.filter_engine.value_counts(column)
+    return table
+
+
+def hidden_parent_rows(table):
+    return {row for row in range(0, table.rowCount(), 2) if table.isRowHidden(row)}
+
+
+# the incremental hidden rows and count tables have to match an engine that works everything out from scratch
+def check_against_full_recompute(table):
+    engine = table.filter_engine
+    fresh = table_module.FilterEngine(table.value_index, table.quick_search)
+    fresh.excluded_values = {column: set(values) for column, values in engine.excluded_values.items()}
+    fresh.hidden_blank_columns = set(engine.hidden_blank_columns)
+    fresh.update()
+
+    assert engine.hidden_rows == fresh.hidden_rows == fresh.compute_hidden_rows()
+    assert hidden_parent_rows(table) == engine.hidden_rows
+    assert set(engine.column_counts) == set(range(table.columnCount()))
+    for column in range(table.columnCount()):
+        assert engine.value_counts(column) == fresh.value_counts(column), column
+
+
+def toggle_value(table, generator):
+    column = generator.randrange(1, 4)
+    value = generator.choice(COLUMN_VALUES[column - 1])
+    engine = table.filter_engine
+    if value == "":
+        engine.set_blanks_hidden(column, column not in engine.hidden_blank_columns)
+    else:
+        engine.set_value_excluded(column, value, not engine.is_value_excluded(column, value))
+    table.apply_filters()
+
+
+def include_all(table, generator):
+    table.filter_engine.include_all(generator.randrange(1, 4))
+    table.apply_filters()
+
+
+def edit_cell(table, generator):
+    row = generator.randrange(0, table.rowCount(), 2)
+    column = generator.randrange(1, 4)
+    table.item(row, column).setText(generator.choice(COLUMN_VALUES[column - 1]))
+    table.apply_filters()
+
+
+def update_row(table, generator):
+    row = generator.randrange(0, table.rowCount(), 2)
+    table.apply_row_deltas(upserts=[(f"WO{row // 2}", [f"WO{row // 2}"] + [generator.choice(values)
+                                                                             for values in COLUMN_VALUES], None)])
+
+
+def search(table, generator):
+    table.set_quick_search(generator.choice(["", "", "open", "b", "wo1"]))
+
+
+OPERATIONS = [toggle_value, include_all, edit_cell, update_row, search]
+
+
+def test_filters_combine_and_clear(table):
+    parents = range(0, table.rowCount(), 2)
+    open_rows = {row for row in parents if table.item(row, 1).text() == "Open"}
+    part_a_rows = {row for row in parents if table.item(row, 2).text() == "A"}
+    assert open_rows - part_a_rows and part_a_rows - open_rows and open_rows & part_a_rows
+
+    engine = table.filter_engine
+    engine.set_value_excluded(1, "Open", True)
+    engine.set_value_excluded(2, "A", True)
+    table.apply_filters()
+    assert hidden_parent_rows(table) == open_rows | part_a_rows
+    check_against_full_recompute(table)
+
+    # rows both filters hid stay hidden by the one that's left
+    engine.include_all(1)
+    table.apply_filters()
+    assert hidden_parent_rows(table) == part_a_rows
+    assert not any(table.isRowHidden(row) for row in open_rows - part_a_rows)
+    check_against_full_recompute(table)
+
+
+def test_edits_in_a_filtered_column_move_their_counts(table):
+    engine = table.filter_engine
+    engine.set_value_excluded(1, "Open", True)
+    table.apply_filters()
+    row = next(row for row in range(0, table.rowCount(), 2) if table.item(row, 1).text() == "Open")
+
+    # the row stays hidden until the filters are applied again, but its count moves to the new value straight away
+    table.item(row, 1).setText("Closed")
+    assert engine.value_counts(1).get("Closed") == \
+        sum(table.item(other, 1).text() == "Closed" for other in range(0, table.rowCount(), 2))
+    table.apply_filters()
+    check_against_full_recompute(table)
+    assert row not in engine.hidden_rows
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_random_filters_edits_and_updates(table, seed):
+    generator = random.Random(seed)
+    for _ in range(40):
+        generator.choice(OPERATIONS)(table, generator)
+        check_against_full_recompute(table)
@@ -0,0 +1,33 @@
+def shown_parent_rows(table):
+    return [row for row in range(0, table.rowCount(), 2) if not table.isRowHidden(row)]
+
+
+def test_search_hides_rows_and_closes_their_sub_tables(load_table):
+    table = load_table(rows=30, columns=3)
+    table.main_table_vertical_header_clicked(4)
+
+    table.set_quick_search("row 1 ")
+
+    assert shown_parent_rows(table) == [2]
+    assert 4 not in table.sub_table_widgets
+    assert table.isRowHidden(5)
+
+    table.set_quick_search("")
+
+    assert shown_parent_rows(table) == list(range(0, 60, 2))
+    # the closed sub table row stays closed with a "+" to open it again
+    assert table.isRowHidden(5)
+    assert table.verticalHeaderItem(4).text() == "+"
+    assert table.updatesEnabled()
+
+
+def test_search_keeps_open_sub_tables_of_rows_still_shown(app, load_table):
+    table = load_table(rows=30, columns=3)
+    table.main_table_vertical_header_clicked(2)
+    app.processEvents()
+
+    table.set_quick_search("row 1")
+
+    assert 2 in table.sub_table_widgets
+    assert not table.isRowHidden(3)
+    assert table.sub_table_widgets[2].geometry().y() == table.rowViewportPosition(3)
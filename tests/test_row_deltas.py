@@ -0,0 +1,97 @@
+import random
+
+import pytest
+from PyQt5.QtCore import Qt
+
+import Qtablewidget_with_filters_sub_tables as table_module
+
+STATUSES = ["Open", "Closed", "Hold", ""]
+PARTS = ["A", "B", "C"]
+QUANTITIES = ["1", "2", "10", ""]
+HEADERS = ["Work Order", "Status", "Part", "Qty"]
+
+
+def random_row(generator, key):
+    return [key, generator.choice(STATUSES), generator.choice(PARTS), generator.choice(QUANTITIES)]
+
+
+def set_filters(table):
+    table.filter_engine.set_value_excluded(1, "Hold", True)
+    table.filter_engine.set_blanks_hidden(3, True)
+    table.apply_filters()
+
+
+def shown_keys(table):
+    vertical_header = table.verticalHeader()
+    rows = (vertical_header.logicalIndex(visual_row) for visual_row in range(0, table.rowCount(), 2))
+    return [table.item(row, 0).text() for row in rows if not table.isRowHidden(row)]
+
+
+def hidden_keys(table):
+    return {table.item(row, 0).text() for row in range(0, table.rowCount(), 2)
+            if row not in table.deleted_rows and table.isRowHidden(row)}
+
+
+def header_counts(table):
+    return [(sorted(table.filter_values(column)), table.filter_value_counts(column))
+            for column in range(table.columnCount())]
+
+
+# a table patched with deltas has to look the same as one loaded from scratch with the same rows, sort and filters
+def check_against_reload(table, rows, sort_spec, load_records):
+    reloaded = load_records(HEADERS, [(list(row_data), None) for row_data in rows.values()], key_column=0)
+    reloaded.set_column_sort_type(3, table.sort_keys.column_type(3))
+    set_filters(reloaded)
+    reloaded.set_sort_spec(sort_spec)
+
+    assert shown_keys(table) == shown_keys(reloaded)
+    assert hidden_keys(table) == hidden_keys(reloaded)
+    assert header_counts(table) == header_counts(reloaded)
+
+
+# the work order column breaks every tie, so both tables have one right order
+@pytest.mark.parametrize("sort_spec", [[(1, Qt.DescendingOrder), (0, Qt.AscendingOrder)],
+                                       [(3, Qt.AscendingOrder), (0, Qt.DescendingOrder)],
+                                       [(0, Qt.DescendingOrder)]])
+@pytest.mark.parametrize("seed", range(4))
+def test_deltas_match_a_full_reload(load_records, sort_spec, seed):
+    generator = random.Random(seed)
+    rows = {f"WO{number}": random_row(generator, f"WO{number}") for number in range(40)}
+    table = load_records(HEADERS, [(list(row_data), None) for row_data in rows.values()], key_column=0)
+    table.set_column_sort_type(3, table_module.SORT_NUMERIC)
+    set_filters(table)
+    table.set_sort_spec(sort_spec)
+    for column in range(table.columnCount()):
+        table.filter_value_counts(column)
+
+    next_number = 40
+    for _ in range(6):
+        upserts = []
+        for key in generator.sample(sorted(rows), 5):
+            rows[key] = random_row(generator, key)
+            upserts.append((key, list(rows[key]), None))
+        for _ in range(generator.randrange(4)):
+            key = f"WO{next_number}"
+            next_number += 1
+            rows[key] = random_row(generator, key)
+            upserts.append((key, list(rows[key]), None))
+        deletes = generator.sample(sorted(rows), generator.randrange(4))
+        for key in deletes:
+            del rows[key]
+
+        table.apply_row_deltas(upserts, deletes)
+        check_against_reload(table, rows, sort_spec, load_records)
+
+
+def test_inserted_row_goes_to_its_sort_position_and_is_filtered(load_records):
+    rows = [["WO1", "Open", "A", "1"], ["WO2", "Closed", "B", "2"], ["WO3", "Open", "C", "3"]]
+    table = load_records(HEADERS, [(row_data, None) for row_data in rows], key_column=0)
+    set_filters(table)
+    table.set_sort_spec([(0, Qt.DescendingOrder)])
+
+    table.apply_row_deltas([("WO25", ["WO25", "Open", "B", "5"], None), ("WO0", ["WO0", "Hold", "A", "1"], None)],
+                           ["WO2"])
+
+    assert shown_keys(table) == ["WO25", "WO3", "WO1"]
+    assert hidden_keys(table) == {"WO0"}
+    assert table.filter_value_counts(1) == {"Open": 3, "Hold": 1}
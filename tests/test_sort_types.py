@@ -0,0 +1,65 @@
+from PyQt5.QtCore import QEventLoop, Qt
+
+import Qtablewidget_with_filters_sub_tables as table_module
+
+
+def load(table, path):
+    loop = QEventLoop()
+    if isinstance(table, table_module.CustomTableWidget):
+        table.loadFinished.connect(loop.quit)
+    importer = table_module.TableImporter(path)
+    importer.load_into(table)
+    if isinstance(table, table_module.CustomTableWidget) and table.is_loading():
+        loop.exec_()
+
+
+def write_csv(path, text):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        file.write(text)
+    return str(path)
+
+
+def test_sort_types_are_reset_for_new_columns(app, tmp_path):
+    numbers = write_csv(tmp_path / "numbers.csv", "Qty,Due\n1,01/02/2024\n20,03/04/2024\n")
+    text = write_csv(tmp_path / "text.csv", "Part,Note\nA 10,x\nA 9,y\n")
+
+    for table in (table_module.CustomTableWidget(), table_module.CustomTableView()):
+        load(table, numbers)
+        assert table.sort_keys.column_type(0) == table_module.SORT_NUMERIC
+        assert table.sort_keys.column_type(1) == table_module.SORT_DATE
+
+        load(table, text)
+        assert table.sort_keys.column_type(0) == table_module.SORT_NATURAL
+        assert table.sort_keys.column_type(1) == table_module.SORT_NATURAL
+
+
+def test_aggregate_sort_types_follow_the_aggregates(app):
+    table = table_module.CustomTableView()
+    table.set_sub_table_aggregates([table_module.SubTableAggregate("NCRs", table_module.AGGREGATE_COUNT)])
+    table.set_table_data(["Work Order"], [["WO1"]], [[["NCR 1"]]])
+    assert table.sort_keys.column_type(1) == table_module.SORT_NUMERIC
+
+    table.set_sub_table_aggregates([])
+    table.set_table_data(["Work Order", "Part"], [["WO1", "A 10"]], [[]])
+    assert table.sort_keys.column_type(1) == table_module.SORT_NATURAL
+
+
+def test_dates_with_and_without_utc_offsets_sort_together(app):
+    table = table_module.CustomTableView()
+    table.set_table_data(["Due"], [["2024-01-02T10:00:00+02:00"], ["2024-01-02T09:00:00"], ["2024-01-02T07:30:00Z"],
+                                   ["01/01/2024"], [""]])
+    table.set_column_sort_type(0, table_module.SORT_DATE)
+
+    assert table.sort_rows(table.parent_rows(), 0) == [3, 2, 0, 1, 4]
+
+
+def test_blanks_and_bad_values_sort_last_in_both_directions(app):
+    table = table_module.CustomTableView()
+    table.set_table_data(["Qty", "Part"], [["10", "A"], [""], ["abc", "A"], ["2", "B"], ["x", "B"], ["30", "A"]])
+    table.set_column_sort_type(0, table_module.SORT_NUMERIC)
+    rows = table.parent_rows()
+
+    assert table.sort_rows(rows, 0) == [3, 0, 5, 2, 4, 1]
+    assert table.sort_rows(rows, 0, reverse=True) == [5, 0, 3, 4, 2, 1]
+    assert table.sort_rows_by_spec(rows, [(1, Qt.AscendingOrder), (0, Qt.DescendingOrder)]) == [5, 0, 2, 3, 4, 1]
+    assert table.sort_rows_by_spec(rows, [(1, Qt.DescendingOrder), (0, Qt.DescendingOrder)]) == [3, 4, 5, 0, 2, 1]
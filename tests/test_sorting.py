@@ -0,0 +1,60 @@
+import random
+
+from PyQt5.QtCore import Qt
+
+
+def visual_rows(table):
+    vertical_header = table.verticalHeader()
+    return [vertical_header.logicalIndex(visual_row) for visual_row in range(table.rowCount())]
+
+
+def test_sort_moves_parent_rows_with_their_sub_table_rows(load_table):
+    table = load_table(rows=50, columns=3)
+    table.main_table_vertical_header_clicked(4)
+    table.setRowHeight(10, 40)
+    table.filter_engine.set_value_excluded(1, "Row 3 Col 1", True)
+    table.apply_filters()
+
+    table.set_sort_spec([(0, Qt.DescendingOrder)])
+
+    order = visual_rows(table)
+    parents = order[0::2]
+    assert [table.item(row, 0).text() for row in parents] == \
+        sorted((f"Row {row} Col 0" for row in range(50)), key=lambda text: int(text.split()[1]), reverse=True)
+    assert order[1::2] == [row + 1 for row in parents]
+    # rows keep their hidden state, sizes and open sub tables
+    assert table.isRowHidden(6)
+    assert not table.isRowHidden(5)
+    assert table.rowHeight(10) == 40
+    assert table.sub_table_widgets[4].geometry().y() == table.rowViewportPosition(5)
+
+
+def test_deleted_rows_stay_at_the_end_when_sorted(load_table):
+    table = load_table(rows=20, columns=3)
+    table.apply_row_deltas(deletes=[8])
+
+    table.set_sort_spec([(0, Qt.DescendingOrder)])
+
+    order = visual_rows(table)
+    assert order[-2:] == [8, 9]
+    assert 8 not in order[:-2]
+
+
+def test_row_order_keeps_each_rows_size_and_hidden_state(load_table):
+    table = load_table(rows=40, columns=3)
+    for row in range(0, 80, 2):
+        table.setRowHeight(row, 30 + row)
+    table.filter_engine.set_value_excluded(1, "Row 5 Col 1", True)
+    table.filter_engine.set_value_excluded(1, "Row 12 Col 1", True)
+    table.apply_filters()
+    hidden = [table.isRowHidden(row) for row in range(80)]
+    heights = [table.rowHeight(row) for row in range(80)]
+
+    for seed in range(5):
+        parents = list(range(0, 80, 2))
+        random.Random(seed).shuffle(parents)
+        table.apply_row_order(parents)
+
+        assert visual_rows(table) == [row for parent in parents for row in (parent, parent + 1)]
+        assert [table.isRowHidden(row) for row in range(80)] == hidden
+        assert [table.rowHeight(row) for row in range(80)] == heights
@@ -0,0 +1,207 @@
+import sqlite3
+
+import pytest
+from PyQt5.QtCore import Qt
+
+import Qtablewidget_with_filters_sub_tables as table_module
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "orders.db")
+    connection = sqlite3.connect(path)
+    # qty has no declared type and holds REALs, price is REAL, status is TEXT
+    connection.execute("CREATE TABLE orders (order_no TEXT, status TEXT, qty, price REAL, done INTEGER)")
+    connection.executemany("INSERT INTO orders VALUES (?, ?, ?, ?, ?)", [
+        ("WO1", "Open", 1.5, 10.25, 0),
+        ("WO2", "Closed", 2, 3.5, 1),
+        ("WO3", None, 1.5, None, 0),
+        ("WO4", "", 10, 99.0, 1),
+        ("WO5", "Open", None, 0.5, 0),
+    ])
+    connection.execute("CREATE TABLE ncrs (order_no TEXT, ncr TEXT)")
+    connection.executemany("INSERT INTO ncrs VALUES (?, ?)", [("WO1", "NCR 1"), ("WO1", "NCR 2"), ("WO4", "NCR 3")])
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def make_source(connection, **kwargs):
+    return table_module.SqliteTableSource(connection, "orders", ["order_no", "status", "qty", "price", "done"],
+                                          checkbox_columns={4}, sub_table="ncrs", sub_table_key="order_no",
+                                          sub_table_columns=["ncr"], key_column="order_no", **kwargs)
+
+
+def make_table(source):
+    table = table_module.CustomTableWidget()
+    table.set_data_source(source)
+    return table
+
+
+# order numbers of the rows in the table, in the order they're shown
+def shown_orders(table):
+    vertical_header = table.verticalHeader()
+    rows = []
+    for visual_row in range(0, table.rowCount(), 2):
+        row = vertical_header.logicalIndex(visual_row)
+        if not table.isRowHidden(row):
+            rows.append(table.item(row, 0).text())
+    return rows
+
+
+def test_cells_come_back_as_text(app, database):
+    table = make_table(make_source(database))
+
+    assert table.sub_table_rows(0) == [["NCR 1"], ["NCR 2"]]
+    assert [table.item(0, column).text() for column in range(4)] == ["WO1", "Open", "1.5", "10.25"]
+    assert table.item(0, 4).checkState() == Qt.Unchecked
+    assert table.item(8, 2).text() == ""
+
+
+def test_excluded_value_hides_rows_but_not_blanks(app, database):
+    table = make_table(make_source(database))
+
+    table.filter_engine.set_value_excluded(1, "Open", True)
+    table.apply_filters()
+
+    assert shown_orders(table) == ["WO2", "WO3", "WO4"]
+
+
+def test_hidden_blanks_cover_null_and_empty_text(app, database):
+    table = make_table(make_source(database))
+
+    table.filter_engine.set_blanks_hidden(1, True)
+    table.apply_filters()
+
+    assert shown_orders(table) == ["WO1", "WO2", "WO5"]
+
+
+def test_excluded_value_of_untyped_real_column(app, database):
+    source = make_source(database)
+    table = make_table(source)
+    assert "1.5" in source.distinct_values(2)
+
+    table.filter_engine.set_value_excluded(2, "1.5", True)
+    table.apply_filters()
+
+    assert shown_orders(table) == ["WO2", "WO4", "WO5"]
+
+
+def test_excluded_value_of_real_column(app, database):
+    source = make_source(database)
+    table = make_table(source)
+    assert source.distinct_values(3) == ["0.5", "10.25", "3.5", "99.0"]
+
+    table.filter_engine.set_value_excluded(3, "99.0", True)
+    table.filter_engine.set_value_excluded(3, "0.5", True)
+    table.apply_filters()
+
+    assert shown_orders(table) == ["WO1", "WO2", "WO3"]
+
+
+def test_value_counts_match_the_filter_text(app, database):
+    source = make_source(database)
+    table = make_table(source)
+
+    assert source.value_counts(2, table.filter_engine) == {"1.5": 2, "2": 1, "10": 1, "": 1}
+    table.filter_engine.set_value_excluded(1, "Open", True)
+    assert source.value_counts(2, table.filter_engine) == {"1.5": 1, "2": 1, "10": 1}
+
+
+def test_many_excluded_values(app, database):
+    table = make_table(make_source(database))
+
+    for number in range(table_module.SQLITE_IN_PARAMS + 10):
+        table.filter_engine.set_value_excluded(0, f"WO{number}", True)
+    table.apply_filters()
+
+    assert shown_orders(table) == []
+
+
+@pytest.mark.parametrize("order, expected", [
+    (Qt.AscendingOrder, ["WO5", "WO2", "WO1", "WO4", "WO3"]),
+    (Qt.DescendingOrder, ["WO4", "WO1", "WO2", "WO5", "WO3"]),
+])
+def test_sort_puts_blanks_last(app, database, order, expected):
+    table = make_table(make_source(database))
+
+    table.set_sort_spec([(3, order)])
+
+    assert shown_orders(table) == expected
+
+
+def test_text_sort_puts_null_and_empty_blanks_last(app, database):
+    table = make_table(make_source(database))
+
+    table.set_sort_spec([(1, Qt.AscendingOrder), (0, Qt.DescendingOrder)])
+
+    assert shown_orders(table)[:3] == ["WO2", "WO5", "WO1"]
+    assert sorted(shown_orders(table)[3:]) == ["WO3", "WO4"]
+
+
+def test_numeric_sort_of_text_column(app, database):
+    database.execute("CREATE TABLE parts (part TEXT, length TEXT)")
+    database.executemany("INSERT INTO parts VALUES (?, ?)", [("A", "10"), ("B", "9"), ("C", ""), ("D", "100")])
+    source = table_module.SqliteTableSource(database, "parts", ["part", "length"])
+    table = make_table(source)
+    table.set_column_sort_type(1, table_module.SORT_NUMERIC)
+
+    table.set_sort_spec([(1, Qt.AscendingOrder)])
+
+    assert shown_orders(table) == ["B", "A", "D", "C"]
+
+
+def test_sorted_query_reads_the_index_in_order(app, database):
+    source = make_source(database)
+    table = make_table(source)
+    table.set_sort_spec([(1, Qt.DescendingOrder)])
+
+    plan = [detail for *_, detail in database.execute(
+        f"EXPLAIN QUERY PLAN SELECT * FROM orders WHERE {source.not_blank_sql(1)}"
+        f"{source.order_sql(table.sort_spec, table.sort_keys, blanks=False)}")]
+
+    assert not any("TEMP B-TREE" in detail for detail in plan)
+    assert any("orders_status_sort_idx" in detail for detail in plan)
+
+
+def test_no_indexes_made_when_turned_off(app, database):
+    table = make_table(make_source(database, create_indexes=False))
+
+    table.set_sort_spec([(1, Qt.AscendingOrder)])
+
+    assert database.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index'").fetchone() == (0,)
+    assert shown_orders(table)[:3] == ["WO2", "WO1", "WO5"]
+
+
+def test_rows_are_fetched_a_page_at_a_time(app, database):
+    database.executemany("INSERT INTO orders VALUES (?, ?, ?, ?, ?)",
+                         [(f"WX{number:03d}", "Open", number, number, 0) for number in range(20)])
+    table = make_table(make_source(database, page_size=10))
+    table.set_sort_spec([(3, Qt.AscendingOrder)])
+
+    assert table.rowCount() == 20
+    table.fetch_source_rows()
+    assert table.rowCount() == 40
+    table.fetch_source_rows()
+    table.fetch_source_rows()
+    assert table.rowCount() == 50
+    assert table.source_cursor is None
+
+    orders = shown_orders(table)
+    assert len(orders) == 25 and len(set(orders)) == 25
+    assert orders[-1] == "WO3"
+
+
+def test_export_is_in_the_same_order_as_the_table(app, database, tmp_path):
+    table = make_table(make_source(database))
+    table.set_sort_spec([(1, Qt.AscendingOrder), (0, Qt.DescendingOrder)])
+    table.filter_engine.set_value_excluded(3, "3.5", True)
+    table.apply_filters()
+
+    path = str(tmp_path / "orders.csv")
+    exporter = table.export_rows(path)
+    exporter.wait()
+
+    with open(path, newline="", encoding="utf-8") as file:
+        exported = [line.split(",")[0] for line in file.read().splitlines()[1:]]
+    assert exported == shown_orders(table)
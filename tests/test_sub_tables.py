@@ -0,0 +1,25 @@
+def test_sub_table_stays_over_its_row_when_scrolled_sideways(app, load_table):
+    table = load_table()
+    table.main_table_vertical_header_clicked(0)
+    widget = table.sub_table_widgets[0]
+    # let the table lay itself out first, so the scroll is the only thing that moves the sub table
+    app.processEvents()
+
+    scroll_bar = table.horizontalScrollBar()
+    assert scroll_bar.maximum() > 0
+    scroll_bar.setValue(scroll_bar.maximum())
+
+    assert widget.geometry().x() == 0
+    assert widget.geometry().width() == table.viewport().width()
+    assert widget.geometry().y() == table.rowViewportPosition(1)
+
+
+def test_sub_table_follows_its_row_when_scrolled_down(app, load_table):
+    table = load_table(rows=200, columns=3)
+    table.main_table_vertical_header_clicked(0)
+    widget = table.sub_table_widgets[0]
+
+    table.verticalScrollBar().setValue(2)
+    app.processEvents()
+
+    assert widget.geometry().y() == table.rowViewportPosition(1)
@@ -0,0 +1,11 @@
+import Qtablewidget_with_filters_sub_tables as table_module
+
+
+def test_view_takes_values_that_arent_text(app):
+    table = table_module.CustomTableView()
+    table.set_table_data(["Work Order", "Qty", "Done"], [["WO1", 3, 1], ["WO2", None, 0], ["WO3", 2.5, True]],
+                         checkbox_columns={2})
+
+    assert table.table_model.columns[1] == ["3", "", "2.5"]
+    assert sorted(table.filter_values(1)) == ["2.5", "3"]
+    assert table.table_model.columns[2] == [False, False, True]
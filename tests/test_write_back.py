@@ -0,0 +1,110 @@
+import sqlite3
+import time
+
+import pytest
+
+import Qtablewidget_with_filters_sub_tables as table_module
+
+
+class RecordingSink:
+    def __init__(self):
+        self.batches = []
+
+    def write(self, edits):
+        self.batches.append(list(edits))
+
+
+# run the event loop until the queued signals from the writer thread have come in
+def wait_for(app, condition, timeout: float = 5.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        app.processEvents()
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "orders.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE orders (order_no TEXT PRIMARY KEY, status TEXT, done INTEGER)")
+    connection.executemany("INSERT INTO orders VALUES (?, ?, ?)", [("WO1", "Open", 0), ("WO2", "Open", 0)])
+    connection.execute("CREATE TABLE ncrs (order_no TEXT, ncr TEXT, disposition TEXT)")
+    connection.executemany("INSERT INTO ncrs VALUES (?, ?, ?)",
+                           [("WO1", "NCR 1", "Open"), ("WO1", "NCR 2", "Open"), ("WO2", "NCR 3", "Open")])
+    connection.commit()
+    yield path, connection
+    connection.close()
+
+
+def make_sink(path):
+    return table_module.SqliteWriteBackSink(path, "orders", ["order_no", "status", "done"], key_column="order_no",
+                                            checkbox_columns={2}, sub_table="ncrs", sub_table_key="order_no",
+                                            sub_table_columns=["ncr", "disposition"])
+
+
+def test_edits_to_the_same_cell_are_coalesced(app):
+    sink = RecordingSink()
+    write_back = table_module.WriteBackQueue(sink, interval=60000)
+    write_back.record("WO1", 1, "Closed")
+    write_back.record("WO1", 1, "Scrap")
+    write_back.record("WO1", 2, True)
+    write_back.record("WO1", 1, "Rework", sub_row=0)
+    write_back.record("WO1", 1, "Done")
+    assert write_back.pending_count() == 3
+
+    write_back.close(5)
+
+    assert len(sink.batches) == 1
+    assert sorted(sink.batches[0], key=repr) == sorted([("WO1", None, 1, "Done"), ("WO1", None, 2, True),
+                                                        ("WO1", 0, 1, "Rework")], key=repr)
+
+
+def test_batch_is_written_in_one_transaction(database):
+    path, connection = database
+    sink = make_sink(path)
+    sink.write([("WO1", None, 1, "Closed")])
+    statements = []
+    sink.connection.set_trace_callback(statements.append)
+
+    sink.write([("WO1", None, 1, "Scrap"), ("WO2", None, 2, "True"), ("WO1", 1, 1, "Use As Is")])
+
+    assert sum(statement.startswith("BEGIN") for statement in statements) == 1
+    assert sum(statement.startswith("COMMIT") for statement in statements) == 1
+    assert connection.execute("SELECT order_no, status, done FROM orders ORDER BY order_no").fetchall() == \
+        [("WO1", "Scrap", 0), ("WO2", "Open", 1)]
+    assert connection.execute("SELECT disposition FROM ncrs ORDER BY rowid").fetchall() == \
+        [("Open",), ("Use As Is",), ("Open",)]
+
+
+def test_failed_batch_is_rolled_back_reported_and_written_later(app, database):
+    path, connection = database
+    connection.execute("CREATE TRIGGER no_scrap BEFORE UPDATE ON orders WHEN NEW.status = 'Scrap' "
+                       "BEGIN SELECT RAISE(ABORT, 'scrap needs sign off'); END")
+    connection.commit()
+
+    write_back = table_module.WriteBackQueue(make_sink(path), interval=60000, retries=1, retry_delay=0.01)
+    flushed = []
+    failed = []
+    write_back.flushed.connect(flushed.append)
+    write_back.failed.connect(lambda count, message: failed.append((count, message)))
+
+    write_back.record("WO1", 2, True)
+    write_back.record("WO2", 1, "Scrap")
+    write_back.flush()
+
+    assert wait_for(app, lambda: failed)
+    assert failed == [(2, "scrap needs sign off")]
+    # neither edit is in the database, the whole batch was rolled back
+    assert connection.execute("SELECT order_no, status, done FROM orders ORDER BY order_no").fetchall() == \
+        [("WO1", "Open", 0), ("WO2", "Open", 0)]
+
+    connection.execute("DROP TRIGGER no_scrap")
+    connection.commit()
+    write_back.record("WO1", 1, "Closed")
+    write_back.close(5)
+
+    assert wait_for(app, lambda: flushed)
+    assert flushed == [3]
+    assert connection.execute("SELECT order_no, status, done FROM orders ORDER BY order_no").fetchall() == \
+        [("WO1", "Closed", 1), ("WO2", "Scrap", 0)]